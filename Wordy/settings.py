@@ -166,10 +166,140 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# Embedding and chat requests to OpenAI share one pooled HTTP client per
+# process: at most OPENAI_HTTP_MAX_CONNECTIONS connections, of which up to
+# OPENAI_HTTP_MAX_KEEPALIVE idle ones are kept open for
+# OPENAI_HTTP_KEEPALIVE_SECONDS. Timeouts are in seconds; OPENAI_HTTP2
+# needs the h2 package.
+OPENAI_HTTP_MAX_CONNECTIONS = int(os.getenv('OPENAI_HTTP_MAX_CONNECTIONS', '20'))
+OPENAI_HTTP_MAX_KEEPALIVE = int(os.getenv('OPENAI_HTTP_MAX_KEEPALIVE', '10'))
+OPENAI_HTTP_KEEPALIVE_SECONDS = float(os.getenv('OPENAI_HTTP_KEEPALIVE_SECONDS', '30'))
+OPENAI_HTTP_CONNECT_TIMEOUT = float(os.getenv('OPENAI_HTTP_CONNECT_TIMEOUT', '5'))
+OPENAI_HTTP_POOL_TIMEOUT = float(os.getenv('OPENAI_HTTP_POOL_TIMEOUT', '10'))
+OPENAI_HTTP_TIMEOUT = float(os.getenv('OPENAI_HTTP_TIMEOUT', '60'))
+OPENAI_EMBEDDING_TIMEOUT = float(os.getenv('OPENAI_EMBEDDING_TIMEOUT', '60'))
+OPENAI_CHAT_TIMEOUT = float(os.getenv('OPENAI_CHAT_TIMEOUT', '120'))
+OPENAI_HTTP2 = os.getenv('OPENAI_HTTP2', 'false').lower() == 'true'
+
+# Embedding provider: 'openai', 'local' (scikit-learn on the CPU, works
+# offline) or a dotted path to an EmbeddingProvider subclass. RAG_EMBEDDING_MODEL
+# defaults to the provider's own model.
+RAG_EMBEDDING_PROVIDER = os.getenv('RAG_EMBEDDING_PROVIDER', 'openai')
+RAG_EMBEDDING_MODEL = os.getenv('RAG_EMBEDDING_MODEL') or None
+
+# Embedding dimensions requested from the provider (None for the model's
+# native size). text-embedding-3 models can be shortened to e.g. 256 or 512,
+# cutting storage and scan time proportionally. After changing this, run
+# 'manage.py reembed_documents --truncate' to shorten existing embeddings.
+RAG_EMBEDDING_DIMENSIONS = int(os.getenv('RAG_EMBEDDING_DIMENSIONS', '0')) or None
+
+# Large embedding requests are split into sub-batches that respect the
+# provider's per-request input and token limits; up to RAG_EMBEDDING_CONCURRENCY
+# of them are in flight at once, each retried with exponential backoff on
+# rate limits and transient errors.
+RAG_EMBEDDING_CONCURRENCY = int(os.getenv('RAG_EMBEDDING_CONCURRENCY', '4'))
+RAG_EMBEDDING_MAX_RETRIES = int(os.getenv('RAG_EMBEDDING_MAX_RETRIES', '6'))
+
+# Uploads are queued and processed by 'manage.py run_ingestion_worker'. A job
+# whose worker stops heartbeating for RAG_INGESTION_LEASE_SECONDS is retried,
+# up to RAG_INGESTION_MAX_ATTEMPTS attempts in total. Each worker thread takes
+# up to RAG_INGESTION_BATCH_SIZE queued jobs at once, extracting their files in
+# parallel and embedding their chunks in shared batches.
+RAG_INGESTION_WORKER_THREADS = int(os.getenv('RAG_INGESTION_WORKER_THREADS', '2'))
+RAG_INGESTION_BATCH_SIZE = int(os.getenv('RAG_INGESTION_BATCH_SIZE', '16'))
+RAG_INGESTION_LEASE_SECONDS = int(os.getenv('RAG_INGESTION_LEASE_SECONDS', '600'))
+RAG_INGESTION_MAX_ATTEMPTS = int(os.getenv('RAG_INGESTION_MAX_ATTEMPTS', '3'))
+
+# PDFs of at least RAG_PDF_PARALLEL_MIN_PAGES pages are extracted by
+# RAG_PDF_EXTRACT_WORKERS processes (defaults to one per core)
+RAG_PDF_EXTRACT_WORKERS = int(os.getenv('RAG_PDF_EXTRACT_WORKERS', '0')) or None
+RAG_PDF_PARALLEL_MIN_PAGES = int(os.getenv('RAG_PDF_PARALLEL_MIN_PAGES', '64'))
+
+# Bulk uploads take up to RAG_BULK_UPLOAD_MAX_FILES files (counting the members
+# of zip archives) and RAG_BULK_UPLOAD_MAX_BYTES of uncompressed archive
+# content; their files are extracted by RAG_BULK_EXTRACT_WORKERS processes
+# (defaults to one per core)
+RAG_BULK_UPLOAD_MAX_FILES = int(os.getenv('RAG_BULK_UPLOAD_MAX_FILES', '500'))
+RAG_BULK_UPLOAD_MAX_BYTES = int(os.getenv('RAG_BULK_UPLOAD_MAX_BYTES', str(1024 ** 3)))
+RAG_BULK_EXTRACT_WORKERS = int(os.getenv('RAG_BULK_EXTRACT_WORKERS', '0')) or None
+DATA_UPLOAD_MAX_NUMBER_FILES = RAG_BULK_UPLOAD_MAX_FILES
+
+# 'manage.py sweep_storage' deletes session documents (those with a
+# session_id) not updated for RAG_SESSION_TTL_SECONDS, RAG_SWEEP_BATCH_SIZE
+# at a time, and upload files no document refers to once they are older than
+# RAG_UPLOAD_GC_GRACE_SECONDS
+RAG_SESSION_TTL_SECONDS = int(os.getenv('RAG_SESSION_TTL_SECONDS', str(24 * 3600)))
+RAG_SWEEP_BATCH_SIZE = int(os.getenv('RAG_SWEEP_BATCH_SIZE', '200'))
+RAG_UPLOAD_GC_GRACE_SECONDS = int(os.getenv('RAG_UPLOAD_GC_GRACE_SECONDS', '3600'))
+
+# Storage precision for chunk embeddings ('float32' or 'float16')
+RAG_EMBEDDING_STORAGE_DTYPE = os.getenv('RAG_EMBEDDING_STORAGE_DTYPE', 'float32')
+
+# Chunks are stored as character offsets into their document's text
+# ('offsets') or each with its own copy of its text ('content')
+RAG_CHUNK_STORAGE = os.getenv('RAG_CHUNK_STORAGE', 'offsets')
+
+# Number of retrieval scopes (template/session/document sets) whose vector
+# index is kept resident per process
+RAG_VECTOR_INDEX_CACHE_SIZE = int(os.getenv('RAG_VECTOR_INDEX_CACHE_SIZE', '32'))
+
+# Approximate (IVF) search for scopes with at least RAG_ANN_MIN_VECTORS chunks;
+# RAG_ANN_NPROBE trades recall for latency. Smaller scopes use exact search.
+RAG_ANN_ENABLED = os.getenv('RAG_ANN_ENABLED', 'true').lower() == 'true'
+RAG_ANN_MIN_VECTORS = int(os.getenv('RAG_ANN_MIN_VECTORS', '50000'))
+RAG_ANN_LISTS = int(os.getenv('RAG_ANN_LISTS', '0')) or None  # Defaults to sqrt(chunks)
+RAG_ANN_NPROBE = int(os.getenv('RAG_ANN_NPROBE', '8'))
+
+# Compressed resident vectors: 'none', 'int8' (4x smaller) or 'pq' (product
+# quantization, 16x smaller by default). Candidates are re-scored with their
+# float embeddings from the database; quantized scopes do not use IVF.
+RAG_INDEX_QUANTIZATION = os.getenv('RAG_INDEX_QUANTIZATION', 'none')
+RAG_INDEX_RERANK_FACTOR = int(os.getenv('RAG_INDEX_RERANK_FACTOR', '4'))
+RAG_PQ_SUBSPACES = int(os.getenv('RAG_PQ_SUBSPACES', '0')) or None  # Defaults to one per 4 dimensions
+
+# Hybrid retrieval: keyword (BM25 / tsvector) matches fused with vector
+# similarity. On scopes of at least RAG_LEXICAL_PREFILTER_MIN_CHUNKS chunks the
+# top RAG_LEXICAL_PREFILTER_CANDIDATES keyword matches are the only chunks
+# scored against the query embedding.
+RAG_LEXICAL_SEARCH_ENABLED = os.getenv('RAG_LEXICAL_SEARCH_ENABLED', 'true').lower() == 'true'
+RAG_HYBRID_CANDIDATE_FACTOR = int(os.getenv('RAG_HYBRID_CANDIDATE_FACTOR', '4'))
+RAG_LEXICAL_PREFILTER_MIN_CHUNKS = int(os.getenv('RAG_LEXICAL_PREFILTER_MIN_CHUNKS', '200000'))
+RAG_LEXICAL_PREFILTER_CANDIDATES = int(os.getenv('RAG_LEXICAL_PREFILTER_CANDIDATES', '2000'))
+
+# Persistent cache of chunk embeddings keyed by model and content hash
+RAG_EMBEDDING_CACHE_ENABLED = os.getenv('RAG_EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+RAG_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('RAG_EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
+
+# Query embeddings: an in-process LRU in front of a cache shared by all workers
+RAG_QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('RAG_QUERY_EMBEDDING_CACHE_SIZE', '1024'))
+RAG_QUERY_EMBEDDING_CACHE_TTL = int(os.getenv('RAG_QUERY_EMBEDDING_CACHE_TTL', str(7 * 24 * 3600)))
+RAG_QUERY_EMBEDDING_CACHE_ALIAS = 'embeddings'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'embeddings': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('RAG_EMBEDDING_CACHE_DIR', str(BASE_DIR / 'cache' / 'embeddings')),
+        'TIMEOUT': RAG_QUERY_EMBEDDING_CACHE_TTL,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('RAG_QUERY_EMBEDDING_CACHE_SHARED_SIZE', '50000')),
+        },
+    },
+}
+
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Persisted vector index structures
+RAG_VECTOR_INDEX_DIR = os.getenv('RAG_VECTOR_INDEX_DIR', str(MEDIA_ROOT / 'vector_indexes'))
+
+# Per-template embedding shards memory-mapped by every worker process
+RAG_VECTOR_SHARDS_ENABLED = os.getenv('RAG_VECTOR_SHARDS_ENABLED', 'true').lower() == 'true'
+RAG_VECTOR_SHARD_DIR = os.getenv('RAG_VECTOR_SHARD_DIR', str(MEDIA_ROOT / 'vector_shards'))
+
 # CORS Configuration for Office Add-in
 CORS_ALLOW_ALL_ORIGINS = DEBUG  # Only for development
 CORS_ALLOWED_ORIGINS = [
@@ -234,6 +364,16 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        'rag_pipeline.services.index_registry': {
+            'handlers': ['console'],
+            'level': 'DEBUG',
+            'propagate': False,
+        },
+        'rag_pipeline.services.vector_index': {
+            'handlers': ['console'],
+            'level': 'DEBUG',
+            'propagate': False,
+        },
         'rag_pipeline.services.text_chunker': {
             'handlers': ['console'],
             'level': 'DEBUG',
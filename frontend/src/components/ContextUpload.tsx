@@ -6,6 +6,21 @@ interface ContextUploadProps {
   sessionId?: string
 }
 
+interface UploadResult {
+  name: string
+  status: 'queued' | 'indexed'
+}
+
+// Uploads are queued and indexed by the ingestion worker
+// (`python manage.py run_ingestion_worker`); only re-uploads of an
+// already-indexed file come back indexed
+function uploadStatusMessage(result: UploadResult) {
+  if (result.status === 'indexed') {
+    return `Context document "${result.name}" uploaded and associated with template successfully!`
+  }
+  return `Context document "${result.name}" queued for indexing; it becomes searchable once the ingestion worker has processed it.`
+}
+
 export function ContextUpload({ onUploadSuccess, templateId, sessionId }: ContextUploadProps) {
   const [isUploading, setIsUploading] = useState(false)
   const [uploadMessage, setUploadMessage] = useState('')
@@ -38,7 +53,7 @@ export function ContextUpload({ onUploadSuccess, templateId, sessionId }: Contex
       }
 
       const result = await response.json()
-      setUploadMessage(`Context document "${result.name}" uploaded and associated with template successfully!`)
+      setUploadMessage(uploadStatusMessage(result))
       onUploadSuccess()
       
       // Clear message after 3 seconds
@@ -75,7 +90,7 @@ export function ContextUpload({ onUploadSuccess, templateId, sessionId }: Contex
       }
 
       const result = await response.json()
-      setUploadMessage(`Context document "${result.name}" uploaded and associated with template successfully!`)
+      setUploadMessage(uploadStatusMessage(result))
       onUploadSuccess()
       
       // Clear message after 3 seconds
@@ -1,23 +1,44 @@
 from django.contrib import admin
-from .models import Document, DocumentChunk
+from .models import Document, DocumentChunk, EmbeddingCacheEntry, IngestionJob
 
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('name', 'file_type', 'created_at', 'updated_at')
+    list_display = ('name', 'file_type', 'status', 'embedding_provider', 'embedding_model', 'created_at', 'updated_at')
     search_fields = ('name',)
-    list_filter = ('file_type', 'created_at')
-    readonly_fields = ('id', 'created_at', 'updated_at')
+    list_filter = ('file_type', 'status', 'embedding_provider', 'created_at')
+    readonly_fields = ('id', 'created_at', 'updated_at', 'embedding_provider', 'embedding_model', 'embedding_dimensions')
 
 
 @admin.register(DocumentChunk)
 class DocumentChunkAdmin(admin.ModelAdmin):
-    list_display = ('document', 'chunk_index', 'created_at', 'has_embedding')
+    list_display = ('document', 'chunk_index', 'embedding_model', 'embedding_dimensions', 'created_at', 'has_embedding')
     list_filter = ('created_at', 'document')
     search_fields = ('document__name', 'content')
-    readonly_fields = ('id', 'created_at')
+    readonly_fields = ('id', 'created_at', 'embedding_model', 'embedding_dimensions', 'embedding_dtype', 'embedding_norm')
+    exclude = ('embedding_data',)
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('embedding_data')
     
     def has_embedding(self, obj):
-        return obj.embedding is not None
+        return obj.embedding_dimensions is not None
     has_embedding.boolean = True
     has_embedding.short_description = 'Has Embedding'
+
+
+@admin.register(EmbeddingCacheEntry)
+class EmbeddingCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('content_hash', 'model', 'dimensions', 'hit_count', 'last_used_at', 'created_at')
+    list_filter = ('model', 'dimensions')
+    search_fields = ('content_hash',)
+    readonly_fields = ('created_at',)
+    exclude = ('embedding_data',)
+
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ('document', 'status', 'stage', 'progress_current', 'progress_total', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'stage')
+    search_fields = ('document__name', 'error')
+    readonly_fields = ('id', 'created_at', 'started_at', 'finished_at', 'heartbeat_at', 'worker')
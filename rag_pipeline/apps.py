@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RagPipelineConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag_pipeline'
+
+    def ready(self):
+        from . import signals  # noqa: F401
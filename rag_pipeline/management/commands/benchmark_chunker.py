@@ -0,0 +1,75 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_pipeline.models import Document
+from rag_pipeline.services.text_chunker import TextChunker, SEPARATORS
+from rag_pipeline.services.vector_index import RetrievalScope
+
+
+class Command(BaseCommand):
+    help = "Compare the output and throughput of the text chunker against langchain's RecursiveCharacterTextSplitter"
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help="Text files to chunk (defaults to the stored documents in scope)")
+        parser.add_argument('--template', default=None, help="Restrict to a template's documents")
+        parser.add_argument('--session', default=None, help="Restrict to a session's documents")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Chunk size in characters")
+        parser.add_argument('--chunk-overlap', type=int, default=200, help="Chunk overlap in characters")
+        parser.add_argument('--part-size', type=int, default=4000, help="Characters per part in streaming mode")
+        parser.add_argument('--repeat', type=int, default=3, help="Timed runs per splitter (the best is reported)")
+
+    def handle(self, *args, **options):
+        try:
+            from langchain_text_splitters import RecursiveCharacterTextSplitter
+        except ImportError:
+            raise CommandError("langchain-text-splitters is required for the comparison")
+
+        if options['files']:
+            texts = []
+            for path in options['files']:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    texts.append(f.read())
+        else:
+            scope = RetrievalScope.build(template_id=options['template'], session_id=options['session'])
+            texts = list(Document.objects.filter(**scope.document_filter()).values_list('content', flat=True))
+        texts = [text for text in texts if text]
+        if not texts:
+            raise CommandError("Nothing to chunk")
+
+        chunk_size, chunk_overlap = options['chunk_size'], options['chunk_overlap']
+        chunker = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len, separators=SEPARATORS
+        )
+        part_size = options['part_size']
+
+        def streamed(text):
+            parts = (text[i:i + part_size] for i in range(0, len(text), part_size))
+            return [content for _, _, content in chunker.iter_spans(parts)]
+
+        expected = [splitter.split_text(text) for text in texts]
+        characters = sum(len(text) for text in texts)
+        self.stdout.write(
+            f"{len(texts)} texts, {characters / 2 ** 20:.1f} MiB, {sum(len(chunks) for chunks in expected)} chunks"
+        )
+        self._report('langchain', splitter.split_text, texts, characters, options['repeat'])
+        self._report('native', lambda text: [content for _, _, content in chunker.iter_spans([text])],
+                     texts, characters, options['repeat'], expected)
+        self._report(f'native (streamed, {part_size} char parts)', streamed, texts, characters,
+                     options['repeat'], expected)
+
+    def _report(self, name, split, texts, characters, repeat, expected=None):
+        best = float('inf')
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            chunks = [split(text) for text in texts]
+            best = min(best, time.perf_counter() - start)
+        if expected is None:
+            agreement = ''
+        else:
+            differing = sum(1 for got, want in zip(chunks, expected) if got != want)
+            agreement = '  identical' if not differing else f"  DIFFERS on {differing} texts"
+        self.stdout.write(
+            f"{name:<36} {best * 1000:9.1f} ms  {characters / 2 ** 20 / max(best, 1e-9):8.1f} MiB/s{agreement}"
+        )
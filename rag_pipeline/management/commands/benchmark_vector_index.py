@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_pipeline.models import DocumentChunk
+from rag_pipeline.services.ann_index import IVFIndex
+from rag_pipeline.services.index_registry import load_chunk_vectors
+from rag_pipeline.services.quantization import QuantizedIndex
+from rag_pipeline.services.vector_index import VectorIndex, RetrievalScope, recall_at_k
+
+
+class Command(BaseCommand):
+    help = "Compare memory, latency and recall@k of the exact, quantized and IVF vector indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', default=None, help="Restrict to a template's documents")
+        parser.add_argument('--session', default=None, help="Restrict to a session's documents")
+        parser.add_argument('--queries', type=int, default=100, help="Number of sampled chunks used as queries")
+        parser.add_argument('--top-k', type=int, default=10, help="Results per query")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for sampling queries")
+
+    def handle(self, *args, **options):
+        scope = RetrievalScope.build(template_id=options['template'], session_id=options['session'])
+        chunks = DocumentChunk.objects.filter(**scope.document_filter(prefix='document__'))
+        exact = VectorIndex.from_queryset(chunks)
+        if len(exact) == 0:
+            raise CommandError(f"No embedded chunks in scope '{scope}'")
+
+        # Perturbed copies of stored chunks stand in for real queries
+        rng = np.random.default_rng(options['seed'])
+        rows = rng.choice(len(exact), min(options['queries'], len(exact)), replace=False)
+        queries = exact.vectors[rows] + rng.normal(scale=0.01, size=(rows.size, exact.dimensions)).astype(np.float32)
+        top_k = options['top_k']
+
+        truth = self._report('exact', exact, queries, top_k, exact.nbytes)
+        for mode in ('int8', 'pq'):
+            index = QuantizedIndex.train(
+                exact, mode, subspaces=settings.RAG_PQ_SUBSPACES,
+                vector_loader=load_chunk_vectors, rerank_factor=settings.RAG_INDEX_RERANK_FACTOR
+            )
+            self._report(mode, index, queries, top_k, exact.nbytes, truth)
+        ivf = IVFIndex.train(exact, n_lists=settings.RAG_ANN_LISTS, n_probe=settings.RAG_ANN_NPROBE)
+        self._report(f'ivf (n_probe={ivf.n_probe})', ivf, queries, top_k, exact.nbytes, truth)
+
+    def _report(self, name, index, queries, top_k, baseline_bytes, truth=None):
+        start = time.perf_counter()
+        hits = [index.search(query, top_k) for query in queries]
+        latency = (time.perf_counter() - start) / len(queries) * 1000
+        recall = recall_at_k(hits, truth) if truth is not None else 1.0
+        self.stdout.write(
+            f"{name:<20} {index.nbytes / 2 ** 20:9.1f} MiB ({baseline_bytes / max(index.nbytes, 1):4.1f}x smaller)"
+            f"  {latency:7.2f} ms/query  recall@{top_k} {recall:.3f}"
+        )
+        return hits
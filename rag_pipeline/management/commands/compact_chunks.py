@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rag_pipeline.models import Document, DocumentChunk
+
+
+class Command(BaseCommand):
+    help = "Store chunks saved with their own copy of their text as offsets into their document's text"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', default=None, help="Only compact this template's documents")
+        parser.add_argument('--dry-run', action='store_true', help="Report the savings without changing anything")
+
+    def handle(self, *args, **options):
+        stored_as_content = DocumentChunk.objects.filter(start_offset__isnull=True).exclude(content='')
+        documents = Document.objects.filter(id__in=stored_as_content.values('document_id'))
+        if options['template']:
+            documents = documents.filter(template_id=options['template'])
+
+        compacted = unmatched = saved = 0
+        for document_id in list(documents.values_list('id', flat=True)):
+            document = Document.objects.only('id', 'content').get(id=document_id)
+            text = document.content or ''
+            chunks = list(stored_as_content.filter(document=document).only(
+                'id', 'content', 'chunk_index'
+            ).order_by('chunk_index'))
+
+            # Chunks are in document order, so each is searched for from where the previous one started
+            position = 0
+            for chunk in chunks:
+                start = text.find(chunk.content, position)
+                if start < 0:
+                    start = text.find(chunk.content)
+                if start < 0:
+                    unmatched += 1
+                    continue
+                saved += len(chunk.content.encode('utf-8'))
+                chunk.start_offset, chunk.end_offset = start, start + len(chunk.content)
+                chunk.content = ''
+                position = start + 1
+                compacted += 1
+
+            if not options['dry_run']:
+                with transaction.atomic():
+                    DocumentChunk.objects.bulk_update(
+                        [chunk for chunk in chunks if chunk.start_offset is not None],
+                        ['content', 'start_offset', 'end_offset'], batch_size=500
+                    )
+
+        verb = 'Would compact' if options['dry_run'] else 'Compacted'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {compacted} chunks, saving {saved / 2 ** 20:.1f} MiB of chunk text"
+            + (f"; {unmatched} chunks were not found in their document's text and were left as they are" if unmatched else "")
+        ))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rag_pipeline.models import EmbeddingCacheEntry
+from rag_pipeline.services.embedding_cache import EmbeddingCache
+
+
+class Command(BaseCommand):
+    help = "Delete unused cached chunk embeddings and enforce the cache size bound"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--unused-days', type=int, default=None,
+            help="Delete entries that have not been used in this many days"
+        )
+        parser.add_argument(
+            '--max-entries', type=int, default=settings.RAG_EMBEDDING_CACHE_MAX_ENTRIES,
+            help="Keep at most this many entries, evicting the least recently used"
+        )
+
+    def handle(self, *args, **options):
+        before = EmbeddingCacheEntry.objects.count()
+        deleted = EmbeddingCache.prune(unused_days=options['unused_days'], max_entries=options['max_entries'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} cached embeddings ({before - deleted} remaining)"
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from rag_pipeline.models import Document
+from rag_pipeline.services.vector_shards import vector_shard_store
+
+
+class Command(BaseCommand):
+    help = "Rewrite per-template embedding shards from the database and swap them in atomically"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--template', action='append', default=None,
+            help="Template ID to rebuild (repeatable; defaults to every template with documents)"
+        )
+
+    def handle(self, *args, **options):
+        template_ids = options['template']
+        if template_ids is None:
+            template_ids = list(Document.objects.order_by().values_list('template_id', flat=True).distinct())
+
+        for template_id in template_ids:
+            rows = vector_shard_store.rebuild(str(template_id) if template_id else None)
+            self.stdout.write(f"{template_id or 'unassigned'}: {rows} chunks")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(template_ids)} vector shards"))
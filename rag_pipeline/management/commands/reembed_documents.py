@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_pipeline.models import Document
+from rag_pipeline.services.rag_pipeline import RAGPipeline
+from rag_pipeline.services.vector_index import RetrievalScope
+
+
+class Command(BaseCommand):
+    help = "Re-embed documents indexed with a different embedding provider, model or dimension"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', default=None, help="Only re-embed this template's documents")
+        parser.add_argument('--provider', default=None, help="Embedding provider (defaults to RAG_EMBEDDING_PROVIDER)")
+        parser.add_argument('--model', default=None, help="Embedding model (defaults to RAG_EMBEDDING_MODEL)")
+        parser.add_argument('--dimensions', type=int, default=None,
+                            help="Embedding dimensions (defaults to RAG_EMBEDDING_DIMENSIONS)")
+        parser.add_argument('--truncate', action='store_true',
+                            help="Shorten and renormalise stored vectors instead of calling the provider "
+                                 "(same model, fewer dimensions only)")
+        parser.add_argument('--dry-run', action='store_true', help="List the documents without re-embedding them")
+
+    def handle(self, *args, **options):
+        pipeline = RAGPipeline(
+            embedding_model=options['model'], embedding_provider=options['provider'],
+            embedding_dimensions=options['dimensions']
+        )
+        if options['truncate'] and pipeline.embedding_service.provider.dimensions is None:
+            raise CommandError("--truncate needs a target size: pass --dimensions or set RAG_EMBEDDING_DIMENSIONS")
+        space = pipeline.embedding_service.space
+        scope = RetrievalScope.build(template_id=options['template'], embedding_space=space)
+
+        documents = Document.objects.filter(
+            **RetrievalScope.build(template_id=options['template']).document_filter()
+        ).filter(chunks__isnull=False).exclude(**scope.space_filter()).distinct()
+        if options['truncate']:
+            documents = documents.filter(
+                embedding_provider=space.provider, embedding_model=space.model,
+                embedding_dimensions__gt=space.dimensions
+            )
+
+        label = f"{space.provider}/{space.model} at {space.dimensions} dimensions"
+        self.stdout.write(f"{documents.count()} documents are not embedded with {label}")
+        if options['dry_run']:
+            for document in documents:
+                self.stdout.write(
+                    f"  {document.id} {document.name} "
+                    f"({document.embedding_provider}/{document.embedding_model}, {document.embedding_dimensions} dimensions)"
+                )
+            return
+
+        total = 0
+        for document in list(documents):
+            total += pipeline.reembed_document(document, truncate=options['truncate'])
+            self.stdout.write(f"  {document.name}")
+        self.stdout.write(self.style.SUCCESS(f"{'Truncated' if options['truncate'] else 'Re-embedded'} {total} chunks"))
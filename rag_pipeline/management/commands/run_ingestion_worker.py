@@ -0,0 +1,53 @@
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from rag_pipeline.services.ingestion_jobs import IngestionWorker
+
+
+class Command(BaseCommand):
+    help = "Process queued document uploads: extract, chunk, embed and index them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=settings.RAG_INGESTION_WORKER_THREADS,
+            help="Number of jobs processed at once"
+        )
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--burst', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self._work, args=(stop, options), name=f'ingest-{i}', daemon=True)
+            for i in range(max(options['threads'], 1))
+        ]
+        self.stdout.write(f"Ingestion worker started with {len(threads)} threads")
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self.stdout.write("Finishing running jobs...")
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def _work(self, stop, options):
+        worker = IngestionWorker()
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                ran = worker.run_pending()
+                if ran:
+                    self.stdout.write(f"{worker.name}: processed {ran} jobs")
+                elif options['burst']:
+                    break
+                else:
+                    stop.wait(options['poll_interval'])
+        finally:
+            connection.close()
@@ -0,0 +1,53 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from rag_pipeline.services.retention import collect_orphaned_uploads, expired_session_documents, sweep_expired_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete expired session documents and upload files no document refers to"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl', type=int, default=settings.RAG_SESSION_TTL_SECONDS,
+            help="Delete session documents not updated for this many seconds"
+        )
+        parser.add_argument(
+            '--grace', type=int, default=settings.RAG_UPLOAD_GC_GRACE_SECONDS,
+            help="Keep unreferenced upload files modified in the last this many seconds"
+        )
+        parser.add_argument('--batch-size', type=int, default=settings.RAG_SWEEP_BATCH_SIZE, help="Rows or files per batch")
+        parser.add_argument('--skip-uploads', action='store_true', help="Only expire session documents")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be deleted without deleting it")
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help="Keep running, sweeping every this many seconds (runs once if 0)"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                close_old_connections()
+                self._sweep(options)
+                if options['interval'] <= 0:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def _sweep(self, options):
+        if options['dry_run']:
+            documents = expired_session_documents(options['ttl']).count()
+        else:
+            documents = sweep_expired_sessions(options['ttl'], options['batch_size'])
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        message = f"{verb} {documents} expired session documents"
+
+        # Files of the documents just deleted are removed as each batch commits
+        if not options['skip_uploads']:
+            result = collect_orphaned_uploads(options['grace'], options['dry_run'], options['batch_size'])
+            message += f" and {result.deleted} orphaned upload files ({result.bytes / 2 ** 20:.1f} MiB); {result.kept} files kept"
+        self.stdout.write(self.style.SUCCESS(message))
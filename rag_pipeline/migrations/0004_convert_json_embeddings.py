@@ -0,0 +1,57 @@
+import numpy as np
+from django.db import migrations
+
+# Every embedding written before binary storage came from the pipeline default
+LEGACY_EMBEDDING_MODEL = 'text-embedding-3-small'
+BATCH_SIZE = 500
+
+
+def json_to_binary(apps, schema_editor):
+    DocumentChunk = apps.get_model('rag_pipeline', 'DocumentChunk')
+    chunks = DocumentChunk.objects.exclude(embedding__isnull=True).only('id', 'embedding')
+
+    batch = []
+    for chunk in chunks.iterator(chunk_size=BATCH_SIZE):
+        if not chunk.embedding:
+            continue
+        vector = np.asarray(chunk.embedding, dtype=np.float32)
+        chunk.embedding_data = vector.astype('<f4').tobytes()
+        chunk.embedding_dtype = 'float32'
+        chunk.embedding_norm = float(np.linalg.norm(vector))
+        chunk.embedding_model = LEGACY_EMBEDDING_MODEL
+        chunk.embedding_dimensions = int(vector.shape[0])
+        batch.append(chunk)
+        if len(batch) >= BATCH_SIZE:
+            DocumentChunk.objects.bulk_update(batch, ['embedding_data', 'embedding_dtype', 'embedding_norm', 'embedding_model', 'embedding_dimensions'])
+            batch = []
+
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ['embedding_data', 'embedding_dtype', 'embedding_norm', 'embedding_model', 'embedding_dimensions'])
+
+
+def binary_to_json(apps, schema_editor):
+    DocumentChunk = apps.get_model('rag_pipeline', 'DocumentChunk')
+    chunks = DocumentChunk.objects.exclude(embedding_data__isnull=True).only('id', 'embedding_data', 'embedding_dtype')
+
+    batch = []
+    for chunk in chunks.iterator(chunk_size=BATCH_SIZE):
+        dtype = '<f2' if chunk.embedding_dtype == 'float16' else '<f4'
+        chunk.embedding = np.frombuffer(chunk.embedding_data, dtype=dtype).astype(float).tolist()
+        batch.append(chunk)
+        if len(batch) >= BATCH_SIZE:
+            DocumentChunk.objects.bulk_update(batch, ['embedding'])
+            batch = []
+
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ['embedding'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_pipeline', '0003_documentchunk_embedding_data'),
+    ]
+
+    operations = [
+        migrations.RunPython(json_to_binary, binary_to_json),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_pipeline', '0004_convert_json_embeddings'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='documentchunk',
+            name='embedding',
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_pipeline', '0005_remove_documentchunk_embedding'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['template', 'session_id'], name='rag_doc_template_session_idx'),
+        ),
+    ]
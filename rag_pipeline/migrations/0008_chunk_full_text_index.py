@@ -0,0 +1,57 @@
+import logging
+
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'rag_pipeline_chunk_fts'
+
+
+def create_full_text_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    "content, chunk_id UNINDEXED, document_id UNINDEXED, "
+                    "tokenize = 'unicode61 remove_diacritics 2')"
+                )
+            except Exception as e:
+                # SQLite built without FTS5: retrieval stays vector-only
+                logger.warning(f"Could not create full-text index: {str(e)}")
+                return
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (content, chunk_id, document_id) "
+                "SELECT content, id, document_id FROM rag_pipeline_documentchunk"
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                "ALTER TABLE rag_pipeline_documentchunk ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+                "GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS rag_chunk_content_tsv_idx "
+                "ON rag_pipeline_documentchunk USING GIN (content_tsv)"
+            )
+
+
+def drop_full_text_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif connection.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS rag_chunk_content_tsv_idx")
+            cursor.execute("ALTER TABLE rag_pipeline_documentchunk DROP COLUMN IF EXISTS content_tsv")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_pipeline', '0007_embeddingcacheentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_full_text_index, drop_full_text_index),
+    ]
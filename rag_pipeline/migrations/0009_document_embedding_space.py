@@ -0,0 +1,47 @@
+from django.db import migrations, models
+
+# Every embedding written before providers were pluggable came from OpenAI
+LEGACY_EMBEDDING_PROVIDER = 'openai'
+
+
+def tag_documents_from_chunks(apps, schema_editor):
+    Document = apps.get_model('rag_pipeline', 'Document')
+    DocumentChunk = apps.get_model('rag_pipeline', 'DocumentChunk')
+    spaces = DocumentChunk.objects.exclude(embedding_dimensions__isnull=True).order_by().values_list(
+        'document_id', 'embedding_model', 'embedding_dimensions'
+    ).distinct()
+
+    tagged = set()
+    for document_id, model, dimensions in spaces.iterator():
+        if document_id in tagged:
+            continue
+        tagged.add(document_id)
+        Document.objects.filter(id=document_id).update(
+            embedding_provider=LEGACY_EMBEDDING_PROVIDER, embedding_model=model, embedding_dimensions=dimensions
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_pipeline', '0008_chunk_full_text_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='embedding_dimensions',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='embedding_model',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='embedding_provider',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.RunPython(tag_documents_from_chunks, migrations.RunPython.noop),
+    ]
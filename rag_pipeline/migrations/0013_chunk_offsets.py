@@ -0,0 +1,103 @@
+from django.db import migrations, models
+
+# Chunk metadata keys that are the same for every chunk of a document and now live on Document
+SHARED_METADATA_KEYS = ('document_name', 'document_id', 'chunk_size', 'chunk_overlap')
+BATCH_SIZE = 500
+
+
+def detach_tsvector(apps, schema_editor):
+    # Chunks stored as offsets have no content of their own, so the tsvector
+    # can no longer be generated from the row; the lexical index writes it
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("ALTER TABLE rag_pipeline_documentchunk ALTER COLUMN content_tsv DROP EXPRESSION IF EXISTS")
+
+
+def attach_tsvector(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("DROP INDEX IF EXISTS rag_chunk_content_tsv_idx")
+            cursor.execute("ALTER TABLE rag_pipeline_documentchunk DROP COLUMN IF EXISTS content_tsv")
+            cursor.execute(
+                "ALTER TABLE rag_pipeline_documentchunk ADD COLUMN content_tsv tsvector "
+                "GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED"
+            )
+            cursor.execute(
+                "CREATE INDEX rag_chunk_content_tsv_idx ON rag_pipeline_documentchunk USING GIN (content_tsv)"
+            )
+
+
+def normalize_chunk_metadata(apps, schema_editor):
+    Document = apps.get_model('rag_pipeline', 'Document')
+    DocumentChunk = apps.get_model('rag_pipeline', 'DocumentChunk')
+    chunks = DocumentChunk.objects.filter(metadata__has_key='document_name').only('id', 'document_id', 'metadata')
+
+    batch, chunking = [], {}
+    for chunk in chunks.iterator(chunk_size=BATCH_SIZE):
+        chunking.setdefault(chunk.document_id, (chunk.metadata.get('chunk_size'), chunk.metadata.get('chunk_overlap')))
+        chunk.metadata = {key: value for key, value in chunk.metadata.items() if key not in SHARED_METADATA_KEYS}
+        batch.append(chunk)
+        if len(batch) >= BATCH_SIZE:
+            DocumentChunk.objects.bulk_update(batch, ['metadata'])
+            batch = []
+
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ['metadata'])
+
+    # Documents chunked before chunking was recorded on them
+    for document in Document.objects.filter(id__in=list(chunking), chunk_size__isnull=True).only('id'):
+        chunk_size, chunk_overlap = chunking[document.id]
+        Document.objects.filter(id=document.id).update(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def denormalize_chunk_metadata(apps, schema_editor):
+    DocumentChunk = apps.get_model('rag_pipeline', 'DocumentChunk')
+    chunks = DocumentChunk.objects.select_related('document').only(
+        'id', 'metadata', 'document__id', 'document__name', 'document__chunk_size', 'document__chunk_overlap'
+    )
+
+    batch = []
+    for chunk in chunks.iterator(chunk_size=BATCH_SIZE):
+        chunk.metadata = {
+            **chunk.metadata,
+            'document_name': chunk.document.name,
+            'document_id': str(chunk.document.id),
+            'chunk_size': chunk.document.chunk_size,
+            'chunk_overlap': chunk.document.chunk_overlap,
+        }
+        batch.append(chunk)
+        if len(batch) >= BATCH_SIZE:
+            DocumentChunk.objects.bulk_update(batch, ['metadata'])
+            batch = []
+
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ['metadata'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_pipeline', '0012_document_content_sha256'),
+    ]
+
+    operations = [
+        migrations.RunPython(detach_tsvector, attach_tsvector),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='end_offset',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='start_offset',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='documentchunk',
+            name='content',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(normalize_chunk_metadata, denormalize_chunk_metadata),
+    ]
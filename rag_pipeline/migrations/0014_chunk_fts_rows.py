@@ -0,0 +1,43 @@
+from django.db import migrations
+
+FTS_TABLE = 'rag_pipeline_chunk_fts'
+FTS_ROWS_TABLE = 'rag_pipeline_chunk_fts_rows'
+
+
+def create_fts_rows(apps, schema_editor):
+    # FTS5 columns cannot be indexed, so deleting a document's or chunk's
+    # rows by chunk_id/document_id scanned the whole table; this table maps
+    # both to the FTS rowid
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or FTS_TABLE not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {FTS_ROWS_TABLE} ("
+            "id INTEGER PRIMARY KEY, chunk_id char(32) NOT NULL UNIQUE, document_id char(32) NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {FTS_ROWS_TABLE}_document_id ON {FTS_ROWS_TABLE} (document_id)"
+        )
+        cursor.execute(
+            f"INSERT INTO {FTS_ROWS_TABLE} (id, chunk_id, document_id) "
+            f"SELECT rowid, chunk_id, document_id FROM {FTS_TABLE}"
+        )
+
+
+def drop_fts_rows(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_ROWS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_pipeline', '0013_chunk_offsets'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_rows, drop_fts_rows),
+    ]
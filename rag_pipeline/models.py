@@ -1,6 +1,11 @@
 from django.db import models
+from django.db.models import Case, F, When
+from django.db.models.functions import Substr
+from django.utils import timezone
 import uuid
 
+from .services.embedding_codec import EMBEDDING_DTYPES, DEFAULT_EMBEDDING_DTYPE, encode_embedding, decode_embedding
+
 
 class Document(models.Model):
     """
@@ -9,6 +14,7 @@ class Document(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
     file_path = models.CharField(max_length=500, null=True, blank=True)  # For file uploads
+    content_sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True)  # Of the uploaded file
     content = models.TextField(null=True, blank=True)  # For direct text input
     file_type = models.CharField(max_length=10, choices=[
         ('text', 'Text'),
@@ -17,14 +23,57 @@ class Document(models.Model):
     ])
     template = models.ForeignKey('template_engine.Template', on_delete=models.CASCADE, null=True, blank=True, related_name='documents')
     session_id = models.CharField(max_length=64, null=True, blank=True)
+    # Embedding space the document's chunks were indexed in; documents from
+    # another space are excluded from retrieval until re-embedded
+    embedding_provider = models.CharField(max_length=50, blank=True, default='')
+    embedding_model = models.CharField(max_length=100, blank=True, default='')
+    embedding_dimensions = models.PositiveIntegerField(null=True, blank=True)
+    # Chunking the stored chunks were produced with
+    chunk_size = models.PositiveIntegerField(null=True, blank=True)
+    chunk_overlap = models.PositiveIntegerField(null=True, blank=True)
+    # Only indexed documents are used for retrieval
+    status = models.CharField(max_length=10, default='pending', choices=[
+        ('pending', 'Pending'),
+        ('indexed', 'Indexed'),
+        ('failed', 'Failed'),
+    ])
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Retrieval scopes filter documents by template and session
+            models.Index(fields=['template', 'session_id'], name='rag_doc_template_session_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.file_type})"
+    
+    @property
+    def chunk_metadata(self):
+        """
+        Metadata shared by all of the document's chunks
+        """
+        return {
+            'document_name': self.name,
+            'document_id': str(self.id),
+            'chunk_size': self.chunk_size,
+            'chunk_overlap': self.chunk_overlap,
+        }
+
+
+class DocumentChunkQuerySet(models.QuerySet):
+    def with_text(self):
+        """
+        Annotate each chunk with its text, sliced out of the document's
+        content by the database so the full content is never loaded
+        """
+        return self.annotate(materialized_text=Case(
+            When(start_offset__isnull=True, then=F('content')),
+            default=Substr('document__content', F('start_offset') + 1, F('end_offset') - F('start_offset')),
+            output_field=models.TextField(),
+        ))
 
 
 class DocumentChunk(models.Model):
@@ -33,15 +82,137 @@ class DocumentChunk(models.Model):
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
-    content = models.TextField()
+    content = models.TextField(blank=True, default='')  # Empty when the chunk is stored as offsets
+    # Span of the chunk in document.content, when stored as offsets
+    start_offset = models.PositiveIntegerField(null=True, blank=True)
+    end_offset = models.PositiveIntegerField(null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, default='')  # sha256 of the normalized content
     chunk_index = models.IntegerField()  # Order of chunk in document
-    embedding = models.JSONField(null=True, blank=True)  # Store embedding vector as JSON
-    metadata = models.JSONField(default=dict, blank=True)  # Store additional metadata
+    embedding_data = models.BinaryField(null=True, blank=True)  # Raw little-endian embedding vector
+    embedding_dtype = models.CharField(max_length=10, default=DEFAULT_EMBEDDING_DTYPE, choices=[
+        (dtype, dtype) for dtype in EMBEDDING_DTYPES
+    ])
+    embedding_norm = models.FloatField(null=True, blank=True)  # L2 norm of the original vector
+    embedding_model = models.CharField(max_length=100, blank=True, default='')
+    embedding_dimensions = models.PositiveIntegerField(null=True, blank=True)
+    metadata = models.JSONField(default=dict, blank=True)  # Chunk-specific metadata, e.g. pages spanned
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = DocumentChunkQuerySet.as_manager()
+    
     class Meta:
         ordering = ['document', 'chunk_index']
         unique_together = ['document', 'chunk_index']
     
     def __str__(self):
         return f"Chunk {self.chunk_index} of {self.document.name}"
+    
+    @property
+    def has_embedding(self):
+        return self.embedding_dimensions is not None
+    
+    @property
+    def text(self):
+        """
+        The chunk's text, from its own content or from its span of the document's content
+        """
+        if self.start_offset is None:
+            return self.content
+        materialized = self.__dict__.get('materialized_text')
+        if materialized is not None:
+            return materialized
+        return (self.document.content or '')[self.start_offset:self.end_offset]
+    
+    @property
+    def full_metadata(self):
+        """
+        The document's shared chunk metadata together with the chunk's own
+        """
+        return {**self.metadata, **self.document.chunk_metadata}
+    
+    @property
+    def embedding(self):
+        """
+        Embedding as a read-only numpy view over the stored bytes, or None
+        """
+        if self.embedding_data is None:
+            return None
+        return decode_embedding(self.embedding_data, self.embedding_dtype)
+    
+    def set_embedding(self, embedding, model: str = '', dtype: str = DEFAULT_EMBEDDING_DTYPE):
+        """
+        Encode and store an embedding vector along with its norm, model and dimension
+        """
+        self.embedding_data, self.embedding_norm = encode_embedding(embedding, dtype)
+        self.embedding_dtype = dtype
+        self.embedding_model = model
+        self.embedding_dimensions = len(embedding)
+
+
+class EmbeddingCacheEntry(models.Model):
+    """
+    Model to store embeddings keyed by the hash of the text they were generated from,
+    so identical chunks are only ever embedded once per model and dimension
+    """
+    model = models.CharField(max_length=100)
+    dimensions = models.PositiveIntegerField(default=0)  # 0 means the model's native size
+    content_hash = models.CharField(max_length=64)  # sha256 of the normalized text
+    embedding_data = models.BinaryField()  # Raw little-endian float32 vector
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'dimensions', 'content_hash'], name='rag_embedding_cache_key'),
+        ]
+    
+    def __str__(self):
+        return f"{self.model}/{self.dimensions or 'native'} {self.content_hash[:12]}"
+
+
+class IngestionJob(models.Model):
+    """
+    Model to track the background extraction, chunking, embedding and
+    indexing of an uploaded document
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='ingestion_jobs')
+    status = models.CharField(max_length=10, default=STATUS_QUEUED, choices=[
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ])
+    stage = models.CharField(max_length=12, default='queued', choices=[
+        ('queued', 'Queued'),
+        ('extracting', 'Extracting'),
+        ('chunking', 'Chunking'),
+        ('embedding', 'Embedding'),
+        ('indexing', 'Indexing'),
+        ('done', 'Done'),
+    ])
+    progress_current = models.PositiveIntegerField(default=0)  # Items finished in the current stage
+    progress_total = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True, default='')  # Worker holding the job
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Last sign of life from that worker
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # Workers poll for the oldest queued job
+            models.Index(fields=['status', 'created_at'], name='rag_job_status_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Ingestion of {self.document.name} ({self.status}, {self.stage})"
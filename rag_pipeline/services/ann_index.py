@@ -0,0 +1,295 @@
+"""
+Approximate nearest neighbour search over chunk embeddings using an
+inverted-file (IVF) index
+"""
+import os
+from typing import List, Tuple, Optional
+import logging
+
+import numpy as np
+
+from .vector_index import VectorIndex, recall_at_k
+
+logger = logging.getLogger(__name__)
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 8,
+                     seed: int = 0, batch_size: int = 4096) -> np.ndarray:
+    """
+    Cluster unit-length vectors by cosine similarity
+
+    Args:
+        vectors: (n, d) matrix of unit-length vectors
+        n_clusters: Number of centroids to learn
+        iterations: Number of Lloyd iterations
+        seed: Random seed for initialisation
+        batch_size: Rows assigned per matrix product
+
+    Returns:
+        (n_clusters, d) matrix of unit-length centroids
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, vectors.shape[0])
+    centroids = vectors[rng.choice(vectors.shape[0], n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_to_centroids(vectors, centroids, batch_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # Re-seed empty clusters from random rows so every list stays useful
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            sums[empty] = vectors[rng.choice(vectors.shape[0], empty.size, replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 4096) -> np.ndarray:
+    """
+    Index of the most similar centroid for each row of vectors
+    """
+    assignments = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], batch_size):
+        batch = vectors[start:start + batch_size]
+        assignments[start:start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex(VectorIndex):
+    """
+    Vector index that partitions rows into k-means lists and only scores the
+    lists whose centroids are closest to the query.
+
+    n_probe is the recall/latency knob: probing more lists finds more of the
+    true nearest neighbours at the cost of scoring more rows. Exact search
+    over every row remains available with exact=True.
+    """
+
+    def __init__(self, chunk_ids: List[str], document_ids: List[str], vectors: np.ndarray,
+                 centroids: np.ndarray, assignments: Optional[np.ndarray] = None,
+                 fingerprint=None, normalized: bool = False, n_probe: int = 8):
+        """
+        Initialize the index
+
+        Args:
+            chunk_ids: Chunk IDs, one per row of vectors
+            document_ids: Document IDs, one per row of vectors
+            vectors: (n, d) matrix of embeddings
+            centroids: (k, d) matrix of unit-length list centroids
+            assignments: List number of each row (computed if not given)
+            fingerprint: Corpus fingerprint the index was built from
+            normalized: Whether rows are already unit length
+            n_probe: Number of lists scored per query
+        """
+        super().__init__(chunk_ids, document_ids, vectors, fingerprint, normalized)
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        if assignments is None:
+            assignments = assign_to_centroids(self.vectors, self.centroids)
+        self._assignments = np.asarray(assignments, dtype=np.int32)
+        self._lists: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self.n_probe = n_probe
+        self.trained_size = len(self)
+
+    @classmethod
+    def train(cls, index: VectorIndex, n_lists: Optional[int] = None, n_probe: int = 8,
+              sample_size: Optional[int] = None, seed: int = 0) -> 'IVFIndex':
+        """
+        Train list centroids on an exact index and partition its rows
+
+        Args:
+            index: Exact index to partition
+            n_lists: Number of lists (defaults to sqrt of the row count)
+            n_probe: Number of lists scored per query
+            sample_size: Rows used to train centroids (defaults to 64 per list)
+            seed: Random seed for training
+
+        Returns:
+            Trained IVFIndex over the same rows
+        """
+        vectors, alive, chunk_ids = index._snapshot()
+        document_ids = index.document_ids
+        if alive is not None:
+            keep = np.flatnonzero(alive)
+            vectors = vectors[keep]
+            chunk_ids = [chunk_ids[row] for row in keep]
+            document_ids = [document_ids[row] for row in keep]
+
+        n_lists = n_lists or max(1, int(np.sqrt(vectors.shape[0])))
+        sample_size = min(vectors.shape[0], sample_size or 64 * n_lists)
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(vectors.shape[0], sample_size, replace=False)]
+
+        centroids = spherical_kmeans(sample, n_lists, seed=seed)
+        logger.info(f"🔍 RAG DEBUG: Trained IVF index with {centroids.shape[0]} lists on {sample_size} of {vectors.shape[0]} chunks")
+        return cls(chunk_ids, document_ids, vectors, centroids, fingerprint=index.fingerprint,
+                   normalized=True, n_probe=n_probe)
+
+    def add(self, chunk_ids: List[str], document_ids: List[str], vectors: np.ndarray,
+            normalized: bool = False) -> np.ndarray:
+        with self._lock:
+            rows = super().add(chunk_ids, document_ids, vectors, normalized)
+            new_assignments = assign_to_centroids(self._data[rows], self.centroids)
+            self._assignments = np.concatenate([self._assignments, new_assignments])
+            self._lists = None
+            return rows
+
+    def _on_compact(self, keep: np.ndarray) -> None:
+        self._assignments = self._assignments[keep]
+        self._lists = None
+
+    def _inverted_lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The rows of each list as (offsets, rows): list i holds
+        rows[offsets[i]:offsets[i + 1]], in row order. Rebuilt after rows
+        are added or compacted away. Must hold the lock.
+        """
+        if self._lists is None:
+            rows = np.argsort(self._assignments, kind='stable')
+            counts = np.bincount(self._assignments, minlength=self.centroids.shape[0])
+            offsets = np.zeros(counts.size + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            self._lists = (offsets, rows)
+        return self._lists
+
+    def needs_retrain(self) -> bool:
+        """
+        Whether the index has grown enough since training that its lists are unbalanced
+        """
+        return len(self) > 2 * max(self.trained_size, 1)
+
+    def search_batch(self, query_embeddings: List[List[float]], top_k: int = 5,
+                     exact: bool = False, n_probe: Optional[int] = None) -> List[List[Tuple[str, float]]]:
+        """
+        Find the chunks most similar to each of several query embeddings
+
+        Args:
+            query_embeddings: Query embedding vectors
+            top_k: Number of top results to return per query
+            exact: Score every row instead of only the probed lists
+            n_probe: Number of lists to score (defaults to the index's n_probe)
+
+        Returns:
+            One list of (chunk_id, similarity_score) tuples per query, sorted by similarity
+        """
+        n_probe = n_probe or self.n_probe
+        if exact or n_probe >= self.centroids.shape[0]:
+            return super().search_batch(query_embeddings, top_k)
+        if len(query_embeddings) == 0:
+            return []
+        if len(self) == 0 or top_k <= 0:
+            return [[] for _ in query_embeddings]
+
+        queries = self._prepare_queries(query_embeddings)
+        with self._lock:
+            vectors, alive, chunk_ids = self._snapshot()
+            offsets, list_rows = self._inverted_lists()
+
+        # Only the probed lists' rows are gathered and scored
+        probes = self._top_k(queries @ self.centroids.T, n_probe)
+        results = []
+        for query, probe in zip(queries, probes):
+            rows = np.sort(np.concatenate([list_rows[offsets[l]:offsets[l + 1]] for l in probe]))
+            if alive is not None:
+                rows = rows[alive[rows]]
+            if rows.size == 0:
+                results.append([])
+                continue
+            scores = vectors[rows] @ query
+            top = self._top_k(scores, top_k)
+            results.append([(chunk_ids[rows[i]], float(scores[i])) for i in top])
+        return results
+
+    def search(self, query_embedding: List[float], top_k: int = 5, exact: bool = False,
+               n_probe: Optional[int] = None) -> List[Tuple[str, float]]:
+        return self.search_batch([query_embedding], top_k, exact=exact, n_probe=n_probe)[0]
+
+    def measure_recall(self, query_embeddings: List[List[float]], top_k: int = 5,
+                       n_probe: Optional[int] = None) -> float:
+        """
+        Fraction of the exact top-k that approximate search also returns
+
+        Args:
+            query_embeddings: Query embedding vectors to evaluate
+            top_k: Number of results per query
+            n_probe: Number of lists to score
+
+        Returns:
+            Mean recall@top_k across the queries
+        """
+        approximate = self.search_batch(query_embeddings, top_k, n_probe=n_probe)
+        exact = self.search_batch(query_embeddings, top_k, exact=True)
+        return recall_at_k(approximate, exact)
+
+    def save(self, path: str) -> None:
+        """
+        Persist the trained centroids and list assignments. Vectors are not
+        written; they are reloaded from the database with the index.
+
+        Args:
+            path: File to write (replaced atomically)
+        """
+        with self._lock:
+            vectors, alive, chunk_ids = self._snapshot()
+            assignments = self._assignments
+            if alive is not None:
+                keep = np.flatnonzero(alive)
+                chunk_ids = [chunk_ids[row] for row in keep]
+                assignments = assignments[keep]
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, chunk_ids=np.array(chunk_ids, dtype='U36'),
+                     assignments=assignments, trained_size=np.array(self.trained_size))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, index: VectorIndex, path: str, n_probe: int = 8) -> Optional['IVFIndex']:
+        """
+        Rebuild an IVF index over an exact index using saved centroids.
+        Rows missing from the saved assignments are assigned to their nearest list.
+
+        Args:
+            index: Exact index with the current rows
+            path: File written by save
+            n_probe: Number of lists scored per query
+
+        Returns:
+            IVFIndex, or None if the file is missing or incompatible
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as saved:
+                centroids = saved['centroids']
+                known = dict(zip(saved['chunk_ids'].tolist(), saved['assignments'].tolist()))
+                trained_size = int(saved['trained_size'])
+        except Exception as e:
+            logger.warning(f"Could not load IVF index from {path}: {str(e)}")
+            return None
+        if centroids.ndim != 2 or centroids.shape[1] != index.dimensions:
+            return None
+
+        vectors, alive, chunk_ids = index._snapshot()
+        document_ids = index.document_ids
+        if alive is not None:
+            keep = np.flatnonzero(alive)
+            vectors = vectors[keep]
+            chunk_ids = [chunk_ids[row] for row in keep]
+            document_ids = [document_ids[row] for row in keep]
+
+        assignments = np.array([known.get(chunk_id, -1) for chunk_id in chunk_ids], dtype=np.int32)
+        unknown = np.flatnonzero(assignments < 0)
+        if unknown.size:
+            assignments[unknown] = assign_to_centroids(vectors[unknown], centroids)
+
+        ivf = cls(chunk_ids, document_ids, vectors, centroids, assignments,
+                  fingerprint=index.fingerprint, normalized=True, n_probe=n_probe)
+        ivf.trained_size = trained_size
+        return ivf
@@ -2,13 +2,98 @@
 Document processing service for handling different file types
 """
 import os
-import fitz  # PyMuPDF
-from docx import Document as DocxDocument
-from typing import Optional, List, Dict, Any
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict, Any, Iterator, NamedTuple, Tuple, Union
 import logging
 
+from django.conf import settings
+
+from .text_chunker import TextChunker
+
 logger = logging.getLogger(__name__)
 
+# Pages handed to one extraction process at a time
+MIN_PAGES_PER_TASK = 16
+
+# Plain text files are decoded this many characters at a time
+TEXT_READ_CHARS = 256 * 1024
+
+
+class ExtractedPage(NamedTuple):
+    """
+    Text of one PDF page; number is 1-based
+    """
+    number: int
+    text: str
+    metadata: Dict[str, Any]
+
+
+def _extract_page_range(file_path: str, start: int, stop: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Extract pages [start, stop) of a PDF; runs in a worker process, which
+    opens the file itself
+    """
+    import fitz  # PyMuPDF
+
+    with fitz.open(file_path) as doc:
+        pages = []
+        for page_num in range(start, stop):
+            page = doc.load_page(page_num)
+            metadata = {'page': page_num + 1}
+            if page.get_label():
+                metadata['page_label'] = page.get_label()
+            pages.append((page.get_text(), metadata))
+        return pages
+
+
+WORD_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+_W = f'{{{WORD_NAMESPACE}}}'
+
+
+def _paragraph_text(paragraph) -> str:
+    """
+    Visible text of a w:p element; deleted (tracked) text is not included
+    """
+    parts = []
+    for node in paragraph.iter(f'{_W}t', f'{_W}tab', f'{_W}br', f'{_W}cr'):
+        if node.tag == f'{_W}t':
+            parts.append(node.text or '')
+        elif node.tag == f'{_W}tab':
+            parts.append('\t')
+        else:
+            parts.append('\n')
+    return ''.join(parts)
+
+
+def _is_merged_continuation(cell) -> bool:
+    """
+    Whether a w:tc continues a vertically merged cell from the row above
+    """
+    merge = cell.find(f'{_W}tcPr/{_W}vMerge')
+    return merge is not None and merge.get(f'{_W}val', 'continue') == 'continue'
+
+
+def _extract_file(file_path: str, file_type: str, chunker: TextChunker) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Extract and chunk a file; runs in a worker process. PDF pages are
+    extracted serially since files are what run in parallel here.
+    
+    Returns:
+        Tuple of (text, chunk dictionaries) as from TextChunker.chunk_parts
+    """
+    return chunker.chunk_parts(DocumentProcessor.iter_document(file_path, file_type, workers=1))
+
+
+def page_ranges(page_count: int, workers: int) -> List[range]:
+    """
+    Split a document's pages into consecutive ranges, a few per worker so a
+    slow range does not leave the other workers idle
+    """
+    size = max(MIN_PAGES_PER_TASK, -(-page_count // (workers * 4)))
+    return [range(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
 
 class DocumentProcessor:
     """
@@ -16,62 +101,253 @@ class DocumentProcessor:
     """
     
     @staticmethod
-    def extract_text_from_pdf(file_path: str) -> str:
+    def iter_pdf_pages(file_path: str, workers: Optional[int] = None) -> Iterator[ExtractedPage]:
         """
-        Extract text content from a PDF file
+        Extract a PDF page by page, in order
+        
+        PDFs of at least RAG_PDF_PARALLEL_MIN_PAGES pages are split into page
+        ranges extracted by separate processes, each opening the file itself,
+        so extraction time scales with pages divided by cores.
         
         Args:
             file_path: Path to the PDF file
+            workers: Number of extraction processes (defaults to RAG_PDF_EXTRACT_WORKERS)
             
-        Returns:
-            Extracted text content
+        Yields:
+            ExtractedPage for each page, first page first
         """
+        import fitz  # PyMuPDF
+
         try:
-            doc = fitz.open(file_path)
-            text = ""
+            with fitz.open(file_path) as doc:
+                page_count = len(doc)
+            workers = workers or settings.RAG_PDF_EXTRACT_WORKERS or os.cpu_count() or 1
             
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                text += page.get_text()
+            if workers <= 1 or page_count < max(settings.RAG_PDF_PARALLEL_MIN_PAGES, 2):
+                for text, metadata in _extract_page_range(file_path, 0, page_count):
+                    yield ExtractedPage(metadata['page'], text, metadata)
+                return
             
-            doc.close()
-            return text.strip()
+            ranges = page_ranges(page_count, workers)
+            logger.info(f"Extracting {page_count} PDF pages in {len(ranges)} ranges with {workers} processes")
+            # Spawned rather than forked: the caller may be a threaded worker
+            with ProcessPoolExecutor(max_workers=min(workers, len(ranges)),
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                futures = [executor.submit(_extract_page_range, file_path, r.start, r.stop) for r in ranges]
+                for future in futures:
+                    for text, metadata in future.result():
+                        yield ExtractedPage(metadata['page'], text, metadata)
             
         except Exception as e:
             logger.error(f"Error extracting text from PDF {file_path}: {str(e)}")
             raise ValueError(f"Failed to extract text from PDF: {str(e)}")
     
     @staticmethod
-    def extract_text_from_docx(file_path: str) -> str:
+    def extract_files(files: List[Tuple[str, str]], chunker: TextChunker, workers: Optional[int] = None
+                      ) -> List[Union[Tuple[str, List[Dict[str, Any]]], Exception]]:
         """
-        Extract text content from a DOCX file
+        Extract and chunk many files, one file per process at a time; each
+        file is chunked while it is read
         
         Args:
-            file_path: Path to the DOCX file
+            files: (file path, file type) pairs
+            chunker: Chunker the files are chunked with
+            workers: Number of extraction processes (defaults to RAG_BULK_EXTRACT_WORKERS)
             
         Returns:
-            Extracted text content
+            For each file in order, either (text, chunk dictionaries) as from
+            TextChunker.chunk_parts, or the exception its extraction raised
         """
-        try:
-            doc = DocxDocument(file_path)
-            text = ""
+        workers = min(workers or settings.RAG_BULK_EXTRACT_WORKERS or os.cpu_count() or 1, len(files))
+        if workers <= 1:
+            results = []
+            for file_path, file_type in files:
+                try:
+                    results.append(_extract_file(file_path, file_type, chunker))
+                except Exception as e:
+                    results.append(e)
+            return results
+        
+        logger.info(f"Extracting {len(files)} files with {workers} processes")
+        # Spawned rather than forked: the caller may be a threaded worker
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(_extract_file, file_path, file_type, chunker) for file_path, file_type in files]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append(e)
+            return results
+    
+    @staticmethod
+    def join_pages(pages: List[ExtractedPage]) -> Tuple[str, List[Tuple[int, Dict[str, Any]]]]:
+        """
+        Join extracted pages into one text
+        
+        Args:
+            pages: Pages in order
             
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
+        Returns:
+            Tuple of (stripped text, list of (offset in text where each page
+            starts, page metadata))
+        """
+        text = ''.join(page.text for page in pages)
+        leading = len(text) - len(text.lstrip())
+        offsets, position = [], 0
+        for page in pages:
+            offsets.append((max(position - leading, 0), page.metadata))
+            position += len(page.text)
+        return text.strip(), offsets
+    
+    @staticmethod
+    def extract_text_from_pdf(file_path: str) -> str:
+        """
+        Extract text content from a PDF file
+        
+        Args:
+            file_path: Path to the PDF file
             
-            # Also extract text from tables
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        text += cell.text + " "
-                    text += "\n"
+        Returns:
+            Extracted text content
+        """
+        text, _ = DocumentProcessor.join_pages(list(DocumentProcessor.iter_pdf_pages(file_path)))
+        return text
+    
+    @staticmethod
+    def iter_docx_blocks(file_path: str) -> Iterator[str]:
+        """
+        Stream the text of a DOCX file in document order
+        
+        word/document.xml is parsed incrementally straight from the zip and
+        each element is freed once read, so memory stays flat however long
+        the document is. Merged table cells are read once.
+        
+        Args:
+            file_path: Path to the DOCX file
             
-            return text.strip()
+        Yields:
+            The text of each body paragraph, and of each table row with its
+            cells separated by spaces
+        """
+        from lxml import etree
+
+        try:
+            with zipfile.ZipFile(file_path) as archive, archive.open('word/document.xml') as xml:
+                cells: List[List[str]] = []  # Paragraphs of the table cells being read, innermost last
+                rows: List[List[str]] = []  # Cell texts of the table rows being read, innermost last
+                for event, element in etree.iterparse(
+                    xml, events=('start', 'end'), tag=(f'{_W}p', f'{_W}tc', f'{_W}tr'), huge_tree=True
+                ):
+                    if event == 'start':
+                        if element.tag == f'{_W}tc':
+                            cells.append([])
+                        elif element.tag == f'{_W}tr':
+                            rows.append([])
+                        continue
+                    
+                    if element.tag == f'{_W}p':
+                        text = _paragraph_text(element)
+                        if cells:
+                            cells[-1].append(text)
+                        else:
+                            yield text
+                    elif element.tag == f'{_W}tc':
+                        text = ' '.join(part for part in cells.pop() if part.strip())
+                        if text and not _is_merged_continuation(element):
+                            rows[-1].append(text)
+                    else:
+                        row = rows.pop()
+                        if row:
+                            # A row of a nested table belongs to its enclosing cell
+                            if cells:
+                                cells[-1].append(' '.join(row))
+                            else:
+                                yield ' '.join(row)
+                    
+                    # Free the element, and the body blocks already read before
+                    # it; inside tables, the cell properties merged cells are
+                    # recognised by must stay
+                    element.clear()
+                    parent = element.getparent()
+                    if parent is not None and parent.tag == f'{_W}body':
+                        while element.getprevious() is not None:
+                            del parent[0]
             
         except Exception as e:
             logger.error(f"Error extracting text from DOCX {file_path}: {str(e)}")
             raise ValueError(f"Failed to extract text from DOCX: {str(e)}")
     
+    @staticmethod
+    def extract_text_from_docx(file_path: str) -> str:
+        """
+        Extract text content from a DOCX file
+        
+        Args:
+            file_path: Path to the DOCX file
+            
+        Returns:
+            Extracted text content
+        """
+        return '\n'.join(DocumentProcessor.iter_docx_blocks(file_path)).strip()
+    
+    @staticmethod
+    def iter_document(file_path: str, file_type: str, workers: Optional[int] = None
+                      ) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Stream the text of a stored file in document order, for
+        TextChunker.chunk_parts; joined and stripped, the parts are the text
+        process_document returns
+        
+        Args:
+            file_path: Path to the file
+            file_type: Type of document ('text', 'pdf', 'docx')
+            workers: Number of PDF extraction processes, see iter_pdf_pages
+            
+        Yields:
+            (text, page metadata) pairs; the metadata is set on each PDF
+            page and None for other parts
+        """
+        if file_type == 'pdf':
+            for page in DocumentProcessor.iter_pdf_pages(file_path, workers):
+                yield page.text, page.metadata
+        elif file_type == 'docx':
+            for i, block in enumerate(DocumentProcessor.iter_docx_blocks(file_path)):
+                yield (f"\n{block}" if i else block), None
+        elif file_type == 'text':
+            for part in DocumentProcessor.iter_text_file(file_path):
+                yield part, None
+        else:
+            raise ValueError(f"Unsupported file type: {file_type}")
+    
+    @staticmethod
+    def iter_text_file(file_path: str) -> Iterator[str]:
+        """
+        Stream the text of a plain text file, decoded as UTF-8 with
+        undecodable bytes replaced and line endings kept as they are
+        
+        Args:
+            file_path: Path to the text file
+            
+        Yields:
+            The text, TEXT_READ_CHARS characters at a time
+        """
+        with open(file_path, encoding='utf-8', errors='replace', newline='') as f:
+            yield from iter(lambda: f.read(TEXT_READ_CHARS), '')
+    
+    @staticmethod
+    def extract_text_from_txt(file_path: str) -> str:
+        """
+        Extract text content from a plain text file
+        
+        Args:
+            file_path: Path to the text file
+            
+        Returns:
+            Extracted text content
+        """
+        return ''.join(DocumentProcessor.iter_text_file(file_path)).strip()
+    
     @staticmethod
     def process_document(file_path: Optional[str] = None, content: Optional[str] = None, 
                         file_type: str = 'text') -> str:
@@ -80,16 +356,21 @@ class DocumentProcessor:
         
         Args:
             file_path: Path to the file (for file uploads)
-            content: Direct text content (for text input)
+            content: Direct text content (for text input); text documents
+                     without it are read from file_path
             file_type: Type of document ('text', 'pdf', 'docx')
             
         Returns:
             Extracted text content
         """
         if file_type == 'text':
-            if content is None:
-                raise ValueError("Content is required for text type documents")
-            return content.strip()
+            if content is not None:
+                return content.strip()
+            if file_path is None:
+                raise ValueError("Content or a file path is required for text type documents")
+            if not os.path.exists(file_path):
+                raise ValueError(f"Text file not found: {file_path}")
+            return DocumentProcessor.extract_text_from_txt(file_path)
         
         elif file_type == 'pdf':
             if file_path is None:
@@ -128,5 +409,7 @@ class DocumentProcessor:
             return 'pdf'
         elif file_extension == '.docx':
             return 'docx'
+        elif file_extension == '.txt':
+            return 'text'
         else:
             raise ValueError(f"Unsupported file extension: {file_extension}") 
\ No newline at end of file
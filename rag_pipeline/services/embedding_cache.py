@@ -0,0 +1,316 @@
+"""
+Caches for chunk and query embeddings
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import List, Dict, Optional, Iterable, Any
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+
+from .embedding_codec import encode_embedding, decode_embedding
+from ..models import EmbeddingCacheEntry
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text before hashing so whitespace-only differences share an embedding
+    """
+    return ' '.join(text.split())
+
+
+def content_hash(text: str) -> str:
+    """
+    sha256 hex digest of the normalized text
+    """
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Database-backed store of embeddings keyed by (model, dimensions, content hash).
+
+    Hit, miss and eviction counters are kept per process and shared by every
+    cache instance.
+    """
+
+    _stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+    _stats_lock = threading.Lock()
+
+    def __init__(self, model: str, dimensions: Optional[int] = None, max_entries: Optional[int] = None):
+        """
+        Initialize the cache
+
+        Args:
+            model: Embedding model the cached vectors belong to
+            dimensions: Requested embedding dimensions (None for the model's native size)
+            max_entries: Maximum number of cached embeddings before the least
+                recently used are evicted (defaults to RAG_EMBEDDING_CACHE_MAX_ENTRIES)
+        """
+        self.model = model
+        self.dimensions = dimensions or 0
+        self.max_entries = max_entries if max_entries is not None else settings.RAG_EMBEDDING_CACHE_MAX_ENTRIES
+
+    @classmethod
+    def _count(cls, **counts) -> None:
+        with cls._stats_lock:
+            for key, value in counts.items():
+                cls._stats[key] += value
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        """
+        Process-wide cache counters
+        """
+        with cls._stats_lock:
+            stats = dict(cls._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _entries(self):
+        return EmbeddingCacheEntry.objects.filter(model=self.model, dimensions=self.dimensions)
+
+    def get_many(self, hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        Look up cached embeddings
+
+        Args:
+            hashes: Content hashes to look up
+
+        Returns:
+            Dictionary mapping each cached hash to its embedding
+        """
+        hashes = list(set(hashes))
+        if not hashes:
+            return {}
+
+        found = {}
+        for start in range(0, len(hashes), 500):
+            rows = self._entries().filter(content_hash__in=hashes[start:start + 500]).values_list('id', 'content_hash', 'embedding_data')
+            for entry_id, entry_hash, data in rows:
+                found[entry_hash] = (entry_id, decode_embedding(data))
+
+        if found:
+            self._entries().filter(id__in=[entry_id for entry_id, _ in found.values()]).update(
+                hit_count=F('hit_count') + 1, last_used_at=timezone.now()
+            )
+
+        self._count(hits=len(found), misses=len(hashes) - len(found))
+        return {entry_hash: embedding for entry_hash, (_, embedding) in found.items()}
+
+    def set_many(self, embeddings: Dict[str, List[float]]) -> None:
+        """
+        Store embeddings and evict the least recently used entries if the
+        cache has grown past its bound
+
+        Args:
+            embeddings: Dictionary mapping content hash to embedding
+        """
+        if not embeddings:
+            return
+
+        entries = [
+            EmbeddingCacheEntry(
+                model=self.model,
+                dimensions=self.dimensions,
+                content_hash=entry_hash,
+                embedding_data=encode_embedding(embedding)[0]
+            )
+            for entry_hash, embedding in embeddings.items()
+        ]
+        # Concurrent uploads of the same text may race; the first writer wins
+        EmbeddingCacheEntry.objects.bulk_create(entries, ignore_conflicts=True)
+        self._count(stores=len(entries))
+        self.evict(self.max_entries)
+
+    @classmethod
+    def evict(cls, max_entries: int) -> int:
+        """
+        Delete the least recently used entries beyond max_entries, across all models
+
+        Args:
+            max_entries: Maximum number of entries to keep
+
+        Returns:
+            Number of entries deleted
+        """
+        excess = EmbeddingCacheEntry.objects.count() - max_entries
+        if excess <= 0:
+            return 0
+
+        deleted = 0
+        while excess > 0:
+            batch = min(excess, 1000)
+            stale_ids = list(
+                EmbeddingCacheEntry.objects.order_by('last_used_at').values_list('id', flat=True)[:batch]
+            )
+            if not stale_ids:
+                break
+            count, _ = EmbeddingCacheEntry.objects.filter(id__in=stale_ids).delete()
+            deleted += count
+            excess -= batch
+
+        cls._count(evictions=deleted)
+        logger.info(f"Evicted {deleted} least recently used cached embeddings")
+        return deleted
+
+    @classmethod
+    def prune(cls, unused_days: Optional[int] = None, max_entries: Optional[int] = None) -> int:
+        """
+        Delete cached embeddings not used for a while and enforce the size bound
+
+        Args:
+            unused_days: Delete entries not used in this many days
+            max_entries: Entry bound to enforce afterwards
+
+        Returns:
+            Number of entries deleted
+        """
+        deleted = 0
+        if unused_days is not None:
+            cutoff = timezone.now() - timedelta(days=unused_days)
+            deleted, _ = EmbeddingCacheEntry.objects.filter(last_used_at__lt=cutoff).delete()
+            cls._count(evictions=deleted)
+        if max_entries is not None:
+            deleted += cls.evict(max_entries)
+        return deleted
+
+
+class QueryEmbeddingCache:
+    """
+    Two-level cache of query embeddings keyed by model, dimensions and text.
+
+    Level one is a bounded in-process LRU. Level two is the Django cache named
+    by RAG_QUERY_EMBEDDING_CACHE_ALIAS, a file-based cache by default, so
+    every worker process on the host shares embeddings of repeated prompts.
+    Both levels expire entries after RAG_QUERY_EMBEDDING_CACHE_TTL seconds.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[int] = None, alias: Optional[str] = None):
+        """
+        Initialize the cache
+
+        Args:
+            max_entries: Size of the in-process LRU (defaults to RAG_QUERY_EMBEDDING_CACHE_SIZE)
+            ttl: Entry lifetime in seconds (defaults to RAG_QUERY_EMBEDDING_CACHE_TTL)
+            alias: Django cache alias for the shared tier (defaults to RAG_QUERY_EMBEDDING_CACHE_ALIAS)
+        """
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._alias = alias
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0, 'l1_evictions': 0, 'l1_expirations': 0}
+
+    @property
+    def max_entries(self) -> int:
+        return self._max_entries if self._max_entries is not None else settings.RAG_QUERY_EMBEDDING_CACHE_SIZE
+
+    @property
+    def ttl(self) -> int:
+        return self._ttl if self._ttl is not None else settings.RAG_QUERY_EMBEDDING_CACHE_TTL
+
+    @property
+    def shared(self):
+        return caches[self._alias or settings.RAG_QUERY_EMBEDDING_CACHE_ALIAS]
+
+    @staticmethod
+    def key(model: str, dimensions: Optional[int], text: str) -> str:
+        """
+        Cache key for a query embedding
+        """
+        return f"query-embedding:{model}:{dimensions or 0}:{content_hash(text)}"
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        Look up a query embedding, promoting shared-tier hits into the LRU
+
+        Args:
+            key: Key from QueryEmbeddingCache.key
+
+        Returns:
+            Embedding, or None on a miss
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, embedding = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['l1_hits'] += 1
+                    return embedding
+                del self._entries[key]
+                self._stats['l1_expirations'] += 1
+
+        try:
+            data = self.shared.get(key)
+        except Exception as e:
+            logger.warning(f"Shared query embedding cache lookup failed: {str(e)}")
+            data = None
+
+        with self._lock:
+            if data is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['l2_hits'] += 1
+
+        embedding = decode_embedding(data)
+        self._remember(key, embedding)
+        return embedding
+
+    def set(self, key: str, embedding: List[float]) -> None:
+        """
+        Store a query embedding in both levels
+
+        Args:
+            key: Key from QueryEmbeddingCache.key
+            embedding: Embedding vector
+        """
+        data, _ = encode_embedding(embedding)
+        try:
+            self.shared.set(key, data, timeout=self.ttl)
+        except Exception as e:
+            logger.warning(f"Shared query embedding cache store failed: {str(e)}")
+        self._remember(key, decode_embedding(data))
+
+    def _remember(self, key: str, embedding: np.ndarray) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['l1_evictions'] += 1
+
+    def clear(self) -> None:
+        """
+        Drop every entry from the in-process level
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Counters for both levels of this process's cache
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['l1_size'] = len(self._entries)
+        stats['l1_max_entries'] = self.max_entries
+        stats['ttl_seconds'] = self.ttl
+        lookups = stats['l1_hits'] + stats['l2_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['l1_hits'] + stats['l2_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+query_embedding_cache = QueryEmbeddingCache()
@@ -0,0 +1,97 @@
+"""
+Compact binary encoding for embedding vectors stored on DocumentChunk
+"""
+from typing import List, Tuple, Union
+
+import numpy as np
+
+# Storage dtypes are always little-endian so blobs are portable across hosts
+EMBEDDING_DTYPES = {
+    'float32': np.dtype('<f4'),
+    'float16': np.dtype('<f2'),
+}
+
+DEFAULT_EMBEDDING_DTYPE = 'float32'
+
+
+def _storage_dtype(dtype: str) -> np.dtype:
+    try:
+        return EMBEDDING_DTYPES[dtype]
+    except KeyError:
+        raise ValueError(f"Unsupported embedding storage dtype: {dtype}")
+
+
+def encode_embedding(embedding: Union[List[float], np.ndarray],
+                     dtype: str = DEFAULT_EMBEDDING_DTYPE) -> Tuple[bytes, float]:
+    """
+    Encode an embedding vector as raw little-endian bytes
+
+    Args:
+        embedding: Embedding vector
+        dtype: Storage dtype ('float32' or 'float16')
+
+    Returns:
+        Tuple of (encoded bytes, L2 norm of the original vector)
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    if vector.ndim != 1:
+        raise ValueError(f"Embedding must be one-dimensional, got shape {vector.shape}")
+    norm = float(np.linalg.norm(vector))
+    return vector.astype(_storage_dtype(dtype)).tobytes(), norm
+
+
+def decode_embedding(data: Union[bytes, memoryview],
+                     dtype: str = DEFAULT_EMBEDDING_DTYPE) -> np.ndarray:
+    """
+    Decode an embedding blob without copying it
+
+    Args:
+        data: Bytes produced by encode_embedding
+        dtype: Storage dtype the blob was encoded with
+
+    Returns:
+        Read-only numpy view over the blob
+    """
+    return np.frombuffer(data, dtype=_storage_dtype(dtype))
+
+
+def decode_embeddings(blobs: List[Union[bytes, memoryview]], dimensions: int,
+                      dtype: str = DEFAULT_EMBEDDING_DTYPE) -> np.ndarray:
+    """
+    Decode many equally sized embedding blobs into one (n, dimensions) float32 matrix
+
+    Args:
+        blobs: Blobs produced by encode_embedding
+        dimensions: Number of dimensions in each vector
+        dtype: Storage dtype the blobs were encoded with
+
+    Returns:
+        Contiguous float32 matrix with one row per blob
+    """
+    if not blobs:
+        return np.empty((0, dimensions), dtype=np.float32)
+    matrix = np.frombuffer(b''.join(blobs), dtype=_storage_dtype(dtype)).reshape(len(blobs), dimensions)
+    return matrix.astype(np.float32)
+
+
+def truncate_embedding(embedding: Union[List[float], np.ndarray], dimensions: int) -> np.ndarray:
+    """
+    Shorten an embedding to its first dimensions and rescale it to unit length
+
+    Only meaningful for models trained so that their leading dimensions carry
+    most of the information (e.g. OpenAI's text-embedding-3 models), where this
+    matches asking the API for fewer dimensions.
+
+    Args:
+        embedding: Embedding vector
+        dimensions: Number of leading dimensions to keep
+
+    Returns:
+        Unit-length float32 vector of length dimensions
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    if dimensions > vector.shape[0]:
+        raise ValueError(f"Cannot truncate a {vector.shape[0]}-dimensional embedding to {dimensions} dimensions")
+    truncated = vector[:dimensions].copy()
+    norm = float(np.linalg.norm(truncated))
+    return truncated / norm if norm > 0 else truncated
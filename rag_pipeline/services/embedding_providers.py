@@ -0,0 +1,196 @@
+"""
+Embedding providers: the OpenAI API, or a local CPU model for offline use
+"""
+import os
+from abc import ABC, abstractmethod
+from typing import List, Optional, NamedTuple, Dict, Tuple, Type
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingSpace(NamedTuple):
+    """
+    Identifies the vector space embeddings live in; vectors from different
+    spaces cannot be compared
+    """
+    provider: str
+    model: str
+    dimensions: Optional[int]
+
+
+class EmbeddingProvider(ABC):
+    """
+    Turns texts into embedding vectors. Subclasses set name and model and
+    implement embed.
+
+    max_batch_size and max_batch_tokens bound a single embed call (None for
+    no limit); retryable_errors are the exceptions worth retrying.
+    """
+
+    name = ''
+    max_batch_size: Optional[int] = None
+    max_batch_tokens: Optional[int] = None
+    retryable_errors: Tuple[Type[BaseException], ...] = ()
+    # Size of each known model's embeddings when no dimensions are requested
+    native_dimensions: Dict[str, int] = {}
+
+    def __init__(self, model: str, dimensions: Optional[int] = None):
+        self.model = model
+        self.dimensions = dimensions
+
+    @property
+    def space(self) -> EmbeddingSpace:
+        """
+        The provider's embedding space; dimensions is None only for a model
+        of unknown native size
+        """
+        return EmbeddingSpace(self.name, self.model, self.dimensions or self.native_dimensions.get(self.model))
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            One embedding vector per text, in order
+        """
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeddings from the OpenAI API
+    """
+
+    name = 'openai'
+    default_model = 'text-embedding-3-small'
+    # The API accepts up to 2048 inputs and 300k tokens per request; the token
+    # budget leaves headroom for the estimate being low
+    max_batch_size = 2048
+    max_batch_tokens = 250_000
+    native_dimensions = {
+        'text-embedding-3-small': 1536,
+        'text-embedding-3-large': 3072,
+        'text-embedding-ada-002': 1536,
+    }
+
+    def __init__(self, model: Optional[str] = None, dimensions: Optional[int] = None, api_key: Optional[str] = None):
+        """
+        Initialize the provider
+
+        Args:
+            model: OpenAI embedding model to use
+            dimensions: Requested embedding dimensions (None for the model's native size)
+            api_key: OpenAI API key (if not provided, will use environment variable)
+        """
+        super().__init__(model or self.default_model, dimensions)
+        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
+        if not self.api_key:
+            raise ValueError("OpenAI API key is required. Set OPENAI_API_KEY environment variable or pass api_key parameter.")
+
+        import openai
+        self.retryable_errors = (
+            openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError
+        )
+
+    @property
+    def client(self):
+        """
+        OpenAI client on the process's shared connection pool; retries are
+        done per sub-batch by EmbeddingService
+        """
+        from .openai_client import get_openai_client
+        return get_openai_client(api_key=self.api_key, max_retries=0)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        from .openai_client import request_timeout
+
+        options = {'dimensions': self.dimensions} if self.dimensions else {}
+        response = self.client.embeddings.create(
+            model=self.model, input=texts, timeout=request_timeout(settings.OPENAI_EMBEDDING_TIMEOUT), **options
+        )
+        return [data.embedding for data in response.data]
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeddings computed on the CPU with scikit-learn, for offline and
+    air-gapped use.
+
+    Character n-grams are hashed into a sparse feature vector and projected
+    to a dense vector by a seeded sparse random projection. Nothing is
+    fitted to the corpus, so the same text always gets the same embedding
+    in every process and no model file has to be shipped. Quality is lexical
+    rather than semantic.
+    """
+
+    name = 'local'
+    default_dimensions = 384
+
+    def __init__(self, model: Optional[str] = None, dimensions: Optional[int] = None,
+                 n_features: int = 2 ** 20, seed: int = 0, **kwargs):
+        """
+        Initialize the provider
+
+        Args:
+            model: Name to record on embeddings (derived from the settings if not given)
+            dimensions: Embedding dimensions
+            n_features: Size of the hashed n-gram space
+            seed: Random projection seed; changing it changes every embedding
+        """
+        dimensions = dimensions or self.default_dimensions
+        super().__init__(model or f"hashing-char3-5-rp{seed}", dimensions)
+
+        from scipy.sparse import csr_matrix
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.random_projection import SparseRandomProjection
+
+        self.vectorizer = HashingVectorizer(
+            analyzer='char_wb', ngram_range=(3, 5), n_features=n_features,
+            alternate_sign=False, norm='l2'
+        )
+        # The projection only depends on the input width and the seed
+        self.projection = SparseRandomProjection(n_components=dimensions, random_state=seed, dense_output=True)
+        self.projection.fit(csr_matrix((1, n_features), dtype=np.float32))
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        vectors = self.projection.transform(self.vectorizer.transform(texts)).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).tolist()
+
+
+EMBEDDING_PROVIDERS: Dict[str, Type[EmbeddingProvider]] = {
+    OpenAIEmbeddingProvider.name: OpenAIEmbeddingProvider,
+    LocalEmbeddingProvider.name: LocalEmbeddingProvider,
+}
+
+
+def get_embedding_provider(name: str, **kwargs) -> EmbeddingProvider:
+    """
+    Create an embedding provider
+
+    Args:
+        name: Registered provider name ('openai', 'local') or dotted path to
+              an EmbeddingProvider subclass
+        **kwargs: Passed to the provider (model, dimensions, api_key)
+
+    Returns:
+        EmbeddingProvider instance
+    """
+    provider_class = EMBEDDING_PROVIDERS.get(name)
+    if provider_class is None:
+        try:
+            provider_class = import_string(name)
+        except ImportError:
+            raise ValueError(f"Unknown embedding provider: {name}")
+    return provider_class(**kwargs)
@@ -1,34 +1,118 @@
 """
-Embedding service for generating vector embeddings using OpenAI API
+Embedding service for generating vector embeddings with a configurable provider
 """
-import os
-import openai
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import List, Dict, Any, Optional, Union, Callable, Tuple
 import logging
 import numpy as np
+from django.conf import settings
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+from .embedding_cache import EmbeddingCache, content_hash, query_embedding_cache
+from .embedding_providers import EmbeddingProvider, EmbeddingSpace, get_embedding_provider
 
 logger = logging.getLogger(__name__)
 
+# (provider, model) -> size of the embeddings seen from models whose provider
+# does not know their native size
+_observed_dimensions: Dict[Tuple[str, str], int] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count of a text. English averages about four characters per
+    token; three is used so the estimate errs high.
+    """
+    return len(text) // 3 + 1
+
+
+def plan_batches(texts: List[str], max_items: Optional[int] = None,
+                 max_tokens: Optional[int] = None) -> List[range]:
+    """
+    Split texts into consecutive batches of at most max_items texts and
+    max_tokens estimated tokens. A text over the token budget gets a batch
+    of its own.
+    
+    Args:
+        texts: Texts to embed
+        max_items: Maximum texts per batch (None for no limit)
+        max_tokens: Maximum estimated tokens per batch (None for no limit)
+        
+    Returns:
+        Index ranges into texts, in order
+    """
+    batches = []
+    start, tokens = 0, 0
+    for i, text in enumerate(texts):
+        text_tokens = estimate_tokens(text)
+        full = (max_items is not None and i - start >= max_items) or \
+               (max_tokens is not None and tokens + text_tokens > max_tokens)
+        if full and i > start:
+            batches.append(range(start, i))
+            start, tokens = i, 0
+        tokens += text_tokens
+    if start < len(texts):
+        batches.append(range(start, len(texts)))
+    return batches
+
 
 class EmbeddingService:
     """
-    Service for generating embeddings using OpenAI API
+    Service for generating embeddings with the provider named by
+    RAG_EMBEDDING_PROVIDER (the OpenAI API by default)
     """
     
-    def __init__(self, api_key: Optional[str] = None, model: str = "text-embedding-3-small"):
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None,
+                 use_cache: bool = True, provider: Union[str, EmbeddingProvider, None] = None,
+                 dimensions: Optional[int] = None):
         """
         Initialize the embedding service
         
         Args:
             api_key: OpenAI API key (if not provided, will use environment variable)
-            model: OpenAI embedding model to use
+            model: Embedding model to use (defaults to RAG_EMBEDDING_MODEL or the provider's default)
+            use_cache: Whether to reuse stored embeddings of identical chunk text
+            provider: Provider name or instance (defaults to RAG_EMBEDDING_PROVIDER)
+            dimensions: Embedding dimensions (defaults to RAG_EMBEDDING_DIMENSIONS)
         """
-        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
-        if not self.api_key:
-            raise ValueError("OpenAI API key is required. Set OPENAI_API_KEY environment variable or pass api_key parameter.")
+        if not isinstance(provider, EmbeddingProvider):
+            options = {
+                'model': model or settings.RAG_EMBEDDING_MODEL,
+                'dimensions': dimensions or settings.RAG_EMBEDDING_DIMENSIONS,
+            }
+            if api_key:
+                options['api_key'] = api_key
+            provider = get_embedding_provider(provider or settings.RAG_EMBEDDING_PROVIDER, **options)
         
-        self.model = model
-        self.client = openai.OpenAI(api_key=self.api_key)
+        self.provider = provider
+        self.model = provider.model
+        self.cache = EmbeddingCache(self.model, provider.dimensions) if use_cache and settings.RAG_EMBEDDING_CACHE_ENABLED else None
+        self.query_cache = query_embedding_cache if use_cache else None
+    
+    @property
+    def client(self):
+        """
+        The provider's API client, if it has one
+        """
+        return getattr(self.provider, 'client', None)
+
+    @property
+    def space(self) -> EmbeddingSpace:
+        """
+        Provider, model and dimensions of the embeddings this service produces
+
+        The size of a model the provider does not know is taken from the
+        first embedding it returned, embedding a probe text if none has been
+        made yet.
+        """
+        space = self.provider.space
+        if space.dimensions is None:
+            key = (space.provider, space.model)
+            if key not in _observed_dimensions:
+                self._embed_with_retry(['dimensions'])
+            space = space._replace(dimensions=_observed_dimensions[key])
+        return space
     
     def generate_embedding(self, text: str) -> List[float]:
         """
@@ -42,11 +126,7 @@ class EmbeddingService:
         """
         try:
             logger.info(f"🔍 RAG DEBUG: Generating embedding for text: '{text[:100]}...'")
-            response = self.client.embeddings.create(
-                model=self.model,
-                input=text
-            )
-            embedding = response.data[0].embedding
+            embedding = self._embed_with_retry([text])[0]
             logger.info(f"🔍 RAG DEBUG: Generated embedding with {len(embedding)} dimensions")
             return embedding
             
@@ -54,23 +134,32 @@ class EmbeddingService:
             logger.error(f"🔍 RAG DEBUG: Error generating embedding: {str(e)}")
             raise ValueError(f"Failed to generate embedding: {str(e)}")
     
-    def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+    def generate_embeddings_batch(self, texts: List[str],
+                                  progress: Optional[Callable[[int, int], None]] = None) -> List[List[float]]:
         """
-        Generate embeddings for multiple texts in a batch
+        Generate embeddings for multiple texts, split into sub-batches within
+        the provider's request limits that are sent concurrently
         
         Args:
             texts: List of texts to embed
+            progress: Optional callable receiving (texts embedded, total) as
+                      sub-batches complete
             
         Returns:
-            List of embedding vectors
+            List of embedding vectors in the same order as texts
         """
         try:
-            logger.info(f"🔍 RAG DEBUG: Generating batch embeddings for {len(texts)} texts")
-            response = self.client.embeddings.create(
-                model=self.model,
-                input=texts
-            )
-            embeddings = [data.embedding for data in response.data]
+            batches = plan_batches(texts, self.provider.max_batch_size, self.provider.max_batch_tokens)
+            logger.info(f"🔍 RAG DEBUG: Generating batch embeddings for {len(texts)} texts in {len(batches)} requests")
+            workers = min(max(settings.RAG_EMBEDDING_CONCURRENCY, 1), len(batches))
+            embed = lambda batch: self._embed_with_retry(texts[batch.start:batch.stop])
+            embeddings = []
+            # Queries are a single small batch and skip the thread pool
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='embed') if workers > 1 else nullcontext() as executor:
+                for result in (executor.map(embed, batches) if executor else map(embed, batches)):
+                    embeddings.extend(result)
+                    if progress is not None:
+                        progress(len(embeddings), len(texts))
             logger.info(f"🔍 RAG DEBUG: Generated {len(embeddings)} embeddings with {len(embeddings[0]) if embeddings else 0} dimensions each")
             return embeddings
             
@@ -78,12 +167,80 @@ class EmbeddingService:
             logger.error(f"🔍 RAG DEBUG: Error generating batch embeddings: {str(e)}")
             raise ValueError(f"Failed to generate batch embeddings: {str(e)}")
     
-    def embed_chunks(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _embed_with_retry(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed one sub-batch, backing off exponentially on the provider's
+        retryable errors
+        """
+        retrying = Retrying(
+            retry=retry_if_exception_type(self.provider.retryable_errors),
+            stop=stop_after_attempt(max(settings.RAG_EMBEDDING_MAX_RETRIES, 0) + 1),
+            wait=wait_random_exponential(multiplier=0.5, max=30),
+            before_sleep=lambda state: logger.warning(
+                f"Embedding request for {len(texts)} texts failed ({state.outcome.exception()}), "
+                f"retry {state.attempt_number}"
+            ),
+            reraise=True,
+        )
+        embeddings = retrying(self.provider.embed, texts)
+        if len(embeddings) != len(texts):
+            raise ValueError(f"Provider returned {len(embeddings)} embeddings for {len(texts)} texts")
+        if embeddings and self.provider.space.dimensions is None:
+            _observed_dimensions.setdefault((self.provider.name, self.model), len(embeddings[0]))
+        return embeddings
+    
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Generate the embedding for a search query, reusing cached query embeddings
+        
+        Args:
+            text: Query text
+            
+        Returns:
+            Embedding vector
+        """
+        return self.embed_queries([text])[0]
+    
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generate embeddings for search queries, sending only cache misses to
+        the provider in a single batch
+        
+        Args:
+            texts: Query texts
+            
+        Returns:
+            List of embedding vectors in the same order as texts
+        """
+        if self.query_cache is None:
+            return self.generate_embeddings_batch(texts)
+        
+        keys = [self.query_cache.key(self.model, self.provider.dimensions, text) for text in texts]
+        embeddings = {key: self.query_cache.get(key) for key in set(keys)}
+        
+        missing = {}
+        for key, text in zip(keys, texts):
+            if embeddings[key] is None:
+                missing.setdefault(key, text)
+        
+        if missing:
+            generated = self.generate_embeddings_batch(list(missing.values()))
+            for key, embedding in zip(missing.keys(), generated):
+                self.query_cache.set(key, embedding)
+                embeddings[key] = embedding
+        
+        logger.info(f"🔍 RAG DEBUG: Embedded {len(texts)} queries ({len(missing)} new, the rest from cache)")
+        return [embeddings[key] for key in keys]
+    
+    def embed_chunks(self, chunks: List[Dict[str, Any]],
+                     progress: Optional[Callable[[int, int], None]] = None) -> List[Dict[str, Any]]:
         """
         Generate embeddings for a list of text chunks
         
         Args:
             chunks: List of chunk dictionaries with 'content' key
+            progress: Optional callable receiving (chunks embedded, total);
+                      chunks found in the cache count as embedded
             
         Returns:
             List of chunk dictionaries with added 'embedding' key
@@ -91,21 +248,59 @@ class EmbeddingService:
         try:
             # Extract text content from chunks
             texts = [chunk['content'] for chunk in chunks]
+            hashes = [content_hash(text) for text in texts]
+            
+            # Reuse stored embeddings of identical text
+            embeddings_by_hash = self._get_cached(hashes)
             
-            # Generate embeddings in batch
-            embeddings = self.generate_embeddings_batch(texts)
+            # Generate embeddings in batch for the remaining unique texts
+            missing = {}
+            for text_hash, text in zip(hashes, texts):
+                if text_hash not in embeddings_by_hash:
+                    missing.setdefault(text_hash, text)
+            
+            cached = len(chunks) - len(missing)
+            report = (lambda done, total: progress(cached + done, len(chunks))) if progress is not None else None
+            if missing:
+                generated = dict(zip(missing.keys(), self.generate_embeddings_batch(list(missing.values()), progress=report)))
+                self._set_cached(generated)
+                embeddings_by_hash.update(generated)
             
             # Add embeddings to chunks
-            for i, chunk in enumerate(chunks):
-                chunk['embedding'] = embeddings[i]
+            for chunk, text_hash in zip(chunks, hashes):
+                chunk['embedding'] = embeddings_by_hash[text_hash]
+                chunk['content_hash'] = text_hash
             
-            logger.info(f"Generated embeddings for {len(chunks)} chunks")
+            logger.info(f"Generated embeddings for {len(chunks)} chunks ({len(missing)} new, the rest from cache)")
             return chunks
             
         except Exception as e:
             logger.error(f"Error embedding chunks: {str(e)}")
             raise ValueError(f"Failed to embed chunks: {str(e)}")
     
+    def _get_cached(self, hashes: List[str]) -> Dict[str, Any]:
+        """
+        Look up cached embeddings, treating cache errors as misses
+        """
+        if self.cache is None:
+            return {}
+        try:
+            return self.cache.get_many(hashes)
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {str(e)}")
+            return {}
+    
+    def _set_cached(self, embeddings: Dict[str, List[float]]) -> None:
+        """
+        Store embeddings in the cache, ignoring cache errors
+        """
+        if self.cache is None:
+            return
+        try:
+            self.cache.set_many(embeddings)
+        except Exception as e:
+            logger.warning(f"Embedding cache store failed: {str(e)}")
+    
     def cosine_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
         """
         Calculate cosine similarity between two embeddings
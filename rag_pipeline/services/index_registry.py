@@ -0,0 +1,289 @@
+"""
+Process-wide registry of resident vector indexes, one per retrieval scope
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Optional, Any, Callable
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .vector_index import VectorIndex, RetrievalScope, ALL_DOCUMENTS
+from .ann_index import IVFIndex
+from .quantization import QuantizedIndex
+from .vector_shards import vector_shard_store
+from .embedding_codec import decode_embedding
+from ..models import Document, DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+
+def load_chunk_vectors(chunk_ids: List[str]) -> Tuple[List[str], np.ndarray]:
+    """
+    Load unit-length float embeddings of chunks from the database
+
+    Args:
+        chunk_ids: Chunks to load
+
+    Returns:
+        Tuple of (IDs of the chunks found, matrix with one row per found chunk)
+    """
+    found_ids = []
+    vectors = []
+    for start in range(0, len(chunk_ids), 500):
+        rows = DocumentChunk.objects.filter(
+            id__in=chunk_ids[start:start + 500], embedding_data__isnull=False
+        ).values_list('id', 'embedding_data', 'embedding_dtype', 'embedding_norm')
+        for chunk_id, data, dtype, norm in rows:
+            found_ids.append(str(chunk_id))
+            vectors.append(decode_embedding(data, dtype).astype(np.float32) / (norm or 1.0))
+    if not vectors:
+        return [], np.empty((0, 0), dtype=np.float32)
+    return found_ids, np.vstack(vectors)
+
+
+class VectorIndexRegistry:
+    """
+    Process-wide LRU cache of vector indexes, one per retrieval scope.
+
+    The scope's document filter is applied in SQL, so only the scope's
+    vectors are ever loaded. With RAG_VECTOR_SHARDS_ENABLED, vectors are
+    memory-mapped from per-template shards instead of decoded from the
+    database. Each index remembers a cheap fingerprint of the
+    documents it was built from, so changes made by other worker processes
+    are picked up on the next query. Changes made in this process are applied
+    to cached indexes in place.
+
+    Scopes with at least RAG_ANN_MIN_VECTORS chunks get an IVF index whose
+    trained lists are persisted under RAG_VECTOR_INDEX_DIR; smaller scopes
+    use exact search. With RAG_INDEX_QUANTIZATION set, every scope instead
+    keeps only compressed codes resident and re-scores candidates from the
+    float embeddings in the database.
+    """
+
+    def __init__(self):
+        self._indexes: 'OrderedDict[RetrievalScope, VectorIndex]' = OrderedDict()
+        self._locks: Dict[RetrievalScope, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprint(scope: RetrievalScope) -> Tuple[int, Any]:
+        """
+        Fingerprint of the documents in a scope; changes whenever a document
+        is added, deleted or has its chunks rewritten
+        """
+        stats = Document.objects.filter(**scope.document_filter()).aggregate(
+            count=Count('id'), latest=Max('updated_at')
+        )
+        return (stats['count'], stats['latest'])
+
+    @staticmethod
+    def _ann_path(scope: RetrievalScope) -> str:
+        digest = hashlib.sha1(str(scope).encode('utf-8')).hexdigest()
+        return os.path.join(settings.RAG_VECTOR_INDEX_DIR, f"ivf-{digest}.npz")
+
+    def _scope_lock(self, scope: RetrievalScope) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(scope, threading.Lock())
+
+    def _cached(self, scope: RetrievalScope, fingerprint: Any) -> Optional[VectorIndex]:
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is None or index.fingerprint != fingerprint:
+                return None
+            self._indexes.move_to_end(scope)
+            return index
+
+    def _store(self, scope: RetrievalScope, index: VectorIndex) -> None:
+        with self._lock:
+            self._indexes[scope] = index
+            self._indexes.move_to_end(scope)
+            while len(self._indexes) > settings.RAG_VECTOR_INDEX_CACHE_SIZE:
+                evicted, _ = self._indexes.popitem(last=False)
+                self._locks.pop(evicted, None)
+
+    def get_index(self, scope: RetrievalScope = ALL_DOCUMENTS) -> VectorIndex:
+        """
+        Get the index for a scope, building or rebuilding it if stale
+
+        Args:
+            scope: Documents to include in the index (all chunks by default)
+
+        Returns:
+            VectorIndex, IVFIndex or QuantizedIndex for the scope
+        """
+        fingerprint = self._fingerprint(scope)
+        index = self._cached(scope, fingerprint)
+        if index is not None:
+            return index
+
+        with self._scope_lock(scope):
+            index = self._cached(scope, fingerprint)
+            if index is not None:
+                return index
+
+            index = self._build(scope, fingerprint)
+            self._store(scope, index)
+            logger.info(f"🔍 RAG DEBUG: Built {type(index).__name__} for scope '{scope}' with {len(index)} chunks")
+            return index
+
+    def _build(self, scope: RetrievalScope, fingerprint: Any) -> VectorIndex:
+        if settings.RAG_VECTOR_SHARDS_ENABLED:
+            index = vector_shard_store.load_index(scope, fingerprint)
+        else:
+            chunks = DocumentChunk.objects.filter(**scope.document_filter(prefix='document__'))
+            index = VectorIndex.from_queryset(chunks, fingerprint)
+        if settings.RAG_INDEX_QUANTIZATION != 'none' and len(index):
+            return QuantizedIndex.train(
+                index, settings.RAG_INDEX_QUANTIZATION, subspaces=settings.RAG_PQ_SUBSPACES,
+                vector_loader=load_chunk_vectors, rerank_factor=settings.RAG_INDEX_RERANK_FACTOR
+            )
+        if not settings.RAG_ANN_ENABLED or len(index) < settings.RAG_ANN_MIN_VECTORS:
+            return index
+
+        path = self._ann_path(scope)
+        ivf = IVFIndex.load(index, path, n_probe=settings.RAG_ANN_NPROBE)
+        if ivf is None or ivf.needs_retrain():
+            ivf = IVFIndex.train(index, n_lists=settings.RAG_ANN_LISTS, n_probe=settings.RAG_ANN_NPROBE)
+            try:
+                ivf.save(path)
+            except OSError as e:
+                logger.warning(f"Could not persist IVF index for scope '{scope}': {str(e)}")
+        return ivf
+
+    def _matching(self, document: Document) -> List[Tuple[RetrievalScope, VectorIndex]]:
+        with self._lock:
+            return [(scope, index) for scope, index in self._indexes.items() if scope.matches(document)]
+
+    def _reconcile(self, scope: RetrievalScope, index: VectorIndex,
+                   accept: Callable[[Tuple[int, Any], Tuple[int, Any]], bool]) -> None:
+        """
+        After an in-place update, adopt the scope's new fingerprint if it is
+        explained by that update alone; otherwise another process changed the
+        scope too, so drop the index and let the next query rebuild it.
+        """
+        previous = index.fingerprint
+        current = self._fingerprint(scope)
+        if previous is not None and accept(previous, current) and not (isinstance(index, IVFIndex) and index.needs_retrain()):
+            index.fingerprint = current
+        else:
+            self._drop(scope, index)
+
+    def _drop(self, scope: RetrievalScope, index: VectorIndex) -> None:
+        with self._lock:
+            if self._indexes.get(scope) is index:
+                del self._indexes[scope]
+
+    def update_document(self, document: Document, chunk_ids: List[str], embeddings: List[List[float]]) -> None:
+        """
+        Replace a document's chunks in every cached index covering it
+
+        Args:
+            document: Document whose chunks were rewritten (updated_at already bumped)
+            chunk_ids: IDs of the document's new chunks
+            embeddings: Embeddings of the new chunks
+        """
+        if settings.RAG_VECTOR_SHARDS_ENABLED:
+            try:
+                vector_shard_store.write_document(document, chunk_ids, embeddings)
+            except OSError as e:
+                # The shard re-syncs the document from the database on the next build
+                logger.warning(f"Could not write document {document.id} to its vector shard: {str(e)}")
+
+        for scope, index in self._matching(document):
+            if index.is_mapped:
+                # Appending would copy the mapped rows onto the heap; map the
+                # updated shard on the next query instead
+                self._drop(scope, index)
+                continue
+            index.remove_documents([document.id])
+            if chunk_ids:
+                index.add(chunk_ids, [str(document.id)] * len(chunk_ids), np.asarray(embeddings, dtype=np.float32))
+            self._reconcile(scope, index, lambda previous, current: (
+                current[1] == document.updated_at and current[0] in (previous[0], previous[0] + 1)
+            ))
+
+    def update_chunks(self, document: Document, removed_chunk_ids: List[str],
+                      added_chunk_ids: List[str], added_embeddings: List[List[float]]) -> None:
+        """
+        Apply an incremental change to a document's chunks in every cached
+        index covering it: removed chunks are tombstoned and added chunks
+        appended, unchanged chunks are left where they are
+
+        Args:
+            document: Document whose chunks changed (updated_at already bumped)
+            removed_chunk_ids: IDs of chunks deleted from the document
+            added_chunk_ids: IDs of the document's new chunks
+            added_embeddings: Embeddings of the new chunks
+        """
+        if settings.RAG_VECTOR_SHARDS_ENABLED:
+            try:
+                # Shards are versioned per document, so the document's rows are
+                # rewritten from the stored embeddings without re-embedding
+                chunk_ids, vectors = load_chunk_vectors(
+                    [str(chunk_id) for chunk_id in document.chunks.values_list('id', flat=True)]
+                )
+                if chunk_ids:
+                    vector_shard_store.write_document(document, chunk_ids, vectors)
+                else:
+                    vector_shard_store.remove_document(document)
+            except OSError as e:
+                logger.warning(f"Could not write document {document.id} to its vector shard: {str(e)}")
+
+        for scope, index in self._matching(document):
+            if index.is_mapped:
+                self._drop(scope, index)
+                continue
+            index.remove_chunks(removed_chunk_ids)
+            if added_chunk_ids:
+                index.add(added_chunk_ids, [str(document.id)] * len(added_chunk_ids),
+                          np.asarray(added_embeddings, dtype=np.float32))
+            self._reconcile(scope, index, lambda previous, current: (
+                current[1] == document.updated_at and current[0] in (previous[0], previous[0] + 1)
+            ))
+
+    def remove_document(self, document: Document) -> None:
+        """
+        Tombstone a deleted document's chunks in every cached index covering it
+
+        Args:
+            document: Deleted document
+        """
+        if settings.RAG_VECTOR_SHARDS_ENABLED:
+            # Not before the deletion commits: a rolled-back delete keeps its rows
+            vector_shard_store.remove_document_on_commit(document)
+
+        for scope, index in self._matching(document):
+            index.remove_documents([document.id])
+            self._reconcile(scope, index, lambda previous, current: (
+                current[0] == previous[0] - 1
+                and (current[1] is None or previous[1] is None or current[1] <= previous[1])
+            ))
+
+    def invalidate(self, template_id: Optional[str] = None) -> None:
+        """
+        Drop cached indexes that may cover a changed document of a template.
+        Scopes not restricted to a template are always dropped.
+
+        Args:
+            template_id: Template whose documents changed
+        """
+        template_id = str(template_id) if template_id else None
+        with self._lock:
+            for scope in list(self._indexes):
+                if scope.template_id is None or scope.template_id == template_id:
+                    del self._indexes[scope]
+
+    def clear(self) -> None:
+        """
+        Drop every cached index
+        """
+        with self._lock:
+            self._indexes.clear()
+
+
+vector_index_registry = VectorIndexRegistry()
@@ -0,0 +1,275 @@
+"""
+Database-backed queue of document ingestion jobs and the worker that runs them
+"""
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Iterator, List, Optional
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, QuerySet
+from django.utils import timezone
+
+from ..models import Document, IngestionJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_document(document: Document) -> IngestionJob:
+    """
+    Queue a stored document for processing by an ingestion worker
+
+    Args:
+        document: Pending document created by RAGPipeline.create_*_document
+
+    Returns:
+        The queued job
+    """
+    return IngestionJob.objects.create(document=document)
+
+
+def mark_documents_failed(documents: QuerySet) -> int:
+    """
+    Mark documents whose ingestion failed as failed
+
+    A document that still has chunks from an earlier ingestion stays
+    indexed: a failed re-processing leaves those chunks untouched, so they
+    remain valid and searchable, and the error is kept on the job.
+
+    Returns:
+        Number of documents marked failed
+    """
+    return documents.filter(chunks__isnull=True).update(status='failed')
+
+
+def job_status(job: IngestionJob) -> dict:
+    """
+    JSON-serialisable summary of a job for the status endpoint
+    """
+    return {
+        'job_id': str(job.id),
+        'document_id': str(job.document_id),
+        'status': job.status,
+        'stage': job.stage,
+        'progress': {'current': job.progress_current, 'total': job.progress_total},
+        'attempts': job.attempts,
+        'error': job.error or None,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class IngestionWorker:
+    """
+    Claims queued jobs and runs them through the RAG pipeline.
+
+    Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED where the database
+    supports it, followed by a conditional UPDATE, so any number of workers in
+    any number of processes can share the queue. A running job whose worker
+    stops heartbeating for RAG_INGESTION_LEASE_SECONDS is re-queued, up to
+    RAG_INGESTION_MAX_ATTEMPTS attempts.
+    """
+
+    def __init__(self, name: Optional[str] = None, pipeline=None):
+        """
+        Initialize the worker
+
+        Args:
+            name: Worker name recorded on claimed jobs (defaults to host, pid and thread)
+            pipeline: RAGPipeline to process documents with (created on first use)
+        """
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self._pipeline = pipeline
+
+    @property
+    def pipeline(self):
+        if self._pipeline is None:
+            from .rag_pipeline import RAGPipeline
+            self._pipeline = RAGPipeline()
+        return self._pipeline
+
+    def requeue_stale(self) -> int:
+        """
+        Release running jobs whose worker has stopped heartbeating
+
+        Returns:
+            Number of jobs released
+        """
+        cutoff = timezone.now() - timedelta(seconds=settings.RAG_INGESTION_LEASE_SECONDS)
+        stale = IngestionJob.objects.filter(status=IngestionJob.STATUS_RUNNING, heartbeat_at__lt=cutoff)
+        failed = stale.filter(attempts__gte=settings.RAG_INGESTION_MAX_ATTEMPTS)
+        mark_documents_failed(Document.objects.filter(ingestion_jobs__in=failed))
+        failed.update(
+            status=IngestionJob.STATUS_FAILED, error='Worker stopped responding', finished_at=timezone.now()
+        )
+        released = stale.update(status=IngestionJob.STATUS_QUEUED, stage='queued', worker='')
+        if released:
+            logger.warning(f"Re-queued {released} ingestion jobs abandoned by their workers")
+        return released
+
+    def claim(self) -> Optional[IngestionJob]:
+        """
+        Take the oldest queued job
+
+        Returns:
+            The claimed job, or None if the queue is empty
+        """
+        jobs = self.claim_batch(1)
+        return jobs[0] if jobs else None
+
+    def claim_batch(self, limit: int) -> List[IngestionJob]:
+        """
+        Take up to limit of the oldest queued jobs
+
+        Returns:
+            The claimed jobs, oldest first; empty if the queue is empty
+        """
+        while True:
+            with transaction.atomic():
+                ids = list(IngestionJob.objects.select_for_update(skip_locked=True).filter(
+                    status=IngestionJob.STATUS_QUEUED
+                ).order_by('created_at').values_list('id', flat=True)[:limit])
+                if not ids:
+                    return []
+                # The conditional update keeps the claim exclusive on
+                # databases without row locks
+                now = timezone.now()
+                claimed = IngestionJob.objects.filter(id__in=ids, status=IngestionJob.STATUS_QUEUED).update(
+                    status=IngestionJob.STATUS_RUNNING, worker=self.name, attempts=F('attempts') + 1,
+                    started_at=now, heartbeat_at=now
+                )
+            if claimed:
+                return list(IngestionJob.objects.filter(
+                    id__in=ids, worker=self.name, status=IngestionJob.STATUS_RUNNING
+                ).select_related('document').order_by('created_at'))
+
+    @contextmanager
+    def heartbeat(self, job_ids: List) -> Iterator[None]:
+        """
+        Keep this worker's lease on running jobs alive from a background
+        thread, so a long extraction or a slowly retried embedding batch does
+        not get the jobs re-queued under it
+        """
+        stop = threading.Event()
+        interval = max(settings.RAG_INGESTION_LEASE_SECONDS / 4, 1)
+
+        def beat():
+            try:
+                while not stop.wait(interval):
+                    IngestionJob.objects.filter(
+                        id__in=job_ids, worker=self.name, status=IngestionJob.STATUS_RUNNING
+                    ).update(heartbeat_at=timezone.now())
+            except Exception as e:
+                logger.warning(f"Heartbeat for ingestion jobs of {self.name} stopped: {str(e)}")
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=beat, name=f'{self.name}-heartbeat', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def _owned(self, job: IngestionJob):
+        """
+        The job, as long as this worker still holds it; a worker whose lease
+        expired must not overwrite the outcome of the one that took over
+        """
+        return IngestionJob.objects.filter(id=job.id, worker=self.name, status=IngestionJob.STATUS_RUNNING)
+
+    def run_job(self, job: IngestionJob) -> bool:
+        """
+        Process a claimed job's document, recording progress on the job
+
+        Returns:
+            Whether the document was indexed
+        """
+        def progress(stage: str, done: int = 0, total: int = 0) -> None:
+            self._owned(job).update(
+                stage=stage, progress_current=done, progress_total=total, heartbeat_at=timezone.now()
+            )
+
+        try:
+            with self.heartbeat([job.id]):
+                self.pipeline.process_document(job.document, progress=progress)
+        except Exception as e:
+            logger.error(f"Ingestion of document {job.document_id} failed: {str(e)}")
+            with transaction.atomic():
+                if self._owned(job).update(
+                    status=IngestionJob.STATUS_FAILED, error=str(e), finished_at=timezone.now()
+                ):
+                    mark_documents_failed(Document.objects.filter(id=job.document_id))
+            return False
+
+        if not self._owned(job).update(
+            status=IngestionJob.STATUS_SUCCEEDED, stage='done', progress_current=F('progress_total'),
+            error='', finished_at=timezone.now()
+        ):
+            logger.warning(f"Job {job.id} was taken over by another worker; its outcome was left to that worker")
+            return False
+        logger.info(f"Ingested document {job.document_id} (job {job.id})")
+        return True
+
+    def run_batch(self, jobs: List[IngestionJob]) -> int:
+        """
+        Process several claimed jobs' documents together with
+        RAGPipeline.process_documents
+
+        Returns:
+            Number of documents indexed
+        """
+        IngestionJob.objects.filter(
+            id__in=[job.id for job in jobs], worker=self.name, status=IngestionJob.STATUS_RUNNING
+        ).update(stage='extracting', heartbeat_at=timezone.now())
+        try:
+            with self.heartbeat([job.id for job in jobs]):
+                results = self.pipeline.process_documents([job.document for job in jobs])
+        except Exception as e:
+            logger.error(f"Ingestion of a batch of {len(jobs)} documents failed: {str(e)}")
+            results = [{'status': 'failed', 'error': str(e)} for _ in jobs]
+
+        indexed = 0
+        for job, result in zip(jobs, results):
+            if result['status'] == 'indexed':
+                indexed += self._owned(job).update(
+                    status=IngestionJob.STATUS_SUCCEEDED, stage='done', error='', finished_at=timezone.now()
+                )
+                continue
+            with transaction.atomic():
+                if self._owned(job).update(
+                    status=IngestionJob.STATUS_FAILED, error=result['error'] or '', finished_at=timezone.now()
+                ):
+                    mark_documents_failed(Document.objects.filter(id=job.document_id))
+        logger.info(f"Ingested {indexed} of {len(jobs)} documents in one batch")
+        return indexed
+
+    def run_pending(self, limit: Optional[int] = None) -> int:
+        """
+        Run queued jobs until the queue is empty
+
+        Args:
+            limit: Maximum number of jobs to run
+
+        Returns:
+            Number of jobs run
+        """
+        self.requeue_stale()
+        count = 0
+        while limit is None or count < limit:
+            batch_size = settings.RAG_INGESTION_BATCH_SIZE
+            jobs = self.claim_batch(max(min(batch_size, limit - count) if limit is not None else batch_size, 1))
+            if not jobs:
+                break
+            if len(jobs) == 1:
+                self.run_job(jobs[0])
+            else:
+                self.run_batch(jobs)
+            count += len(jobs)
+        return count
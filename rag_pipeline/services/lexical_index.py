@@ -0,0 +1,212 @@
+"""
+Keyword (BM25) search over chunk content using the database's full-text index
+"""
+import re
+import uuid
+from typing import List, Tuple, Optional
+import logging
+
+from django.conf import settings
+from django.db import connection
+
+from .vector_index import RetrievalScope, ALL_DOCUMENTS
+from ..models import Document, DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'rag_pipeline_chunk_fts'
+# Indexed chunk_id/document_id -> FTS rowid map: FTS5 columns cannot be
+# indexed, so rows are found through it instead of by scanning the FTS table
+FTS_ROWS_TABLE = 'rag_pipeline_chunk_fts_rows'
+
+# Identifiers such as "INV-2024/001" or "contract_number" are kept together
+_TERM_RE = re.compile(r'[^\W_]+(?:[-_./:#][^\W_]+)*')
+_WORD_RE = re.compile(r'[^\W_]+')
+
+# Terms used from a single query, most queries are far shorter
+MAX_QUERY_TERMS = 32
+
+
+class LexicalIndex:
+    """
+    Full-text index over the text of document chunks.
+
+    On SQLite this is an FTS5 virtual table ranked by BM25 and kept in sync
+    as chunks are written; rows are deleted by rowid, looked up by chunk or
+    document in an ordinary indexed table. On PostgreSQL (DATABASE_URL set) it is a tsvector
+    column with a GIN index, ranked by ts_rank_cd, written as chunks are
+    written (chunks stored as offsets have no content to generate it from).
+    Other backends have no lexical index.
+    """
+
+    def __init__(self):
+        self._fts_available: Optional[bool] = None
+
+    @property
+    def available(self) -> bool:
+        if not settings.RAG_LEXICAL_SEARCH_ENABLED:
+            return False
+        if connection.vendor == 'postgresql':
+            return True
+        if connection.vendor != 'sqlite':
+            return False
+        if self._fts_available is None:
+            self._fts_available = FTS_TABLE in connection.introspection.table_names()
+        return self._fts_available
+
+    @staticmethod
+    def query_terms(text: str) -> List[str]:
+        """
+        Distinct search terms of a query, in order
+        """
+        return list(dict.fromkeys(term.lower() for term in _TERM_RE.findall(text)))[:MAX_QUERY_TERMS]
+
+    @classmethod
+    def fts5_query(cls, text: str) -> str:
+        # Each term is a quoted phrase so punctuation inside identifiers
+        # cannot be parsed as FTS5 syntax
+        return ' OR '.join(f'"{term}"' for term in cls.query_terms(text))
+
+    @classmethod
+    def tsquery(cls, text: str) -> str:
+        return ' | '.join(' <-> '.join(_WORD_RE.findall(term)) for term in cls.query_terms(text))
+
+    @staticmethod
+    def _db_id(value) -> str:
+        return DocumentChunk._meta.pk.get_db_prep_value(uuid.UUID(str(value)), connection)
+
+    def index_chunks(self, document: Document, chunks: List[DocumentChunk]) -> None:
+        """
+        Replace a document's rows in the index
+
+        Args:
+            document: Document whose chunks were rewritten
+            chunks: The document's new chunks
+        """
+        if connection.vendor == 'postgresql':
+            self._write_tsvectors(chunks)
+            return
+        if not self.available or connection.vendor != 'sqlite':
+            return
+        document_id = self._db_id(document.id)
+        with connection.cursor() as cursor:
+            self._delete_rows(cursor, 'document_id = %s', [document_id])
+            self._insert_rows(cursor, document_id, chunks)
+
+    def update_chunks(self, document: Document, removed_chunk_ids: List[str], added_chunks: List[DocumentChunk]) -> None:
+        """
+        Apply an incremental change to a document's rows in the index
+
+        Args:
+            document: Document whose chunks changed
+            removed_chunk_ids: IDs of chunks deleted from the document
+            added_chunks: The document's new chunks
+        """
+        if connection.vendor == 'postgresql':
+            self._write_tsvectors(added_chunks)
+            return
+        if not self.available or connection.vendor != 'sqlite':
+            return
+        removed = [self._db_id(chunk_id) for chunk_id in removed_chunk_ids]
+        with connection.cursor() as cursor:
+            for start in range(0, len(removed), 500):
+                batch = removed[start:start + 500]
+                self._delete_rows(cursor, f"chunk_id IN ({', '.join(['%s'] * len(batch))})", batch)
+            self._insert_rows(cursor, self._db_id(document.id), added_chunks)
+
+    @staticmethod
+    def _delete_rows(cursor, where: str, params: List[str]) -> None:
+        """
+        Delete the FTS rows, and their row map entries, matching a condition
+        on the row map (SQLite)
+        """
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT id FROM {FTS_ROWS_TABLE} WHERE {where})", params)
+        cursor.execute(f"DELETE FROM {FTS_ROWS_TABLE} WHERE {where}", params)
+
+    def _insert_rows(self, cursor, document_id: str, chunks: List[DocumentChunk]) -> None:
+        """
+        Add FTS rows for chunks, each under the rowid of its row map entry (SQLite)
+        """
+        rows = [(self._db_id(chunk.id), chunk.text) for chunk in chunks]
+        cursor.executemany(
+            f"INSERT INTO {FTS_ROWS_TABLE} (chunk_id, document_id) VALUES (%s, %s)",
+            [(chunk_id, document_id) for chunk_id, _ in rows]
+        )
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, content, chunk_id, document_id) "
+            f"SELECT id, %s, chunk_id, document_id FROM {FTS_ROWS_TABLE} WHERE chunk_id = %s",
+            [(text, chunk_id) for chunk_id, text in rows]
+        )
+
+    def _write_tsvectors(self, chunks: List[DocumentChunk]) -> None:
+        """
+        Store the search vectors of newly written chunks (PostgreSQL)
+        """
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "UPDATE rag_pipeline_documentchunk SET content_tsv = to_tsvector('simple', %s) WHERE id = %s",
+                [(chunk.text, self._db_id(chunk.id)) for chunk in chunks]
+            )
+
+    def remove_document(self, document: Document) -> None:
+        """
+        Drop a deleted document's rows from the index
+        """
+        if not self.available or connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            self._delete_rows(cursor, 'document_id = %s', [self._db_id(document.id)])
+
+    def search(self, query: str, scope: RetrievalScope = ALL_DOCUMENTS, limit: int = 50) -> List[Tuple[str, float]]:
+        """
+        Find the chunks that best match a query's terms
+
+        Args:
+            query: Search query
+            scope: Documents to search
+            limit: Maximum number of results
+
+        Returns:
+            List of tuples (chunk_id, relevance) sorted by relevance, highest first
+        """
+        if not self.available or limit <= 0:
+            return []
+
+        scope_sql, scope_params = '', []
+        if scope != ALL_DOCUMENTS:
+            documents = Document.objects.filter(**scope.document_filter()).order_by().values('id')
+            subquery, scope_params = documents.query.sql_with_params()
+            scope_sql = f" AND document_id IN ({subquery})"
+
+        if connection.vendor == 'postgresql':
+            match = self.tsquery(query)
+            sql = (
+                "SELECT id, ts_rank_cd(content_tsv, to_tsquery('simple', %s)) AS score "
+                "FROM rag_pipeline_documentchunk "
+                f"WHERE content_tsv @@ to_tsquery('simple', %s){scope_sql} "
+                "ORDER BY score DESC LIMIT %s"
+            )
+            params = [match, match, *scope_params, limit]
+        else:
+            match = self.fts5_query(query)
+            # bm25() is lower for better matches
+            sql = (
+                f"SELECT chunk_id, -bm25({FTS_TABLE}) AS score FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s{scope_sql} "
+                "ORDER BY score DESC LIMIT %s"
+            )
+            params = [match, *scope_params, limit]
+
+        if not match:
+            return []
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+        except Exception as e:
+            logger.warning(f"Lexical search failed for query '{query[:100]}': {str(e)}")
+            return []
+        return [(str(uuid.UUID(str(chunk_id))), float(score)) for chunk_id, score in rows]
+
+
+lexical_index = LexicalIndex()
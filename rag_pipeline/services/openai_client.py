@@ -0,0 +1,209 @@
+"""
+Process-wide pooled HTTP client for all OpenAI traffic (embeddings and chat)
+"""
+import importlib.util
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+import logging
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """
+    Response body that gives its connection back to the meter once closed
+    """
+
+    def __init__(self, stream: httpx.SyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class MeteredTransport(httpx.HTTPTransport):
+    """
+    Connection-pooling transport that counts how busy its pool is
+
+    A request holds a connection from when it is sent until its response
+    body is closed. Requests sent while every connection is busy wait for
+    one, up to the pool timeout; those are counted as saturated.
+    """
+
+    def __init__(self, max_connections: int, **kwargs):
+        super().__init__(**kwargs)
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {'requests': 0, 'peak_in_flight': 0, 'saturated_requests': 0, 'pool_timeouts': 0, 'errors': 0}
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self._stats['requests'] += 1
+            if self._in_flight >= self.max_connections:
+                self._stats['saturated_requests'] += 1
+            self._in_flight += 1
+            self._stats['peak_in_flight'] = max(self._stats['peak_in_flight'], self._in_flight)
+
+        released = False
+
+        def release():
+            nonlocal released
+            with self._lock:
+                if not released:
+                    released = True
+                    self._in_flight -= 1
+
+        try:
+            response = super().handle_request(request)
+        except httpx.PoolTimeout:
+            self._count('pool_timeouts')
+            release()
+            raise
+        except Exception:
+            self._count('errors')
+            release()
+            raise
+        response.stream = _ReleasingStream(response.stream, release)
+        return response
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Request counters and current pool occupancy
+        """
+        with self._lock:
+            stats = dict(self._stats, in_flight=self._in_flight)
+        stats['max_connections'] = self.max_connections
+        stats['utilization'] = stats['in_flight'] / self.max_connections
+        stats['saturation_rate'] = stats['saturated_requests'] / stats['requests'] if stats['requests'] else 0.0
+        connections = getattr(getattr(self, '_pool', None), 'connections', None)
+        if connections is not None:
+            stats['open_connections'] = len(connections)
+            stats['idle_connections'] = sum(1 for connection in connections if connection.is_idle())
+        return stats
+
+
+_lock = threading.Lock()
+_transport: Optional[MeteredTransport] = None
+_http_client: Optional[httpx.Client] = None
+_openai_clients: Dict[Tuple, Any] = {}
+
+
+def _reset_after_fork():
+    """
+    Forget the parent's client in a forked child (e.g. a gunicorn worker
+    forked after preloading the app) so the child opens its own connections
+
+    The parent's client is dropped rather than closed: closing it would shut
+    down TLS sessions on sockets the parent is still using.
+    """
+    global _lock, _transport, _http_client
+    _lock = threading.Lock()
+    _transport = None
+    _http_client = None
+    _openai_clients.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def request_timeout(seconds: float) -> httpx.Timeout:
+    """
+    Timeout for one API call: seconds to wait for the response, with the
+    configured connect and pool timeouts
+    """
+    return httpx.Timeout(
+        seconds, connect=settings.OPENAI_HTTP_CONNECT_TIMEOUT, pool=settings.OPENAI_HTTP_POOL_TIMEOUT
+    )
+
+
+def _http2_enabled() -> bool:
+    if not settings.OPENAI_HTTP2:
+        return False
+    if importlib.util.find_spec('h2') is None:
+        logger.warning("OPENAI_HTTP2 is set but the h2 package is not installed; using HTTP/1.1")
+        return False
+    return True
+
+
+def get_http_client() -> httpx.Client:
+    """
+    This process's pooled HTTP client for the OpenAI API, created on the
+    first call
+    """
+    global _transport, _http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                max_connections = settings.OPENAI_HTTP_MAX_CONNECTIONS
+                _transport = MeteredTransport(
+                    max_connections,
+                    limits=httpx.Limits(
+                        max_connections=max_connections,
+                        max_keepalive_connections=settings.OPENAI_HTTP_MAX_KEEPALIVE,
+                        keepalive_expiry=settings.OPENAI_HTTP_KEEPALIVE_SECONDS,
+                    ),
+                    http2=_http2_enabled(),
+                )
+                _http_client = httpx.Client(
+                    transport=_transport, timeout=request_timeout(settings.OPENAI_HTTP_TIMEOUT), follow_redirects=True
+                )
+    return _http_client
+
+
+def get_openai_client(api_key: Optional[str] = None, max_retries: Optional[int] = None,
+                      wrapper: Optional[Callable[[Any], Any]] = None):
+    """
+    An OpenAI client sending its requests through the shared HTTP client
+
+    Clients are cached per combination of arguments, so callers can ask for
+    one on every call.
+
+    Args:
+        api_key: OpenAI API key (defaults to OPENAI_API_KEY)
+        max_retries: Retries the SDK makes itself (defaults to the SDK's)
+        wrapper: Applied once to the new client, e.g. to add tracing
+
+    Returns:
+        openai.OpenAI client
+    """
+    key = (api_key, max_retries, wrapper)
+    client = _openai_clients.get(key)
+    if client is None:
+        http_client = get_http_client()
+        with _lock:
+            client = _openai_clients.get(key)
+            if client is None:
+                from openai import OpenAI
+
+                options = {'max_retries': max_retries} if max_retries is not None else {}
+                client = OpenAI(api_key=api_key, http_client=http_client, **options)
+                if wrapper is not None:
+                    client = wrapper(client)
+                _openai_clients[key] = client
+    return client
+
+
+def http_client_stats() -> Dict[str, Any]:
+    """
+    Pool counters of this process's OpenAI HTTP client (empty until it is
+    first used)
+    """
+    transport = _transport
+    return transport.stats() if transport is not None else {}
@@ -0,0 +1,360 @@
+"""
+Compressed vector indexes using int8 scalar quantization or product quantization
+"""
+from typing import List, Tuple, Optional, Callable
+import logging
+
+import numpy as np
+
+from .vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ('none', 'int8', 'pq')
+
+# Rows scored per block, bounding the float32 scratch space used while scanning codes
+SCORE_BLOCK_SIZE = 8192
+
+# Rows sampled at random to train product quantizer codebooks
+PQ_SAMPLE_SIZE = 8192
+
+
+class ScalarQuantizer:
+    """
+    Maps each dimension linearly onto int8 using the range seen in training.
+
+    Queries stay in float (asymmetric scoring), so the only error is the
+    rounding of stored rows: 4x smaller than float32.
+    """
+
+    code_dtype = np.int8
+
+    def __init__(self, offsets: np.ndarray, scales: np.ndarray):
+        """
+        Initialize the quantizer
+
+        Args:
+            offsets: Per-dimension value stored as code -128
+            scales: Per-dimension width of one code step
+        """
+        self.offsets = np.asarray(offsets, dtype=np.float32)
+        self.scales = np.asarray(scales, dtype=np.float32)
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray) -> 'ScalarQuantizer':
+        """
+        Learn per-dimension ranges from training vectors
+        """
+        low = vectors.min(axis=0)
+        high = vectors.max(axis=0)
+        scales = (high - low) / 255.0
+        scales[scales == 0] = 1.0
+        return cls(low, scales)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.offsets) / self.scales)
+        return (np.clip(codes, 0, 255) - 128).astype(self.code_dtype)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.offsets + self.scales * (codes.astype(np.float32) + 128)
+
+    def score(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        (m, n) approximate inner products between float queries and int8 codes
+        """
+        # q . (offset + scale * (c + 128)) = q . (offset + 128 * scale) + (q * scale) . c
+        weights = queries * self.scales
+        bias = queries @ (self.offsets + 128 * self.scales)
+        scores = np.empty((queries.shape[0], codes.shape[0]), dtype=np.float32)
+        for start in range(0, codes.shape[0], SCORE_BLOCK_SIZE):
+            block = codes[start:start + SCORE_BLOCK_SIZE].astype(np.float32)
+            scores[:, start:start + SCORE_BLOCK_SIZE] = weights @ block.T
+        scores += bias[:, None]
+        return scores
+
+    @property
+    def code_size(self) -> int:
+        return self.offsets.shape[0]
+
+
+def kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 8, seed: int = 0) -> np.ndarray:
+    """
+    Cluster vectors by Euclidean distance
+
+    Args:
+        vectors: (n, d) matrix
+        n_clusters: Number of centroids to learn
+        iterations: Number of Lloyd iterations
+        seed: Random seed for initialisation
+
+    Returns:
+        (n_clusters, d) matrix of centroids
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, vectors.shape[0])
+    centroids = vectors[rng.choice(vectors.shape[0], n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        # Per-dimension bincount is much faster than np.add.at for narrow vectors
+        sums = np.stack([
+            np.bincount(assignments, weights=vectors[:, dim], minlength=n_clusters)
+            for dim in range(vectors.shape[1])
+        ], axis=1)
+
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(vectors.shape[0], int(empty.sum()), replace=False)]
+            counts[empty] = 1
+        centroids = (sums / counts[:, None]).astype(np.float32)
+
+    return centroids
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = SCORE_BLOCK_SIZE) -> np.ndarray:
+    """
+    Index of the closest centroid (Euclidean) for each row of vectors
+    """
+    # ||x - c||^2 ranks the same as ||c||^2 - 2 x.c
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], batch_size):
+        batch = vectors[start:start + batch_size]
+        assignments[start:start + batch_size] = np.argmin(centroid_norms - 2 * (batch @ centroids.T), axis=1)
+    return assignments
+
+
+class ProductQuantizer:
+    """
+    Splits vectors into equal subspaces and stores each as the index of its
+    nearest of up to 256 subspace centroids, one byte per subspace.
+
+    Queries are scored with asymmetric distance tables: the query's inner
+    product with every subspace centroid is computed once, and a row's score
+    is the sum of its table entries.
+    """
+
+    code_dtype = np.uint8
+
+    def __init__(self, codebooks: np.ndarray):
+        """
+        Initialize the quantizer
+
+        Args:
+            codebooks: (subspaces, centroids, subspace dimensions) matrix
+        """
+        self.codebooks = np.ascontiguousarray(codebooks, dtype=np.float32)
+
+    @staticmethod
+    def default_subspaces(dimensions: int) -> int:
+        """
+        Largest subspace count with at least four dimensions per subspace that
+        divides the dimensions evenly (16x smaller than float32 when d % 4 == 0)
+        """
+        for subspaces in range(max(dimensions // 4, 1), 0, -1):
+            if dimensions % subspaces == 0:
+                return subspaces
+        return 1
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, subspaces: Optional[int] = None,
+            iterations: int = 8, seed: int = 0) -> 'ProductQuantizer':
+        """
+        Learn subspace codebooks from training vectors
+
+        Args:
+            vectors: (n, d) training matrix
+            subspaces: Number of subspaces (must divide d)
+            iterations: Lloyd iterations per subspace
+            seed: Random seed for training
+        """
+        dimensions = vectors.shape[1]
+        subspaces = subspaces or cls.default_subspaces(dimensions)
+        if dimensions % subspaces:
+            raise ValueError(f"{subspaces} subspaces do not divide {dimensions} dimensions")
+
+        width = dimensions // subspaces
+        n_centroids = min(256, vectors.shape[0])
+        codebooks = np.empty((subspaces, n_centroids, width), dtype=np.float32)
+        for subspace in range(subspaces):
+            part = np.ascontiguousarray(vectors[:, subspace * width:(subspace + 1) * width])
+            codebooks[subspace] = kmeans(part, n_centroids, iterations=iterations, seed=seed + subspace)
+        return cls(codebooks)
+
+    @property
+    def subspaces(self) -> int:
+        return self.codebooks.shape[0]
+
+    @property
+    def code_size(self) -> int:
+        return self.subspaces
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.reshape(vectors.shape[0], self.subspaces, -1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        parts = self._split(vectors)
+        codes = np.empty((vectors.shape[0], self.subspaces), dtype=self.code_dtype)
+        for subspace in range(self.subspaces):
+            codes[:, subspace] = nearest_centroids(np.ascontiguousarray(parts[:, subspace]), self.codebooks[subspace])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = self.codebooks[np.arange(self.subspaces), codes]
+        return parts.reshape(codes.shape[0], -1)
+
+    def score(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        (m, n) approximate inner products between float queries and PQ codes
+        """
+        # (m, subspaces, centroids) inner products of each query part with each centroid
+        tables = np.einsum('qsd,skd->qsk', self._split(queries), self.codebooks)
+        scores = np.empty((queries.shape[0], codes.shape[0]), dtype=np.float32)
+        subspaces = np.arange(self.subspaces)[:, None]
+        for start in range(0, codes.shape[0], SCORE_BLOCK_SIZE):
+            block = codes[start:start + SCORE_BLOCK_SIZE].T
+            for row, table in enumerate(tables):
+                # (subspaces, block) table lookups, summed over the subspaces
+                scores[row, start:start + SCORE_BLOCK_SIZE] = table[subspaces, block].sum(axis=0)
+        return scores
+
+
+class QuantizedIndex(VectorIndex):
+    """
+    Vector index that keeps only quantized codes resident.
+
+    The compressed scan selects rerank_factor * top_k candidates per query;
+    their float embeddings are then fetched through vector_loader and
+    re-scored exactly, so returned similarities are exact and only the
+    candidate selection is approximate.
+    """
+
+    def __init__(self, chunk_ids: List[str], document_ids: List[str], vectors: np.ndarray,
+                 quantizer, fingerprint=None, normalized: bool = False,
+                 vector_loader: Optional[Callable[[List[str]], Tuple[List[str], np.ndarray]]] = None,
+                 rerank_factor: int = 4):
+        """
+        Initialize the index
+
+        Args:
+            chunk_ids: Chunk IDs, one per row of vectors
+            document_ids: Document IDs, one per row of vectors
+            vectors: (n, d) matrix of embeddings; only their codes are kept
+            quantizer: Fitted ScalarQuantizer or ProductQuantizer
+            fingerprint: Corpus fingerprint the index was built from
+            normalized: Whether rows are already unit length
+            vector_loader: Callable returning (found chunk IDs, unit-length float
+                vectors) for a list of chunk IDs, used for exact re-scoring
+            rerank_factor: Candidates re-scored per requested result
+        """
+        self.quantizer = quantizer
+        self.vector_loader = vector_loader
+        self.rerank_factor = max(1, rerank_factor)
+        super().__init__(chunk_ids, document_ids, vectors, fingerprint, normalized)
+
+    @classmethod
+    def train(cls, index: VectorIndex, mode: str, subspaces: Optional[int] = None,
+              sample_size: int = 65536, seed: int = 0, **kwargs) -> 'QuantizedIndex':
+        """
+        Fit a quantizer on an exact index and encode its rows
+
+        Args:
+            index: Exact index to compress
+            mode: 'int8' or 'pq'
+            subspaces: PQ subspace count (defaults to one per four dimensions)
+            sample_size: Rows used to fit the quantizer
+            seed: Random seed for sampling and training
+            **kwargs: Passed to the QuantizedIndex constructor
+
+        Returns:
+            QuantizedIndex over the same rows
+        """
+        vectors, alive, chunk_ids = index._snapshot()
+        document_ids = index.document_ids
+        if alive is not None:
+            keep = np.flatnonzero(alive)
+            vectors = vectors[keep]
+            chunk_ids = [chunk_ids[row] for row in keep]
+            document_ids = [document_ids[row] for row in keep]
+
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if vectors.shape[0] > sample_size:
+            sample = vectors[rng.choice(vectors.shape[0], sample_size, replace=False)]
+
+        if mode == 'int8':
+            quantizer = ScalarQuantizer.fit(sample)
+        elif mode == 'pq':
+            # 32 rows per subspace centroid is plenty for codebooks of 256
+            if sample.shape[0] > PQ_SAMPLE_SIZE:
+                sample = sample[rng.choice(sample.shape[0], PQ_SAMPLE_SIZE, replace=False)]
+            quantizer = ProductQuantizer.fit(sample, subspaces, seed=seed)
+        else:
+            raise ValueError(f"Unknown quantization mode '{mode}', expected one of {QUANTIZATION_MODES}")
+
+        quantized = cls(chunk_ids, document_ids, vectors, quantizer,
+                        fingerprint=index.fingerprint, normalized=True, **kwargs)
+        logger.info(f"🔍 RAG DEBUG: Quantized {len(quantized)} chunks with {mode}: "
+                    f"{quantized.nbytes} bytes instead of {vectors.nbytes}")
+        return quantized
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        if vectors.size == 0:
+            return np.empty((0, self.quantizer.code_size), dtype=self.quantizer.code_dtype)
+        return self.quantizer.encode(vectors)
+
+    def _score(self, queries: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        return self.quantizer.score(queries, rows)
+
+    def search_batch(self, query_embeddings: List[List[float]], top_k: int = 5,
+                     rerank: bool = True) -> List[List[Tuple[str, float]]]:
+        """
+        Find the chunks most similar to each of several query embeddings
+
+        Args:
+            query_embeddings: Query embedding vectors
+            top_k: Number of top results to return per query
+            rerank: Re-score candidates with their float embeddings
+
+        Returns:
+            One list of (chunk_id, similarity_score) tuples per query, sorted by similarity
+        """
+        if not rerank or self.vector_loader is None:
+            return super().search_batch(query_embeddings, top_k)
+
+        candidates = super().search_batch(query_embeddings, top_k * self.rerank_factor)
+        wanted = list({chunk_id for hits in candidates for chunk_id, _ in hits})
+        if not wanted:
+            return candidates
+
+        found_ids, vectors = self.vector_loader(wanted)
+        positions = {chunk_id: i for i, chunk_id in enumerate(found_ids)}
+        queries = self._prepare_queries(query_embeddings)
+
+        results = []
+        for query, hits in zip(queries, candidates):
+            # Chunks deleted since the candidates were selected are skipped
+            ids = [chunk_id for chunk_id, _ in hits if chunk_id in positions]
+            if not ids:
+                results.append([])
+                continue
+            scores = vectors[[positions[chunk_id] for chunk_id in ids]] @ query
+            top = self._top_k(scores, top_k)
+            results.append([(ids[i], float(scores[i])) for i in top])
+        return results
+
+    def search(self, query_embedding: List[float], top_k: int = 5, rerank: bool = True) -> List[Tuple[str, float]]:
+        return self.search_batch([query_embedding], top_k, rerank=rerank)[0]
+
+    def score_chunks(self, query_embedding: List[float], chunk_ids) -> List[Tuple[str, float]]:
+        if self.vector_loader is None:
+            return super().score_chunks(query_embedding, chunk_ids)
+        candidates = [chunk_id for chunk_id, _ in super().score_chunks(query_embedding, chunk_ids)]
+        if not candidates:
+            return []
+        found_ids, vectors = self.vector_loader(candidates)
+        if not found_ids:
+            return []
+        scores = vectors @ self._prepare_queries([query_embedding])[0]
+        return [(found_ids[i], float(scores[i])) for i in np.argsort(-scores, kind='stable')]
@@ -3,19 +3,45 @@ RAG (Retrieval-Augmented Generation) pipeline service
 """
 import os
 import uuid
-from typing import List, Dict, Any, Optional
+from contextlib import ExitStack
+from typing import List, Dict, Any, Optional, Callable, NamedTuple, Set, Tuple
 import logging
 
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Substr
+from django.utils import timezone
 
 from .document_processor import DocumentProcessor
 from .text_chunker import TextChunker
+from .embedding_codec import truncate_embedding
 from .embedding_service import EmbeddingService
+from .embedding_providers import EmbeddingSpace
+from .embedding_cache import content_hash
+from .vector_index import RetrievalScope, ALL_DOCUMENTS
+from .index_registry import vector_index_registry
+from .lexical_index import lexical_index
+from .upload_storage import store_upload, delete_if_unreferenced, local_path
+from .ingestion_jobs import mark_documents_failed
 from ..models import Document, DocumentChunk
 
 logger = logging.getLogger(__name__)
 
+# Embedding spaces this process has checked for documents embedded in another space
+_checked_spaces: Set[EmbeddingSpace] = set()
+
+ProgressCallback = Optional[Callable[..., None]]
+
+
+class ChunkDiff(NamedTuple):
+    """
+    Difference between a document's stored chunks and its re-chunked content
+    """
+    kept: List[Tuple[DocumentChunk, Dict[str, Any]]]  # (stored chunk, new chunk data) with equal content
+    added: List[Dict[str, Any]]  # New chunk data to embed and insert
+    removed: List[DocumentChunk]  # Stored chunks no longer in the document
+
 
 class RAGPipeline:
     """
@@ -23,18 +49,23 @@ class RAGPipeline:
     """
     
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200, 
-                 embedding_model: str = "text-embedding-3-small"):
+                 embedding_model: str = None, embedding_provider: str = None,
+                 embedding_dimensions: int = None):
         """
         Initialize the RAG pipeline
         
         Args:
             chunk_size: Maximum size of each chunk in characters
             chunk_overlap: Overlap between consecutive chunks in characters
-            embedding_model: OpenAI embedding model to use
+            embedding_model: Embedding model to use (defaults to RAG_EMBEDDING_MODEL)
+            embedding_provider: Embedding provider to use (defaults to RAG_EMBEDDING_PROVIDER)
+            embedding_dimensions: Embedding dimensions (defaults to RAG_EMBEDDING_DIMENSIONS)
         """
         self.document_processor = DocumentProcessor()
         self.text_chunker = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-        self.embedding_service = EmbeddingService(model=embedding_model)
+        self.embedding_service = EmbeddingService(
+            model=embedding_model, provider=embedding_provider, dimensions=embedding_dimensions
+        )
     
     def _validate_uuid(self, uuid_string: str) -> Optional[uuid.UUID]:
         """
@@ -54,6 +85,31 @@ class RAGPipeline:
             logger.error(f"Invalid UUID format: {uuid_string}")
             return None
     
+    def create_text_document(self, name: str, content: str, template_id: str = None, session_id: str = None) -> Document:
+        """
+        Store a text document for processing; it is not searchable until
+        process_document has run
+        
+        Args:
+            name: Name of the document
+            content: Text content
+            template_id: Optional template ID to associate with
+            session_id: Optional session ID for cleanup
+            
+        Returns:
+            Created Document object
+        """
+        # Validate template_id if provided
+        validated_template_id = self._validate_uuid(template_id) if template_id else None
+        
+        return Document.objects.create(
+            name=name,
+            content=content,
+            file_type='text',
+            template_id=validated_template_id,
+            session_id=session_id
+        )
+    
     def process_text_document(self, name: str, content: str, template_id: str = None, session_id: str = None) -> Document:
         """
         Process a text document and store it in the database
@@ -68,20 +124,10 @@ class RAGPipeline:
             Created Document object
         """
         try:
-            # Validate template_id if provided
-            validated_template_id = self._validate_uuid(template_id) if template_id else None
-            
-            # Create document record
-            document = Document.objects.create(
-                name=name,
-                content=content,
-                file_type='text',
-                template_id=validated_template_id,
-                session_id=session_id
-            )
+            document = self.create_text_document(name, content, template_id, session_id)
             
             # Process the document
-            self._process_document(document)
+            self.process_document(document)
             
             logger.info(f"Successfully processed text document: {name}")
             return document
@@ -90,6 +136,39 @@ class RAGPipeline:
             logger.error(f"Error processing text document {name}: {str(e)}")
             raise
     
+    def create_file_document(self, name: str, file_obj, template_id: str = None, session_id: str = None) -> Document:
+        """
+        Save an uploaded file (PDF, DOCX, TXT) and store its document for
+        processing; it is not searchable until process_document has run
+        
+        Args:
+            name: Name of the document
+            file_obj: Uploaded file object
+            template_id: Optional template ID to associate with
+            session_id: Optional session ID for cleanup
+            
+        Returns:
+            Created Document object
+        """
+        # Validate template_id if provided
+        validated_template_id = self._validate_uuid(template_id) if template_id else None
+        
+        # Determine file type
+        file_type = self.document_processor.validate_file_type(file_obj.name)
+        
+        # Stream the file to storage, once per distinct content; text files
+        # have no signature to check
+        upload = store_upload(file_obj, expected_type=file_type if file_type != 'text' else None)
+        
+        return Document.objects.create(
+            name=name,
+            file_path=upload.path,
+            content_sha256=upload.sha256,
+            file_type=file_type,
+            template_id=validated_template_id,
+            session_id=session_id
+        )
+    
     def process_file_document(self, name: str, file_obj, template_id: str = None, session_id: str = None) -> Document:
         """
         Process a file document (PDF, DOCX) and store it in the database
@@ -104,27 +183,10 @@ class RAGPipeline:
             Created Document object
         """
         try:
-            # Validate template_id if provided
-            validated_template_id = self._validate_uuid(template_id) if template_id else None
-            
-            # Determine file type
-            file_type = self.document_processor.validate_file_type(file_obj.name)
-            
-            # Save file to storage
-            file_path = f"uploads/{uuid.uuid4()}_{file_obj.name}"
-            saved_path = default_storage.save(file_path, ContentFile(file_obj.read()))
-            
-            # Create document record
-            document = Document.objects.create(
-                name=name,
-                file_path=saved_path,
-                file_type=file_type,
-                template_id=validated_template_id,
-                session_id=session_id
-            )
+            document = self.create_file_document(name, file_obj, template_id, session_id)
             
             # Process the document
-            self._process_document(document)
+            self.process_document(document)
             
             logger.info(f"Successfully processed file document: {name}")
             return document
@@ -133,81 +195,501 @@ class RAGPipeline:
             logger.error(f"Error processing file document {name}: {str(e)}")
             raise
     
-    def _process_document(self, document: Document) -> None:
+    def replace_document_source(self, document: Document, file_obj=None, content: str = None) -> Document:
+        """
+        Replace an existing document's file or text; the stored chunks stay
+        searchable until process_document has re-indexed it, which only
+        embeds chunks whose content changed
+        
+        Args:
+            document: Document to update
+            file_obj: New uploaded file (PDF, DOCX, TXT)
+            content: New text content
+            
+        Returns:
+            The updated Document object
+        """
+        if file_obj is not None:
+            file_type = self.document_processor.validate_file_type(file_obj.name)
+            old_path = document.file_path
+            upload = store_upload(file_obj, expected_type=file_type if file_type != 'text' else None)
+            document.file_path = upload.path
+            document.content_sha256 = upload.sha256
+            document.file_type = file_type
+            document.save(update_fields=['file_path', 'content_sha256', 'file_type'])
+            if old_path != upload.path:
+                delete_if_unreferenced(old_path)
+        elif content is not None:
+            old_path = document.file_path
+            with transaction.atomic():
+                self._detach_chunk_text(document)
+                document.content = content
+                document.file_path = None
+                document.content_sha256 = ''
+                document.file_type = 'text'
+                document.save(update_fields=['content', 'file_path', 'content_sha256', 'file_type'])
+            if old_path:
+                delete_if_unreferenced(old_path)
+        else:
+            raise ValueError("Either file or content must be provided")
+        return document
+    
+    def process_document(self, document: Document, progress: ProgressCallback = None) -> None:
         """
-        Internal method to process a document: extract text, chunk, and embed
+        Process a stored document: extract text, chunk, embed and index it
         
         Args:
             document: Document object to process
+            progress: Optional callable receiving (stage, done, total) as
+                      processing moves through extracting, chunking,
+                      embedding and indexing
         """
+        report = progress or (lambda stage, done=0, total=0: None)
         try:
-            # Extract text content
-            if document.file_type == 'text':
-                text_content = document.content
+            # An identical file already ingested the same way is copied, not re-processed
+            if self.reuse_existing_ingestion(document):
+                return
+            
+            # Extract and chunk the text; metadata shared by every chunk lives
+            # on the document, PDF page numbers are kept on the chunks
+            report('extracting')
+            if document.file_path:
+                # Files are chunked while they are read, page by page or
+                # block by block
+                with local_path(document.file_path) as file_path:
+                    text_content, chunks_data = self.text_chunker.chunk_parts(
+                        self.document_processor.iter_document(file_path, document.file_type)
+                    )
             else:
-                # Get full path for file processing
-                file_path = default_storage.path(document.file_path) if document.file_path else None
-                text_content = self.document_processor.process_document(
-                    file_path=file_path,
-                    file_type=document.file_type
-                )
-            
-            # Update document with extracted content
-            document.content = text_content
-            document.save()
-            
-            # Chunk the text
-            chunks_data = self.text_chunker.chunk_document(
-                document_content=text_content,
-                document_name=document.name,
-                document_id=str(document.id)
+                text_content = document.content
+                if document.file_type != 'text':
+                    text_content = self.document_processor.process_document(file_type=document.file_type)
+                report('chunking')
+                chunks_data = self.text_chunker.chunk_text(text_content)
+            
+            # Keep stored chunks whose content is unchanged and embed only the rest
+            diff = self._diff_chunks(document, chunks_data)
+            report('embedding', 0, len(diff.added))
+            self.embedding_service.embed_chunks(
+                diff.added, progress=lambda done, total: report('embedding', done, total)
             )
             
-            # Generate embeddings for chunks
-            chunks_with_embeddings = self.embedding_service.embed_chunks(chunks_data)
+            # Save chunks to database; the extracted text is stored with them,
+            # since the stored chunks are offsets into the current text and
+            # stay searchable until then
+            report('indexing', 0, len(chunks_data))
+            self._save_chunks_to_db(document, diff, text_content)
             
-            # Save chunks to database
-            self._save_chunks_to_db(document, chunks_with_embeddings)
-            
-            logger.info(f"Processed document {document.name} into {len(chunks_with_embeddings)} chunks")
+            logger.info(
+                f"Processed document {document.name} into {len(chunks_data)} chunks "
+                f"({len(diff.added)} embedded, {len(diff.kept)} unchanged, {len(diff.removed)} removed)"
+            )
             
         except Exception as e:
             logger.error(f"Error in document processing pipeline: {str(e)}")
             raise
     
-    def _save_chunks_to_db(self, document: Document, chunks_data: List[Dict[str, Any]]) -> None:
+    def process_documents(self, documents: List[Document]) -> List[Dict[str, Any]]:
         """
-        Save processed chunks to the database
+        Process many new documents together: their files are extracted in
+        parallel processes, and the chunks of all of them share embedding
+        batches and one bulk insert
         
         Args:
-            document: Document object
-            chunks_data: List of chunk dictionaries with content and embeddings
+            documents: Unprocessed documents created by create_*_document
+            
+        Returns:
+            One result per document, in order, with its document_id, name,
+            status ('indexed' or 'failed'), number of chunks and error
         """
+        results = {
+            document.id: {'document_id': str(document.id), 'name': document.name, 'status': 'failed', 'chunks': 0, 'error': None}
+            for document in documents
+        }
+        
+        def fail(document: Document, error: Exception) -> None:
+            logger.error(f"Error processing document {document.name}: {str(error)}")
+            results[document.id]['error'] = str(error)
+            mark_documents_failed(Document.objects.filter(id=document.id))
+        
+        pending = []
+        for document in documents:
+            try:
+                if document.chunks.exists():
+                    # Documents that already have chunks are re-processed incrementally, on their own
+                    self.process_document(document)
+                elif not self.reuse_existing_ingestion(document):
+                    pending.append(document)
+                    continue
+                results[document.id].update(status='indexed', chunks=document.chunks.count())
+            except Exception as e:
+                fail(document, e)
+        
+        # Files are extracted and chunked in parallel; text entered directly is already on the document
+        files = [document for document in pending if document.file_path]
+        with ExitStack() as stack:
+            paths = [stack.enter_context(local_path(document.file_path)) for document in files]
+            extracted = dict(zip(
+                [document.id for document in files],
+                self.document_processor.extract_files(
+                    list(zip(paths, [document.file_type for document in files])), self.text_chunker
+                ) if files else []
+            ))
+        chunked = []
+        for document in pending:
+            outcome = extracted.get(document.id)
+            if outcome is None:
+                outcome = document.content, self.text_chunker.chunk_text(document.content)
+            if isinstance(outcome, Exception):
+                fail(document, outcome)
+                continue
+            document.content, chunks_data = outcome
+            chunked.append((document, chunks_data))
+        
         try:
-            # Delete existing chunks for this document
-            DocumentChunk.objects.filter(document=document).delete()
+            # Chunks from every document go into the same token-aware embedding batches
+            self.embedding_service.embed_chunks([chunk_data for _, chunks_data in chunked for chunk_data in chunks_data])
+            self._save_new_documents(chunked)
+        except Exception as e:
+            for document, _ in chunked:
+                fail(document, e)
+        else:
+            for document, chunks_data in chunked:
+                results[document.id].update(status='indexed', chunks=len(chunks_data))
+        
+        logger.info(f"Processed {len(documents)} documents, {len(chunked)} of them extracted and embedded together")
+        return [results[document.id] for document in documents]
+    
+    def _save_new_documents(self, chunked: List[Tuple[Document, List[Dict[str, Any]]]]) -> None:
+        """
+        Insert the embedded chunks of several documents that have none yet and
+        mark the documents indexed
+        
+        Args:
+            chunked: (document, embedded chunk data) pairs
+        """
+        created = [
+            (document, [self._new_chunk(document, chunk_data) for chunk_data in chunks_data], chunks_data)
+            for document, chunks_data in chunked
+        ]
+        with transaction.atomic():
+            DocumentChunk.objects.bulk_create([chunk for _, chunks, _ in created for chunk in chunks], batch_size=500)
+            now = timezone.now()
+            for document, chunks, chunks_data in created:
+                lexical_index.update_chunks(document, [], chunks)
+                self._tag_embedding_space(document, len(chunks_data[0]['embedding']) if chunks_data else None)
+                document.chunk_size = self.text_chunker.chunk_size
+                document.chunk_overlap = self.text_chunker.chunk_overlap
+                document.status = 'indexed'
+                document.updated_at = now
+            Document.objects.bulk_update([document for document, _, _ in created], [
+                'content', 'embedding_provider', 'embedding_model', 'embedding_dimensions',
+                'chunk_size', 'chunk_overlap', 'status', 'updated_at'
+            ], batch_size=500)
+        
+        for document, chunks, chunks_data in created:
+            vector_index_registry.update_chunks(
+                document, [], [str(chunk.id) for chunk in chunks], [chunk_data['embedding'] for chunk_data in chunks_data]
+            )
+    
+    def reuse_existing_ingestion(self, document: Document) -> bool:
+        """
+        Index a new file document by copying the text and chunk embeddings of
+        an indexed document with the same file content, chunking and
+        embedding space
+        
+        Args:
+            document: Unprocessed document created by create_file_document
             
-            # Create new chunks
-            chunks_to_create = []
-            for chunk_data in chunks_data:
-                chunk = DocumentChunk(
+        Returns:
+            Whether a matching document was found and the document is now indexed
+        """
+        if not document.content_sha256 or document.chunks.exists():
+            return False
+        space = self.embedding_service.space
+        source = Document.objects.filter(
+            content_sha256=document.content_sha256,
+            file_type=document.file_type,
+            chunk_size=self.text_chunker.chunk_size,
+            chunk_overlap=self.text_chunker.chunk_overlap,
+            **RetrievalScope.build(embedding_space=space).document_filter()
+        ).exclude(id=document.id).order_by('-updated_at').first()
+        if source is None:
+            return False
+        
+        with transaction.atomic():
+            document.content = source.content
+            chunks = []
+            for chunk in source.chunks.order_by('chunk_index').iterator(chunk_size=500):
+                chunks.append(DocumentChunk(
                     document=document,
-                    content=chunk_data['content'],
-                    chunk_index=chunk_data['chunk_index'],
-                    embedding=chunk_data['embedding'],
-                    metadata=chunk_data['metadata']
-                )
-                chunks_to_create.append(chunk)
+                    content=chunk.content,
+                    start_offset=chunk.start_offset,
+                    end_offset=chunk.end_offset,
+                    content_hash=chunk.content_hash,
+                    chunk_index=chunk.chunk_index,
+                    metadata=chunk.metadata,
+                    embedding_data=chunk.embedding_data,
+                    embedding_dtype=chunk.embedding_dtype,
+                    embedding_norm=chunk.embedding_norm,
+                    embedding_model=chunk.embedding_model,
+                    embedding_dimensions=chunk.embedding_dimensions,
+                ))
+            DocumentChunk.objects.bulk_create(chunks, batch_size=500)
+            lexical_index.update_chunks(document, [], chunks)
+            
+            document.chunk_size, document.chunk_overlap = source.chunk_size, source.chunk_overlap
+            self._tag_embedding_space(document, source.embedding_dimensions)
+            document.status = 'indexed'
+            document.save()
+        
+        embedded = [chunk for chunk in chunks if chunk.has_embedding]
+        vector_index_registry.update_chunks(
+            document, [], [str(chunk.id) for chunk in embedded],
+            [chunk.embedding for chunk in embedded]
+        )
+        logger.info(f"Reused {len(chunks)} chunks of {source.name} for identical upload {document.name}")
+        return True
+    
+    def _diff_chunks(self, document: Document, chunks_data: List[Dict[str, Any]]) -> ChunkDiff:
+        """
+        Match a document's new chunks against its stored ones by content hash
+        
+        Stored embeddings are only reused when the document was embedded in
+        this pipeline's embedding space.
+        
+        Args:
+            document: Document being (re)processed
+            chunks_data: The document's new chunks, in order
             
-            # Bulk create chunks
-            DocumentChunk.objects.bulk_create(chunks_to_create)
+        Returns:
+            ChunkDiff of stored chunks to keep, new chunks to embed and stored
+            chunks to delete
+        """
+        stored = list(document.chunks.defer('embedding_data').order_by('chunk_index'))
+        space = self.embedding_service.space
+        reusable = (document.embedding_provider, document.embedding_model, document.embedding_dimensions) == (
+            space.provider, space.model, space.dimensions
+        )
+        
+        by_hash: Dict[str, List[DocumentChunk]] = {}
+        for chunk in stored if reusable else []:
+            if chunk.has_embedding:
+                by_hash.setdefault(chunk.content_hash or content_hash(chunk.text), []).append(chunk)
+        
+        diff = ChunkDiff([], [], [])
+        for chunk_data in chunks_data:
+            chunk_data['content_hash'] = content_hash(chunk_data['content'])
+            matches = by_hash.get(chunk_data['content_hash'])
+            if matches:
+                diff.kept.append((matches.pop(0), chunk_data))
+            else:
+                diff.added.append(chunk_data)
+        kept_ids = {chunk.id for chunk, _ in diff.kept}
+        diff.removed.extend(chunk for chunk in stored if chunk.id not in kept_ids)
+        return diff
+    
+    def _save_chunks_to_db(self, document: Document, diff: ChunkDiff, text_content: Optional[str] = None) -> None:
+        """
+        Apply a chunk diff to the database and the search indexes
+        
+        Args:
+            document: Document object
+            diff: Chunks to keep, add (with embeddings) and delete
+            text_content: The document's new text, saved together with the
+                          chunks whose offsets point into it
+        """
+        try:
+            with transaction.atomic():
+                if text_content is not None:
+                    document.content = text_content
+                DocumentChunk.objects.filter(id__in=[chunk.id for chunk in diff.removed]).delete()
+                
+                # Kept chunks may move; park them on negative indexes first so
+                # (document, chunk_index) stays unique throughout
+                moved = [(chunk, data) for chunk, data in diff.kept if chunk.chunk_index != data['chunk_index']]
+                for position, (chunk, _) in enumerate(moved):
+                    chunk.chunk_index = -1 - position
+                DocumentChunk.objects.bulk_update([chunk for chunk, _ in moved], ['chunk_index'], batch_size=500)
+                for chunk, chunk_data in diff.kept:
+                    chunk.content, chunk.start_offset, chunk.end_offset = self._chunk_storage(document, chunk_data)
+                    chunk.content_hash = chunk_data['content_hash']
+                    chunk.chunk_index = chunk_data['chunk_index']
+                    chunk.metadata = chunk_data['metadata']
+                DocumentChunk.objects.bulk_update(
+                    [chunk for chunk, _ in diff.kept],
+                    ['content', 'start_offset', 'end_offset', 'content_hash', 'chunk_index', 'metadata'],
+                    batch_size=500
+                )
+                
+                # Create new chunks
+                chunks_to_create = [self._new_chunk(document, chunk_data) for chunk_data in diff.added]
+                
+                # Bulk create chunks and update the keyword index
+                DocumentChunk.objects.bulk_create(chunks_to_create)
+                removed_ids = [str(chunk.id) for chunk in diff.removed]
+                lexical_index.update_chunks(document, removed_ids, chunks_to_create)
+                
+                # Tag the document with its embedding space, mark it searchable and bump updated_at so
+                # indexes in other processes see the new corpus; any index cached
+                # in this one is updated in place
+                if diff.added:
+                    dimensions = len(diff.added[0]['embedding'])
+                else:
+                    dimensions = diff.kept[0][0].embedding_dimensions if diff.kept else None
+                self._tag_embedding_space(document, dimensions)
+                document.chunk_size = self.text_chunker.chunk_size
+                document.chunk_overlap = self.text_chunker.chunk_overlap
+                document.status = 'indexed'
+                document.save(update_fields=[
+                    'content', 'embedding_provider', 'embedding_model', 'embedding_dimensions',
+                    'chunk_size', 'chunk_overlap', 'status', 'updated_at'
+                ])
+            
+            vector_index_registry.update_chunks(
+                document,
+                removed_ids,
+                [str(chunk.id) for chunk in chunks_to_create],
+                [chunk_data['embedding'] for chunk_data in diff.added]
+            )
             
-            logger.info(f"Saved {len(chunks_to_create)} chunks to database for document {document.name}")
+            logger.info(f"Saved {len(chunks_to_create)} new chunks to database for document {document.name}")
             
         except Exception as e:
             logger.error(f"Error saving chunks to database: {str(e)}")
             raise
     
+    @staticmethod
+    def _detach_chunk_text(document: Document) -> None:
+        """
+        Give a document's chunks stored as offsets their own copy of their
+        text, so they stay correct while the document's text is replaced
+        """
+        current_text = Document.objects.filter(id=OuterRef('document_id')).values('content')[:1]
+        document.chunks.filter(start_offset__isnull=False).update(
+            content=Substr(Subquery(current_text), F('start_offset') + 1, F('end_offset') - F('start_offset')),
+            start_offset=None,
+            end_offset=None,
+        )
+    
+    def _new_chunk(self, document: Document, chunk_data: Dict[str, Any]) -> DocumentChunk:
+        """
+        Unsaved DocumentChunk for embedded chunk data
+        """
+        content, start_offset, end_offset = self._chunk_storage(document, chunk_data)
+        chunk = DocumentChunk(
+            document=document,
+            content=content,
+            start_offset=start_offset,
+            end_offset=end_offset,
+            content_hash=chunk_data['content_hash'],
+            chunk_index=chunk_data['chunk_index'],
+            metadata=chunk_data['metadata']
+        )
+        chunk.set_embedding(
+            chunk_data['embedding'],
+            model=self.embedding_service.model,
+            dtype=settings.RAG_EMBEDDING_STORAGE_DTYPE
+        )
+        return chunk
+    
+    @staticmethod
+    def _chunk_storage(document: Document, chunk_data: Dict[str, Any]) -> Tuple[str, Optional[int], Optional[int]]:
+        """
+        The (content, start_offset, end_offset) to store for a new chunk:
+        offsets into the document's content when RAG_CHUNK_STORAGE is
+        'offsets' and the chunk's text is exactly that span, otherwise the text
+        """
+        start, end = chunk_data.get('start_offset'), chunk_data.get('end_offset')
+        if settings.RAG_CHUNK_STORAGE == 'offsets' and start is not None and \
+                (document.content or '')[start:end] == chunk_data['content']:
+            return '', start, end
+        return chunk_data['content'], None, None
+    
+    def _tag_embedding_space(self, document: Document, dimensions: Optional[int]) -> None:
+        """
+        Record which provider, model and dimension a document was embedded with
+        """
+        space = self.embedding_service.space
+        document.embedding_provider = space.provider
+        document.embedding_model = space.model
+        document.embedding_dimensions = dimensions or space.dimensions
+    
+    def reembed_document(self, document: Document, truncate: bool = False) -> int:
+        """
+        Re-embed a document's existing chunks with this pipeline's embedding
+        service, e.g. after switching provider, model or dimensions
+        
+        Args:
+            document: Document to re-embed
+            truncate: Shorten and renormalise the stored vectors instead of
+                      calling the provider; only valid when the document was
+                      embedded with the same model at more dimensions
+            
+        Returns:
+            Number of chunks re-embedded
+        """
+        if truncate:
+            chunks = list(document.chunks.filter(embedding_data__isnull=False).order_by('chunk_index'))
+            chunks_data = self._truncated_embeddings(document, chunks)
+        else:
+            chunks = list(document.chunks.defer('embedding_data').order_by('chunk_index'))
+            chunks_data = self.embedding_service.embed_chunks([{'content': chunk.text} for chunk in chunks])
+        for chunk, chunk_data in zip(chunks, chunks_data):
+            chunk.set_embedding(
+                chunk_data['embedding'],
+                model=self.embedding_service.model,
+                dtype=settings.RAG_EMBEDDING_STORAGE_DTYPE
+            )
+        DocumentChunk.objects.bulk_update(
+            chunks, ['embedding_data', 'embedding_dtype', 'embedding_norm', 'embedding_model', 'embedding_dimensions'],
+            batch_size=500
+        )
+        
+        self._tag_embedding_space(document, len(chunks_data[0]['embedding']) if chunks_data else None)
+        document.save(update_fields=['embedding_provider', 'embedding_model', 'embedding_dimensions', 'updated_at'])
+        vector_index_registry.update_document(
+            document,
+            [str(chunk.id) for chunk in chunks],
+            [chunk_data['embedding'] for chunk_data in chunks_data]
+        )
+        logger.info(f"Re-embedded {len(chunks)} chunks of document {document.name} with {self.embedding_service.model}")
+        return len(chunks)
+    
+    def _truncated_embeddings(self, document: Document, chunks: List[DocumentChunk]) -> List[Dict[str, Any]]:
+        """
+        The stored embeddings of a document's chunks cut down to this
+        pipeline's dimensions and rescaled to unit length
+        """
+        if self.embedding_service.provider.dimensions is None:
+            raise ValueError("Truncating embeddings requires a target dimension (RAG_EMBEDDING_DIMENSIONS)")
+        space = self.embedding_service.space
+        if (document.embedding_provider, document.embedding_model) != (space.provider, space.model):
+            raise ValueError(
+                f"Document {document.name} was embedded with {document.embedding_provider}/{document.embedding_model}, "
+                f"not {space.provider}/{space.model}; re-embed it instead of truncating"
+            )
+        return [
+            {'content': chunk.text, 'embedding': truncate_embedding(chunk.embedding, space.dimensions).tolist()}
+            for chunk in chunks
+        ]
+    
+    def _scope(self, template_id: str = None, session_id: str = None, document_ids: List[str] = None) -> RetrievalScope:
+        """
+        Retrieval scope limited to documents embedded like the queries will be
+        """
+        space = self.embedding_service.space
+        scope = RetrievalScope.build(template_id, session_id, document_ids, embedding_space=space)
+        if space not in _checked_spaces:
+            # Once per process rather than a query per retrieval
+            _checked_spaces.add(space)
+            if Document.objects.filter(**ALL_DOCUMENTS.document_filter()).exclude(embedding_provider='').exclude(**scope.space_filter()).exists():
+                logger.warning(
+                    f"🔍 RAG DEBUG: Documents embedded with another provider or model than {space.provider}/{space.model} "
+                    f"are left out of retrieval; run 'manage.py reembed_documents' to include them"
+                )
+        return scope
+    
     def get_document_chunks(self, document_id: str) -> List[Dict[str, Any]]:
         """
         Get all chunks for a specific document
@@ -219,16 +701,18 @@ class RAGPipeline:
             List of chunks for the document
         """
         try:
-            chunks = DocumentChunk.objects.filter(document_id=document_id).order_by('chunk_index')
+            chunks = DocumentChunk.objects.filter(document_id=document_id).with_text().select_related('document').defer(
+                'embedding_data', 'document__content'
+            ).order_by('chunk_index')
             
             results = []
             for chunk in chunks:
                 result = {
                     'chunk_id': str(chunk.id),
-                    'content': chunk.content,
+                    'content': chunk.text,
                     'chunk_index': chunk.chunk_index,
-                    'metadata': chunk.metadata,
-                    'has_embedding': chunk.embedding is not None
+                    'metadata': chunk.full_metadata,
+                    'has_embedding': chunk.has_embedding
                 }
                 results.append(result)
             
@@ -238,7 +722,8 @@ class RAGPipeline:
             logger.error(f"Error getting document chunks: {str(e)}")
             return []
     
-    def get_similar_chunks_internal(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    def get_similar_chunks_internal(self, query: str, top_k: int = 5, template_id: str = None,
+                                    session_id: str = None, document_ids: List[str] = None) -> List[Dict[str, Any]]:
         """
         Internal method to get similar chunks for use in other services
         This is not exposed via API
@@ -246,6 +731,9 @@ class RAGPipeline:
         Args:
             query: Search query
             top_k: Number of top results to return
+            template_id: Optional template ID to restrict the search to
+            session_id: Optional session ID to restrict the search to
+            document_ids: Optional document IDs to restrict the search to
             
         Returns:
             List of similar chunks with metadata
@@ -254,57 +742,201 @@ class RAGPipeline:
             logger.info(f"🔍 RAG DEBUG: Starting similarity search for query: '{query[:100]}...'")
             
             # Generate embedding for query
-            query_embedding = self.embedding_service.generate_embedding(query)
+            query_embedding = self.embedding_service.embed_query(query)
             logger.info(f"🔍 RAG DEBUG: Generated query embedding with {len(query_embedding)} dimensions")
             
-            # Get all chunks from database
-            all_chunks = DocumentChunk.objects.all()
-            logger.info(f"🔍 RAG DEBUG: Found {all_chunks.count()} total chunks in database")
+            # Score the query against the resident vector index for the scope;
+            # the document filter is applied in SQL before any vectors load
+            scope = self._scope(template_id, session_id, document_ids)
+            index = vector_index_registry.get_index(scope)
+            logger.info(f"🔍 RAG DEBUG: Searching vector index of {len(index)} chunks")
             
-            if not all_chunks:
+            if len(index) == 0:
                 logger.info("🔍 RAG DEBUG: No chunks found in database")
                 return []
             
-            # Calculate similarities
-            similarities = []
-            for chunk in all_chunks:
-                if chunk.embedding:
-                    similarity = self.embedding_service.cosine_similarity(
-                        query_embedding, chunk.embedding
-                    )
-                    similarities.append((chunk, similarity))
-                    logger.debug(f"🔍 RAG DEBUG: Chunk {chunk.id} from '{chunk.document.name}' similarity: {similarity:.3f}")
-                else:
-                    logger.warning(f"🔍 RAG DEBUG: Chunk {chunk.id} has no embedding")
+            top_hits = self._hybrid_hits(index, scope, [query], [query_embedding], top_k)[0]
+            results = self._load_chunk_results(top_hits)
             
-            logger.info(f"🔍 RAG DEBUG: Calculated similarities for {len(similarities)} chunks")
+            logger.info(f"🔍 RAG DEBUG: Top {len(results)} results:")
+            for i, result in enumerate(results, 1):
+                logger.info(f"🔍 RAG DEBUG: #{i}: Chunk {result['chunk_id']} from '{result['document_name']}' (similarity: {result['similarity_score']:.3f})")
+                logger.info(f"🔍 RAG DEBUG: #{i} content preview: {result['content'][:100]}...")
             
-            # Sort by similarity and get top results
-            similarities.sort(key=lambda x: x[1], reverse=True)
-            top_results = similarities[:top_k]
+            logger.info(f"🔍 RAG DEBUG: Returning {len(results)} similar chunks for internal query")
+            return results
             
-            logger.info(f"🔍 RAG DEBUG: Top {len(top_results)} results:")
-            for i, (chunk, similarity) in enumerate(top_results, 1):
-                logger.info(f"🔍 RAG DEBUG: #{i}: Chunk {chunk.id} from '{chunk.document.name}' (similarity: {similarity:.3f})")
-                logger.info(f"🔍 RAG DEBUG: #{i} content preview: {chunk.content[:100]}...")
+        except Exception as e:
+            logger.error(f"🔍 RAG DEBUG: Error getting similar chunks internally: {str(e)}")
+            return [] 
+    
+    def get_similar_chunks_multi(self, queries: List[str], top_k: int = 3, limit: int = 10,
+                                 fusion: str = 'max', template_id: str = None, session_id: str = None,
+                                 document_ids: List[str] = None) -> List[Dict[str, Any]]:
+        """
+        Internal method to retrieve chunks for several queries at once.
+        All queries are embedded in one API call and scored against the
+        index in one matrix product, then the per-query results are fused.
+        
+        Args:
+            queries: Search queries
+            top_k: Number of top results to take per query
+            limit: Maximum number of fused results to return
+            fusion: 'max' to rank by the best position a chunk reached in any
+                    query's results, or 'rrf' for reciprocal rank fusion; both
+                    keep each query's hybrid ranking rather than re-sorting
+                    by raw similarity
+            template_id: Optional template ID to restrict the search to
+            session_id: Optional session ID to restrict the search to
+            document_ids: Optional document IDs to restrict the search to
             
-            # Format results
-            results = []
-            for chunk, similarity in top_results:
-                result = {
-                    'chunk_id': str(chunk.id),
-                    'content': chunk.content,
-                    'similarity_score': similarity,
-                    'document_name': chunk.document.name,
-                    'document_id': str(chunk.document.id),
-                    'chunk_index': chunk.chunk_index,
-                    'metadata': chunk.metadata
-                }
-                results.append(result)
+        Returns:
+            List of unique similar chunks with metadata, best first
+        """
+        try:
+            queries = [query for query in dict.fromkeys(queries) if query]
+            if not queries:
+                return []
             
-            logger.info(f"🔍 RAG DEBUG: Returning {len(results)} similar chunks for internal query")
+            logger.info(f"🔍 RAG DEBUG: Starting multi-query similarity search for {len(queries)} queries")
+            
+            scope = self._scope(template_id, session_id, document_ids)
+            index = vector_index_registry.get_index(scope)
+            if len(index) == 0:
+                logger.info("🔍 RAG DEBUG: No chunks found in database")
+                return []
+            
+            query_embeddings = self.embedding_service.embed_queries(queries)
+            hits_per_query = self._hybrid_hits(index, scope, queries, query_embeddings, top_k)
+            
+            fused = self._fuse_hits(hits_per_query, fusion)[:limit]
+            results = self._load_chunk_results([(chunk_id, similarity) for chunk_id, similarity, _ in fused])
+            fusion_scores = {chunk_id: score for chunk_id, _, score in fused}
+            for result in results:
+                result['fusion_score'] = fusion_scores[result['chunk_id']]
+            
+            logger.info(f"🔍 RAG DEBUG: Returning {len(results)} fused chunks from {len(index)} indexed chunks")
             return results
             
         except Exception as e:
-            logger.error(f"🔍 RAG DEBUG: Error getting similar chunks internally: {str(e)}")
-            return [] 
\ No newline at end of file
+            logger.error(f"🔍 RAG DEBUG: Error getting similar chunks for multiple queries: {str(e)}")
+            return []
+    
+    def _hybrid_hits(self, index, scope: RetrievalScope, queries: List[str],
+                     query_embeddings: List[List[float]], top_k: int) -> List[List[tuple]]:
+        """
+        Rank chunks for each query by fusing vector similarity with keyword
+        (BM25) relevance, so exact identifiers are found even when their
+        embeddings are not close to the query's
+        
+        On scopes with at least RAG_LEXICAL_PREFILTER_MIN_CHUNKS chunks the
+        keyword matches also act as a prefilter: only they are scored against
+        the query embedding, unless there are fewer than top_k of them.
+        
+        Args:
+            index: Vector index for the scope
+            scope: Documents being searched
+            queries: Search queries
+            query_embeddings: Embedding of each query
+            top_k: Number of results per query
+            
+        Returns:
+            One list of (chunk_id, similarity_score) per query, best first
+        """
+        if not lexical_index.available:
+            return index.search_batch(query_embeddings, top_k)
+        
+        depth = max(top_k * settings.RAG_HYBRID_CANDIDATE_FACTOR, top_k)
+        prefilter = len(index) >= settings.RAG_LEXICAL_PREFILTER_MIN_CHUNKS
+        keyword_limit = settings.RAG_LEXICAL_PREFILTER_CANDIDATES if prefilter else depth
+        keyword_hits = [lexical_index.search(query, scope, keyword_limit) for query in queries]
+        
+        full_scan = [i for i, hits in enumerate(keyword_hits) if not prefilter or len(hits) < top_k]
+        vector_hits = {}
+        if full_scan:
+            scanned = index.search_batch([query_embeddings[i] for i in full_scan], depth)
+            vector_hits = dict(zip(full_scan, scanned))
+        
+        results = []
+        for i, (query_embedding, keywords) in enumerate(zip(query_embeddings, keyword_hits)):
+            if i in vector_hits:
+                vector = vector_hits[i]
+            else:
+                vector = index.score_chunks(query_embedding, [chunk_id for chunk_id, _ in keywords])[:depth]
+            
+            # Keyword matches outside the vector candidates still need a similarity
+            similarity = dict(vector)
+            keywords = keywords[:depth]
+            missing = [chunk_id for chunk_id, _ in keywords if chunk_id not in similarity]
+            similarity.update(index.score_chunks(query_embedding, missing))
+            keyword_ranking = [(chunk_id, similarity[chunk_id]) for chunk_id, _ in keywords if chunk_id in similarity]
+            
+            fused = self._fuse_hits([vector, keyword_ranking], fusion='rrf')[:top_k]
+            results.append([(chunk_id, best_similarity) for chunk_id, best_similarity, _ in fused])
+        return results
+    
+    @staticmethod
+    def _fuse_hits(hits_per_query: List[List[tuple]], fusion: str = 'max', rrf_k: int = 60) -> List[tuple]:
+        """
+        Merge per-query hit lists into one ranking with each chunk at most once
+        
+        Chunks are fused on their rank in each list, not their similarity:
+        the lists may already be ranked by more than similarity (see
+        _hybrid_hits). 'max' scores a chunk by its best rank, 'rrf' sums
+        reciprocal ranks over the lists; ties go to the higher similarity.
+        
+        Args:
+            hits_per_query: One list of (chunk_id, similarity_score) per query, best first
+            fusion: 'max' or 'rrf'
+            rrf_k: Rank offset for reciprocal rank fusion
+            
+        Returns:
+            List of tuples (chunk_id, best_similarity, fusion_score) sorted by fusion score
+        """
+        if fusion not in ('max', 'rrf'):
+            raise ValueError(f"Unsupported fusion method: {fusion}")
+        
+        best_similarity: Dict[str, float] = {}
+        fusion_scores: Dict[str, float] = {}
+        for hits in hits_per_query:
+            for rank, (chunk_id, similarity) in enumerate(hits, 1):
+                best_similarity[chunk_id] = max(similarity, best_similarity.get(chunk_id, float('-inf')))
+                if fusion == 'rrf':
+                    fusion_scores[chunk_id] = fusion_scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+                else:
+                    fusion_scores[chunk_id] = max(fusion_scores.get(chunk_id, 0.0), 1.0 / (rrf_k + rank))
+        
+        fused = [(chunk_id, best_similarity[chunk_id], score) for chunk_id, score in fusion_scores.items()]
+        fused.sort(key=lambda x: (x[2], x[1]), reverse=True)
+        return fused
+    
+    def _load_chunk_results(self, hits: List[tuple]) -> List[Dict[str, Any]]:
+        """
+        Fetch the chunks for a ranked list of hits and format them as results
+        
+        Args:
+            hits: List of tuples (chunk_id, similarity_score), best first
+            
+        Returns:
+            List of result dictionaries in the same order as hits
+        """
+        # Only the hits' text is materialised, sliced from their documents in SQL
+        chunks_by_id = DocumentChunk.objects.with_text().select_related('document').defer(
+            'embedding_data', 'document__content'
+        ).in_bulk([chunk_id for chunk_id, _ in hits])
+        
+        results = []
+        for chunk_id, similarity in hits:
+            chunk = chunks_by_id.get(uuid.UUID(chunk_id))
+            if chunk is None:
+                continue
+            results.append({
+                'chunk_id': str(chunk.id),
+                'content': chunk.text,
+                'similarity_score': similarity,
+                'document_name': chunk.document.name,
+                'document_id': str(chunk.document.id),
+                'chunk_index': chunk.chunk_index,
+                'metadata': chunk.full_metadata
+            })
+        return results
@@ -0,0 +1,149 @@
+"""
+Retention: expiring session documents and deleting upload files no document refers to
+"""
+import os
+from datetime import timedelta
+from typing import Iterator, NamedTuple, Optional
+import logging
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from ..models import Document, IngestionJob
+from .upload_storage import modified_within
+from .vector_shards import vector_shard_store
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_PREFIX = 'uploads'
+
+# Document fields the post_delete handlers read (to match cached index scopes
+# and find the stored file); nothing else is loaded to delete a document
+DELETE_FIELDS = (
+    'id', 'template_id', 'session_id', 'file_path', 'status',
+    'embedding_provider', 'embedding_model', 'embedding_dimensions',
+)
+
+
+class GCResult(NamedTuple):
+    deleted: int
+    bytes: int
+    kept: int  # Stored files that are referenced or too recent to delete
+
+
+def delete_documents(documents: QuerySet, batch_size: Optional[int] = None) -> int:
+    """
+    Delete documents batch by batch, each batch in its own transaction
+
+    Only the fields the delete signal handlers need are loaded; chunks and
+    ingestion jobs are deleted by one statement per batch without being
+    loaded at all. The batch's documents are removed from the vector shards
+    in one pass once it commits.
+
+    Args:
+        documents: Documents to delete
+        batch_size: Documents per batch (defaults to RAG_SWEEP_BATCH_SIZE)
+
+    Returns:
+        Number of documents deleted
+    """
+    batch_size = batch_size or settings.RAG_SWEEP_BATCH_SIZE
+    ids = documents.order_by().values_list('id', flat=True)
+    deleted = 0
+    while True:
+        batch = list(ids[:batch_size])
+        if not batch:
+            return deleted
+        with transaction.atomic(), vector_shard_store.batched_removals():
+            _, counts = Document.objects.filter(id__in=batch).only(*DELETE_FIELDS).delete()
+        deleted += counts.get(Document._meta.label, 0)
+
+
+def expired_session_documents(ttl: Optional[int] = None) -> QuerySet:
+    """
+    Session documents not updated for ttl seconds (defaults to
+    RAG_SESSION_TTL_SECONDS), leaving out those still being ingested
+    """
+    ttl = settings.RAG_SESSION_TTL_SECONDS if ttl is None else ttl
+    cutoff = timezone.now() - timedelta(seconds=ttl)
+    return Document.objects.filter(session_id__isnull=False, updated_at__lt=cutoff).exclude(session_id='').exclude(
+        ingestion_jobs__status__in=[IngestionJob.STATUS_QUEUED, IngestionJob.STATUS_RUNNING]
+    )
+
+
+def sweep_expired_sessions(ttl: Optional[int] = None, batch_size: Optional[int] = None) -> int:
+    """
+    Delete expired session documents with their chunks and files
+
+    Returns:
+        Number of documents deleted
+    """
+    deleted = delete_documents(expired_session_documents(ttl), batch_size)
+    if deleted:
+        logger.info(f"Deleted {deleted} expired session documents")
+    return deleted
+
+
+def iter_stored_files(prefix: str = UPLOADS_PREFIX) -> Iterator[str]:
+    """
+    Storage paths of every file under a prefix, depth first
+    """
+    try:
+        directories, files = default_storage.listdir(prefix)
+    except FileNotFoundError:
+        return
+    for name in files:
+        yield f"{prefix}/{name}"
+    for name in directories:
+        yield from iter_stored_files(f"{prefix}/{name}")
+
+
+def collect_orphaned_uploads(grace: Optional[int] = None, dry_run: bool = False,
+                             batch_size: Optional[int] = None) -> GCResult:
+    """
+    Delete upload files that no document's file_path refers to
+
+    Files are checked against the database a batch at a time, so memory does
+    not grow with the number of documents or files. Files modified in the
+    last grace seconds (defaults to RAG_UPLOAD_GC_GRACE_SECONDS) are kept:
+    an upload is stored, or an identical stored one reused, before its
+    document is saved.
+
+    Returns:
+        GCResult with the files deleted (or that would be), their size, and
+        the files kept
+    """
+    grace = settings.RAG_UPLOAD_GC_GRACE_SECONDS if grace is None else grace
+    batch_size = batch_size or settings.RAG_SWEEP_BATCH_SIZE
+    deleted = size = kept = 0
+
+    def collect(paths):
+        nonlocal deleted, size, kept
+        referenced = set(Document.objects.filter(file_path__in=paths).values_list('file_path', flat=True))
+        for path in paths:
+            if path in referenced or modified_within(path, grace):
+                kept += 1
+                continue
+            file_size = default_storage.size(path)
+            if not dry_run:
+                default_storage.delete(path)
+            deleted += 1
+            size += file_size
+
+    batch = []
+    for path in iter_stored_files():
+        if os.path.basename(path).startswith('.'):
+            continue
+        batch.append(path)
+        if len(batch) >= batch_size:
+            collect(batch)
+            batch = []
+    if batch:
+        collect(batch)
+
+    if deleted and not dry_run:
+        logger.info(f"Deleted {deleted} orphaned upload files ({size} bytes)")
+    return GCResult(deleted, size, kept)
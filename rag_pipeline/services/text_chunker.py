@@ -1,16 +1,76 @@
 """
 Text chunking service for breaking documents into smaller pieces for better embedding and retrieval
 """
-from typing import List, Dict, Any, Optional
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from bisect import bisect_right
+from collections import deque
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator
 import logging
 
 logger = logging.getLogger(__name__)
 
+SEPARATORS = ["\n\n", "\n", " ", ""]
+
+
+class _SpanMerger:
+    """
+    Greedily merges adjacent spans into chunks of at most chunk_size
+    characters, carrying up to chunk_overlap characters into the next chunk
+    """
+    
+    def __init__(self, chunk_size: int, chunk_overlap: int):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.spans = deque()
+        self.total = 0
+    
+    def push(self, start: int, end: int) -> Optional[Tuple[int, int]]:
+        """
+        Add the next span
+        
+        Returns:
+            The span of the chunk this closes, if any
+        """
+        length = end - start
+        closed = None
+        if self.spans and self.total + length > self.chunk_size:
+            closed = (self.spans[0][0], self.spans[-1][1])
+            while self.total > self.chunk_overlap or (self.total + length > self.chunk_size and self.total > 0):
+                first_start, first_end = self.spans.popleft()
+                self.total -= first_end - first_start
+        self.spans.append((start, end))
+        self.total += length
+        return closed
+    
+    def flush(self) -> Optional[Tuple[int, int]]:
+        """
+        Close the chunk in progress and start over
+        
+        Returns:
+            The span of the closed chunk, if any
+        """
+        closed = (self.spans[0][0], self.spans[-1][1]) if self.spans else None
+        self.spans.clear()
+        self.total = 0
+        return closed
+    
+    def rebase(self, shift: int) -> None:
+        """
+        Move held spans back by shift characters after the text they index was trimmed
+        """
+        self.spans = deque((start - shift, end - shift) for start, end in self.spans)
+
 
 class TextChunker:
     """
-    Service for chunking text documents into smaller pieces for embedding
+    Service for chunking text documents into smaller pieces for embedding.
+    
+    Text is split on the first of the separators that occurs in it, keeping
+    each separator at the start of the piece it precedes; pieces shorter than
+    chunk_size are merged into chunks with overlap and longer pieces are split
+    again with the remaining separators. This reproduces langchain's
+    RecursiveCharacterTextSplitter chunk for chunk, but works on offsets into
+    the text, so each separator level scans its text once and chunks keep
+    their position in the document.
     """
     
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
@@ -23,44 +83,158 @@ class TextChunker:
         """
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
+        self.separators = SEPARATORS
+    
+    def iter_spans(self, parts: Iterable[str]) -> Iterator[Tuple[int, int, str]]:
+        """
+        Chunk a text given as consecutive parts (e.g. extracted pages),
+        yielding chunks as soon as they are complete
+        
+        Only the unchunked tail of the text is held in memory once the first
+        paragraph break has been seen; a text without paragraph breaks is
+        buffered whole. The chunks are the same as for the joined text.
+        
+        Args:
+            parts: Pieces of the text, in order
+            
+        Yields:
+            (start, end, content) of each chunk, with offsets into the joined text
+        """
+        separator, remaining = self.separators[0], self.separators[1:]
+        buffer, base = '', 0  # buffer holds the text from offset base on
+        piece_start = search = 0  # positions in buffer
+        merger = _SpanMerger(self.chunk_size, self.chunk_overlap)
+        spans: List[Tuple[int, int]] = []
+        split = False  # Whether the top-level separator has been seen
+        
+        for part in parts:
+            buffer += part
+            while True:
+                found = buffer.find(separator, search)
+                if found < 0:
+                    break
+                # The text contains the first separator, so it is split on it
+                split = True
+                if found > piece_start:
+                    self._add_piece(buffer, piece_start, found, remaining, merger, spans)
+                piece_start, search = found, found + len(separator)
+            # A separator may still start in the last few characters
+            search = max(search, len(buffer) - len(separator) + 1)
+            if not split:
+                continue
+            
+            for start, end in spans:
+                yield base + start, base + end, buffer[start:end]
+            spans.clear()
+            # Drop the text before both the piece in progress and the chunk being merged
+            cut = min(piece_start, merger.spans[0][0]) if merger.spans else piece_start
+            if cut:
+                buffer = buffer[cut:]
+                base += cut
+                piece_start -= cut
+                search -= cut
+                merger.rebase(cut)
+        
+        if split:
+            if len(buffer) > piece_start:
+                self._add_piece(buffer, piece_start, len(buffer), remaining, merger, spans)
+            self._close(buffer, merger.flush(), spans)
+        else:
+            self._split(buffer, 0, len(buffer), self.separators, spans)
+        for start, end in spans:
+            yield base + start, base + end, buffer[start:end]
     
-    def chunk_text(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    def _split(self, text: str, start: int, end: int, separators: List[str],
+               spans: List[Tuple[int, int]]) -> None:
+        """
+        Split text[start:end] on the first separator it contains and append the chunk spans
+        """
+        separator, remaining = separators[-1], []
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                separator, remaining = candidate, []
+                break
+            if text.find(candidate, start, end) >= 0:
+                separator, remaining = candidate, separators[i + 1:]
+                break
+        
+        merger = _SpanMerger(self.chunk_size, self.chunk_overlap)
+        if not separator:
+            pieces = ((position, position + 1) for position in range(start, end))
+        else:
+            pieces = self._pieces(text, start, end, separator)
+        for piece_start, piece_end in pieces:
+            self._add_piece(text, piece_start, piece_end, remaining, merger, spans)
+        self._close(text, merger.flush(), spans)
+    
+    @staticmethod
+    def _pieces(text: str, start: int, end: int, separator: str) -> Iterator[Tuple[int, int]]:
+        """
+        Spans of text[start:end] split before each occurrence of separator
+        """
+        piece_start = start
+        found = text.find(separator, start, end)
+        while found >= 0:
+            if found > piece_start:
+                yield piece_start, found
+            piece_start = found
+            found = text.find(separator, found + len(separator), end)
+        if end > piece_start:
+            yield piece_start, end
+    
+    def _add_piece(self, text: str, start: int, end: int, remaining: List[str],
+                   merger: _SpanMerger, spans: List[Tuple[int, int]]) -> None:
+        """
+        Merge a piece into the chunk in progress, or split it further if it is too long
+        """
+        if end - start < self.chunk_size:
+            self._close(text, merger.push(start, end), spans)
+            return
+        self._close(text, merger.flush(), spans)
+        if remaining:
+            self._split(text, start, end, remaining, spans)
+        else:
+            spans.append((start, end))
+    
+    @staticmethod
+    def _close(text: str, span: Optional[Tuple[int, int]], spans: List[Tuple[int, int]]) -> None:
+        """
+        Append a closed chunk's span with surrounding whitespace trimmed, unless it is blank
+        """
+        if span is None:
+            return
+        start, end = span
+        content = text[start:end]
+        stripped = content.lstrip()
+        if not stripped:
+            return
+        start += len(content) - len(stripped)
+        spans.append((start, start + len(stripped.rstrip())))
+    
+    def chunk_text(self, text: str, metadata: Optional[Dict[str, Any]] = None,
+                   pages: Optional[List[Tuple[int, Dict[str, Any]]]] = None) -> List[Dict[str, Any]]:
         """
         Split text into chunks with metadata
         
         Args:
             text: The text to chunk
             metadata: Additional metadata to include with each chunk
+            pages: Optional (offset where the page starts, page metadata) pairs
+                   in order; each chunk then records the pages it spans
             
         Returns:
-            List of chunk dictionaries with content and metadata
+            List of chunk dictionaries with content, the offsets of the
+            content in text, and metadata
         """
         try:
             logger.info(f"🔍 RAG DEBUG: Starting text chunking for text of length {len(text)}")
             logger.info(f"🔍 RAG DEBUG: Chunk size: {self.chunk_size}, Chunk overlap: {self.chunk_overlap}")
             
-            # Split the text into chunks
-            chunks = self.text_splitter.split_text(text)
-            
-            logger.info(f"🔍 RAG DEBUG: Text splitter created {len(chunks)} chunks")
-            for i, chunk in enumerate(chunks):
-                logger.info(f"🔍 RAG DEBUG: Chunk {i+1} length: {len(chunk)} chars, preview: {chunk[:100]}...")
-            
             # Create chunk objects with metadata
-            chunk_objects = []
-            for i, chunk_content in enumerate(chunks):
-                chunk_obj = {
-                    'content': chunk_content.strip(),
-                    'chunk_index': i,
-                    'metadata': metadata if metadata is not None else {}
-                }
-                chunk_objects.append(chunk_obj)
+            pages = pages or []
+            chunk_objects = self._chunk_objects(
+                self.iter_spans([text]), metadata, pages, [offset for offset, _ in pages]
+            )
             
             logger.info(f"🔍 RAG DEBUG: Created {len(chunk_objects)} chunk objects from text")
             return chunk_objects
@@ -69,8 +243,98 @@ class TextChunker:
             logger.error(f"🔍 RAG DEBUG: Error chunking text: {str(e)}")
             raise ValueError(f"Failed to chunk text: {str(e)}")
     
+    def chunk_parts(self, parts: Iterable[Tuple[str, Optional[Dict[str, Any]]]],
+                    metadata: Optional[Dict[str, Any]] = None) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Chunk a text while it is being extracted, e.g. from the page or block
+        iterators of DocumentProcessor
+        
+        Parts are fed to iter_spans as they arrive, so no list of pages or
+        blocks is built before chunking. The result is the same as stripping
+        the joined text and passing it to chunk_text, with the pages as
+        join_pages would give them.
+        
+        Args:
+            parts: (text, page metadata or None) pairs in order; a part with
+                   page metadata starts a page, and each chunk then records
+                   the pages it spans
+            metadata: Additional metadata to include with each chunk
+            
+        Returns:
+            Tuple of (joined text stripped of surrounding whitespace, which
+            the chunk offsets point into, list of chunk dictionaries)
+        """
+        texts: List[str] = []
+        pages: List[Tuple[int, Dict[str, Any]]] = []
+        page_starts: List[int] = []
+        
+        def stripped_text() -> Iterator[str]:
+            # Whitespace is held back until more text follows it, so none is
+            # yielded at either end of the text
+            position = 0  # Characters of the unstripped text read so far
+            leading = None  # Whitespace before the first text, once seen
+            held = ''
+            for text, page_metadata in parts:
+                if page_metadata is not None:
+                    offset = max(position - leading, 0) if leading is not None else 0
+                    pages.append((offset, page_metadata))
+                    page_starts.append(offset)
+                position += len(text)
+                if leading is None:
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                    leading = position - len(text)
+                body = text.rstrip()
+                if body:
+                    texts.append(held + body)
+                    yield texts[-1]
+                    held = text[len(body):]
+                else:
+                    held += text
+        
+        chunk_objects = self._chunk_objects(self.iter_spans(stripped_text()), metadata, pages, page_starts)
+        logger.info(f"Chunked streamed text of length {sum(map(len, texts))} into {len(chunk_objects)} chunks")
+        return ''.join(texts), chunk_objects
+    
+    def _chunk_objects(self, spans: Iterable[Tuple[int, int, str]], metadata: Optional[Dict[str, Any]],
+                       pages: List[Tuple[int, Dict[str, Any]]], page_starts: List[int]) -> List[Dict[str, Any]]:
+        """
+        Chunk dictionaries for the spans from iter_spans; pages and
+        page_starts may still grow while the spans are produced
+        """
+        chunk_objects = []
+        for i, (start, end, chunk_content) in enumerate(spans):
+            chunk_metadata = metadata if metadata is not None else {}
+            if page_starts:
+                chunk_metadata = {**chunk_metadata, **self._page_metadata(pages, page_starts, start, end)}
+            chunk_objects.append({
+                'content': chunk_content.strip(),
+                'chunk_index': i,
+                'start_offset': start,
+                'end_offset': end,
+                'metadata': chunk_metadata
+            })
+        return chunk_objects
+    
+    @staticmethod
+    def _page_metadata(pages: List[Tuple[int, Dict[str, Any]]], page_starts: List[int],
+                       start: int, end: int) -> Dict[str, Any]:
+        """
+        Metadata of the pages spanned by the text between start and end
+        """
+        first = max(bisect_right(page_starts, start) - 1, 0)
+        last = max(bisect_right(page_starts, max(end - 1, start)) - 1, first)
+        spanned = [page_metadata for _, page_metadata in pages[first:last + 1]]
+        page_metadata = {'page_start': spanned[0].get('page'), 'page_end': spanned[-1].get('page')}
+        labels = [page.get('page_label') for page in spanned if page.get('page_label')]
+        if labels:
+            page_metadata['page_labels'] = labels
+        return page_metadata
+    
     def chunk_document(self, document_content: str, document_name: str, 
-                      document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+                      document_id: Optional[str] = None,
+                      pages: Optional[List[Tuple[int, Dict[str, Any]]]] = None) -> List[Dict[str, Any]]:
         """
         Chunk a document with document-specific metadata
         
@@ -78,6 +342,7 @@ class TextChunker:
             document_content: The document text content
             document_name: Name of the document
             document_id: ID of the document (optional)
+            pages: Optional page offsets and metadata, see chunk_text
             
         Returns:
             List of chunk dictionaries with content and metadata
@@ -89,4 +354,4 @@ class TextChunker:
             'chunk_overlap': self.chunk_overlap
         }
         
-        return self.chunk_text(document_content, metadata) 
\ No newline at end of file
+        return self.chunk_text(document_content, metadata, pages) 
\ No newline at end of file
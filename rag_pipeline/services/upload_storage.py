@@ -0,0 +1,211 @@
+"""
+Content-addressed storage of uploaded files: each distinct file is stored once, under its sha256
+"""
+import hashlib
+import os
+import tempfile
+import zipfile
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from typing import NamedTuple, Iterable, Iterator, Optional, Tuple
+import logging
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from ..models import Document
+
+logger = logging.getLogger(__name__)
+
+BLOB_PREFIX = 'uploads/blobs'
+
+# Uploads are read, hashed and written this many bytes at a time
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# Leading bytes that identify a file's type, and how far into the file to look
+FILE_SIGNATURES = {'pdf': b'%PDF-', 'docx': b'PK\x03\x04'}
+SNIFF_BYTES = 1024
+
+
+class StoredUpload(NamedTuple):
+    path: str  # Storage path of the blob
+    sha256: str
+    size: int
+    file_type: Optional[str]  # Type identified from the content
+
+
+def sniff_file_type(head: bytes) -> Optional[str]:
+    """
+    Type of a file from its first bytes: 'pdf', 'docx' (any zip container)
+    or None if unrecognised
+    """
+    # PDF readers accept a header anywhere in the first kilobyte
+    if head.find(FILE_SIGNATURES['pdf'], 0, SNIFF_BYTES) >= 0:
+        return 'pdf'
+    if head.startswith(FILE_SIGNATURES['docx']):
+        return 'docx'
+    return None
+
+
+def blob_path(sha256: str, extension: str) -> str:
+    """
+    Storage path of the blob with the given digest
+    """
+    return f"{BLOB_PREFIX}/{sha256[:2]}/{sha256}{extension.lower()}"
+
+
+def store_upload(file_obj, expected_type: Optional[str] = None) -> StoredUpload:
+    """
+    Store an uploaded file under its digest unless an identical file is
+    already stored
+    
+    The file is read once, UPLOAD_CHUNK_SIZE bytes at a time, to hash it and
+    identify its type; memory use does not depend on the file's size. An
+    upload Django already spooled to disk is hashed in place and then moved
+    into storage, anything else is copied to a temporary file as it is read.
+
+    Args:
+        file_obj: Uploaded file (Django UploadedFile or any File)
+        expected_type: File type the name promises ('pdf' or 'docx'); a file
+                       whose content is of another type is refused before
+                       anything is stored
+
+    Returns:
+        StoredUpload with the blob's storage path, digest, size and type
+    """
+    source = file_obj if isinstance(file_obj, File) else File(file_obj)
+    on_disk = hasattr(source, 'temporary_file_path')
+    digest = hashlib.sha256()
+    size = 0
+    file_type = None
+    with nullcontext() if on_disk else tempfile.TemporaryFile() as spool:
+        for chunk in source.chunks(UPLOAD_CHUNK_SIZE):
+            if size == 0:
+                file_type = sniff_file_type(chunk[:SNIFF_BYTES])
+                if expected_type and file_type != expected_type:
+                    raise ValueError(f"{file_obj.name} is not a valid {expected_type.upper()} file")
+            digest.update(chunk)
+            size += len(chunk)
+            if spool is not None:
+                spool.write(chunk)
+        if size == 0 and expected_type:
+            raise ValueError(f"{file_obj.name} is empty")
+
+        sha256 = digest.hexdigest()
+        path = blob_path(sha256, os.path.splitext(file_obj.name or '')[1])
+        if not default_storage.exists(path):
+            if spool is not None:
+                spool.seek(0)
+                source = File(spool, name=os.path.basename(path))
+            saved = default_storage.save(path, source)
+            if saved != path:
+                # A concurrent upload of the same content stored the blob
+                # first; storage kept this copy under another name
+                default_storage.delete(saved)
+        else:
+            logger.info(f"Upload {file_obj.name} matches stored blob {path}")
+        # Deletions skip recently touched blobs, so the blob outlives the
+        # moment until the caller's document refers to it
+        _touch(path)
+    return StoredUpload(path, sha256, size, file_type)
+
+
+def _touch(path: str) -> None:
+    try:
+        os.utime(default_storage.path(path))
+    except (NotImplementedError, FileNotFoundError):
+        pass
+
+
+def modified_within(path: str, seconds: float) -> bool:
+    """
+    Whether a stored file was written or reused in the last seconds; storage
+    that cannot tell is treated as not
+    """
+    try:
+        return default_storage.get_modified_time(path) >= timezone.now() - timedelta(seconds=seconds)
+    except NotImplementedError:
+        return False
+
+
+@contextmanager
+def local_path(path: str) -> Iterator[str]:
+    """
+    Filesystem path of a stored file for extraction: the file itself when
+    storage is local, otherwise a temporary copy streamed out of storage
+    """
+    try:
+        local = default_storage.path(path)
+    except NotImplementedError:
+        local = None
+    if local is not None:
+        yield local
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(path)[1]) as copy:
+        with default_storage.open(path, 'rb') as stored:
+            for chunk in stored.chunks(UPLOAD_CHUNK_SIZE):
+                copy.write(chunk)
+        copy.flush()
+        yield copy.name
+
+
+def delete_if_unreferenced(path: str) -> bool:
+    """
+    Delete a stored file unless a document still refers to it
+
+    A blob stored or reused in the last RAG_UPLOAD_GC_GRACE_SECONDS may be
+    about to be referenced by a document that is not saved yet, so it is
+    left for 'manage.py sweep_storage' to collect once the grace period is
+    over.
+
+    Returns:
+        Whether the file was deleted
+    """
+    if not path or Document.objects.filter(file_path=path).exists():
+        return False
+    if modified_within(path, settings.RAG_UPLOAD_GC_GRACE_SECONDS):
+        logger.info(f"Left recently used upload {path} for the storage sweep")
+        return False
+    default_storage.delete(path)
+    return True
+
+
+def iter_upload_files(file_objs: Iterable) -> Iterator[Tuple[str, File]]:
+    """
+    The files of a bulk upload, with zip archives expanded into their members
+
+    Directories and hidden or macOS metadata entries in archives are skipped.
+    Raises ValueError once there are more than RAG_BULK_UPLOAD_MAX_FILES
+    files or the archives hold more than RAG_BULK_UPLOAD_MAX_BYTES.
+
+    Yields:
+        (file name, file) for each file
+    """
+    count = archived_bytes = 0
+    for file_obj in file_objs:
+        if os.path.splitext(file_obj.name or '')[1].lower() != '.zip':
+            members = [(file_obj.name, file_obj)]
+        else:
+            try:
+                archive = zipfile.ZipFile(file_obj)
+            except zipfile.BadZipFile:
+                raise ValueError(f"{file_obj.name} is not a valid zip archive")
+            infos = [
+                info for info in archive.infolist()
+                if not info.is_dir() and not any(part.startswith(('.', '__MACOSX')) for part in info.filename.split('/'))
+            ]
+            # Declared sizes bound what the members decompress to
+            archived_bytes += sum(info.file_size for info in infos)
+            if archived_bytes > settings.RAG_BULK_UPLOAD_MAX_BYTES:
+                raise ValueError(f"Archives expand to more than {settings.RAG_BULK_UPLOAD_MAX_BYTES} bytes")
+            members = ((os.path.basename(info.filename), File(archive.open(info), name=os.path.basename(info.filename)))
+                       for info in infos)
+
+        for name, member in members:
+            count += 1
+            if count > settings.RAG_BULK_UPLOAD_MAX_FILES:
+                raise ValueError(f"At most {settings.RAG_BULK_UPLOAD_MAX_FILES} files can be uploaded at once")
+            yield name, member
@@ -0,0 +1,492 @@
+"""
+Resident vector index for fast similarity search over document chunks
+"""
+import threading
+from typing import List, Dict, Tuple, Optional, Any, Iterable, NamedTuple
+import logging
+
+import numpy as np
+
+from .embedding_codec import decode_embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class VectorIndex:
+    """
+    Contiguous matrix of pre-normalised chunk embeddings held in memory.
+
+    Rows are unit length, so cosine similarity against a query is a single
+    matrix-vector product and top-k selection is an argpartition. Chunks can
+    be appended in place; removed chunks are tombstoned and the matrix is
+    compacted once too many rows are dead.
+    """
+
+    # Fraction of dead rows that triggers compaction
+    COMPACT_RATIO = 0.25
+
+    def __init__(self, chunk_ids: List[str], document_ids: List[str],
+                 vectors: np.ndarray, fingerprint: Any = None, normalized: bool = False,
+                 alive: Optional[np.ndarray] = None):
+        """
+        Initialize the index
+
+        Args:
+            chunk_ids: Chunk IDs, one per row of vectors
+            document_ids: Document IDs, one per row of vectors
+            vectors: (n, d) matrix of embeddings, normalised in place
+            fingerprint: Corpus fingerprint the index was built from
+            normalized: Whether rows are already unit length
+            alive: Mask of rows to include; other rows start out tombstoned.
+                Lets a memory-mapped matrix be used without copying a subset.
+        """
+        if normalized:
+            # Keep memory-mapped matrices mapped rather than copying them
+            if not (vectors.dtype == np.float32 and vectors.flags.c_contiguous):
+                vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        else:
+            vectors = self._normalize(vectors, copy=False)
+
+        self._lock = threading.RLock()
+        self._dimensions = vectors.shape[1] if vectors.ndim == 2 else 0
+        self._data = self._encode(vectors)
+        self._size = len(chunk_ids)
+        self._alive = np.ones(self._size, dtype=bool) if alive is None else np.array(alive, dtype=bool)
+        self._dead = int(self._size - np.count_nonzero(self._alive))
+        self.chunk_ids = list(chunk_ids)
+        self.document_ids = list(document_ids)
+        self._rows_by_document: Dict[str, List[int]] = {}
+        for row in np.flatnonzero(self._alive):
+            self._rows_by_document.setdefault(self.document_ids[row], []).append(int(row))
+        self._rows_by_chunk: Optional[Dict[str, int]] = None
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray, copy: bool = True) -> np.ndarray:
+        """
+        Return C-contiguous float32 vectors scaled to unit length along the last axis
+        """
+        if copy:
+            vectors = np.array(vectors, dtype=np.float32, order='C')
+        else:
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.size == 0:
+            return vectors
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors /= norms
+        return vectors
+
+    @classmethod
+    def from_queryset(cls, chunks, fingerprint: Any = None) -> 'VectorIndex':
+        """
+        Build an index from a DocumentChunk queryset
+
+        Args:
+            chunks: DocumentChunk queryset to load embeddings from
+            fingerprint: Corpus fingerprint to attach to the index
+
+        Returns:
+            Populated VectorIndex
+        """
+        chunk_ids = []
+        document_ids = []
+        blobs = []
+        norms = []
+        dimensions = None
+        dtype = None
+
+        rows = chunks.exclude(embedding_data__isnull=True).values_list(
+            'id', 'document_id', 'embedding_data', 'embedding_dtype', 'embedding_dimensions', 'embedding_norm'
+        )
+        for chunk_id, document_id, data, row_dtype, row_dimensions, norm in rows.iterator(chunk_size=2000):
+            if dimensions is None:
+                dimensions, dtype = row_dimensions, row_dtype
+            elif row_dimensions != dimensions or row_dtype != dtype:
+                logger.warning(f"Skipping chunk {chunk_id}: stored as {row_dimensions}-d {row_dtype}, expected {dimensions}-d {dtype}")
+                continue
+            chunk_ids.append(str(chunk_id))
+            document_ids.append(str(document_id))
+            blobs.append(data)
+            norms.append(norm or 0.0)
+
+        if not blobs:
+            return cls([], [], np.empty((0, 0), dtype=np.float32), fingerprint)
+
+        # One join and one frombuffer for the whole corpus; stored norms
+        # save a pass over the matrix when normalising
+        vectors = decode_embeddings(blobs, dimensions, dtype)
+        del blobs
+        norms = np.asarray(norms, dtype=np.float32)[:, None]
+        norms[norms == 0] = 1.0
+        vectors /= norms
+
+        return cls(chunk_ids, document_ids, vectors, fingerprint, normalized=True)
+
+    def __len__(self) -> int:
+        return self._size - self._dead
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._data[:self._size]
+
+    @property
+    def dimensions(self) -> int:
+        return self._dimensions
+
+    @property
+    def is_mapped(self) -> bool:
+        """
+        Whether rows are memory-mapped from a file rather than held on the heap
+        """
+        return isinstance(self._data, np.memmap)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory held by the stored rows
+        """
+        return self._data.nbytes
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Convert unit-length vectors to the stored row format; subclasses may
+        compress them
+        """
+        return vectors
+
+    def _score(self, queries: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """
+        (m, n) similarities between unit-length queries and stored rows
+        """
+        return queries @ rows.T
+
+    def has_document(self, document_id: str) -> bool:
+        return str(document_id) in self._rows_by_document
+
+    def add(self, chunk_ids: List[str], document_ids: List[str], vectors: np.ndarray,
+            normalized: bool = False) -> np.ndarray:
+        """
+        Append chunks to the index
+
+        Args:
+            chunk_ids: Chunk IDs, one per row of vectors
+            document_ids: Document IDs, one per row of vectors
+            vectors: (n, d) matrix of embeddings
+            normalized: Whether rows are already unit length
+
+        Returns:
+            Row numbers of the added chunks
+        """
+        vectors = np.asarray(vectors, dtype=np.float32) if normalized else self._normalize(vectors)
+        count = len(chunk_ids)
+        if count == 0:
+            return np.empty(0, dtype=np.int64)
+
+        with self._lock:
+            if self._size == 0:
+                self._dimensions = vectors.shape[1]
+            if vectors.shape[1] != self.dimensions:
+                raise ValueError(f"Vectors have {vectors.shape[1]} dimensions but index has {self.dimensions}")
+            encoded = self._encode(vectors)
+            if self._size == 0 and self._data.shape[1:] != encoded.shape[1:]:
+                self._data = np.empty((0,) + encoded.shape[1:], dtype=encoded.dtype)
+
+            # Grow capacity geometrically so repeated appends stay amortised O(1)
+            needed = self._size + count
+            if needed > self._data.shape[0]:
+                capacity = max(needed, 2 * self._data.shape[0], 64)
+                grown = np.empty((capacity,) + self._data.shape[1:], dtype=self._data.dtype)
+                grown[:self._size] = self._data[:self._size]
+                self._data = grown
+
+            rows = np.arange(self._size, needed)
+            self._data[self._size:needed] = encoded
+            self._alive = np.concatenate([self._alive, np.ones(count, dtype=bool)])
+            self.chunk_ids.extend(str(chunk_id) for chunk_id in chunk_ids)
+            for row, document_id in zip(rows, document_ids):
+                document_id = str(document_id)
+                self.document_ids.append(document_id)
+                self._rows_by_document.setdefault(document_id, []).append(int(row))
+            self._size = needed
+            self._rows_by_chunk = None
+            return rows
+
+    def remove_documents(self, document_ids: Iterable[str]) -> int:
+        """
+        Tombstone every chunk of the given documents
+
+        Args:
+            document_ids: Documents whose chunks should be removed
+
+        Returns:
+            Number of chunks removed
+        """
+        with self._lock:
+            rows = []
+            for document_id in document_ids:
+                rows.extend(self._rows_by_document.pop(str(document_id), []))
+            return self._tombstone(rows)
+
+    def remove_chunks(self, chunk_ids: Iterable[str]) -> int:
+        """
+        Tombstone individual chunks, e.g. the edited part of a re-ingested document
+
+        Args:
+            chunk_ids: Chunks to remove; chunks not in the index are skipped
+
+        Returns:
+            Number of chunks removed
+        """
+        with self._lock:
+            if self._rows_by_chunk is None:
+                self._rows_by_chunk = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+            rows = {
+                self._rows_by_chunk[chunk_id] for chunk_id in map(str, chunk_ids)
+                if chunk_id in self._rows_by_chunk and self._alive[self._rows_by_chunk[chunk_id]]
+            }
+            for document_id in {self.document_ids[row] for row in rows}:
+                remaining = [row for row in self._rows_by_document[document_id] if row not in rows]
+                if remaining:
+                    self._rows_by_document[document_id] = remaining
+                else:
+                    del self._rows_by_document[document_id]
+            return self._tombstone(list(rows))
+
+    def _tombstone(self, rows: List[int]) -> int:
+        """
+        Mark rows dead, compacting once enough of the index is dead; call with the lock held
+        """
+        if not rows:
+            return 0
+
+        alive = self._alive.copy()
+        alive[rows] = False
+        self._alive = alive
+        self._dead += len(rows)
+
+        if self._dead > self.COMPACT_RATIO * self._size:
+            self._compact()
+        return len(rows)
+
+    def _compact(self) -> None:
+        """
+        Rebuild the storage without tombstoned rows
+        """
+        keep = np.flatnonzero(self._alive)
+        self._data = self._data[keep]
+        self.chunk_ids = [self.chunk_ids[row] for row in keep]
+        self.document_ids = [self.document_ids[row] for row in keep]
+        self._rows_by_document = {}
+        for row, document_id in enumerate(self.document_ids):
+            self._rows_by_document.setdefault(document_id, []).append(row)
+        self._size = len(keep)
+        self._rows_by_chunk = None
+        self._alive = np.ones(self._size, dtype=bool)
+        self._dead = 0
+        self._on_compact(keep)
+
+    def _on_compact(self, keep: np.ndarray) -> None:
+        """
+        Hook for subclasses holding per-row state; keep maps new rows to old rows
+        """
+
+    def _snapshot(self) -> Tuple[np.ndarray, Optional[np.ndarray], List[str]]:
+        """
+        Consistent view of (stored rows, alive mask or None, chunk_ids) for a search.
+        Appends and compaction never mutate rows inside an earlier snapshot.
+        """
+        with self._lock:
+            alive = self._alive if self._dead else None
+            return self._data[:self._size], alive, self.chunk_ids
+
+    def search(self, query_embedding: List[float], top_k: int = 5) -> List[Tuple[str, float]]:
+        """
+        Find the chunks most similar to a query embedding
+
+        Args:
+            query_embedding: Query embedding vector
+            top_k: Number of top results to return
+
+        Returns:
+            List of tuples (chunk_id, similarity_score) sorted by similarity
+        """
+        return self.search_batch([query_embedding], top_k)[0]
+
+    def search_batch(self, query_embeddings: List[List[float]], top_k: int = 5) -> List[List[Tuple[str, float]]]:
+        """
+        Find the chunks most similar to each of several query embeddings
+        using a single matrix-matrix product
+
+        Args:
+            query_embeddings: Query embedding vectors
+            top_k: Number of top results to return per query
+
+        Returns:
+            One list of (chunk_id, similarity_score) tuples per query, sorted by similarity
+        """
+        if len(query_embeddings) == 0:
+            return []
+        if len(self) == 0 or top_k <= 0:
+            return [[] for _ in query_embeddings]
+
+        queries = self._prepare_queries(query_embeddings)
+        vectors, alive, chunk_ids = self._snapshot()
+
+        scores = self._score(queries, vectors)
+        if alive is not None:
+            scores[:, ~alive] = -np.inf
+        top = self._top_k(scores, top_k)
+        return [self._hits(row_scores, row_top, chunk_ids) for row_scores, row_top in zip(scores, top)]
+
+    def score_chunks(self, query_embedding: List[float], chunk_ids: Iterable[str]) -> List[Tuple[str, float]]:
+        """
+        Score a query against specific chunks only, so a cheap prefilter such
+        as keyword search can restrict the scan to its candidates
+
+        Args:
+            query_embedding: Query embedding vector
+            chunk_ids: Chunks to score; chunks not in the index are skipped
+
+        Returns:
+            List of tuples (chunk_id, similarity_score) sorted by similarity
+        """
+        queries = self._prepare_queries([query_embedding])
+        with self._lock:
+            if self._rows_by_chunk is None:
+                self._rows_by_chunk = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+            rows_by_chunk = self._rows_by_chunk
+            vectors, alive, _ = self._snapshot()
+
+        found = [
+            (chunk_id, rows_by_chunk[chunk_id]) for chunk_id in dict.fromkeys(chunk_ids)
+            if chunk_id in rows_by_chunk and (alive is None or alive[rows_by_chunk[chunk_id]])
+        ]
+        if not found:
+            return []
+        scores = self._score(queries, vectors[[row for _, row in found]])[0]
+        return [(found[i][0], float(scores[i])) for i in np.argsort(-scores, kind='stable')]
+
+    def _prepare_queries(self, query_embeddings: List[List[float]]) -> np.ndarray:
+        queries = self._normalize(np.asarray(query_embeddings, dtype=np.float32))
+        if queries.ndim != 2 or queries.shape[1] != self.dimensions:
+            raise ValueError(f"Queries have shape {queries.shape} but index has {self.dimensions} dimensions")
+        return queries
+
+    @staticmethod
+    def _hits(scores: np.ndarray, rows: np.ndarray, chunk_ids: List[str]) -> List[Tuple[str, float]]:
+        return [(chunk_ids[row], float(scores[row])) for row in rows if scores[row] != -np.inf]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """
+        Indices of the top_k highest scores along the last axis, highest first
+        """
+        n = scores.shape[-1]
+        if top_k < n:
+            candidates = np.argpartition(-scores, top_k - 1, axis=-1)[..., :top_k]
+        else:
+            candidates = np.broadcast_to(np.arange(n), scores.shape[:-1] + (n,))
+        order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1, kind='stable')
+        return np.take_along_axis(candidates, order, axis=-1)
+
+
+def recall_at_k(approximate: List[List[Tuple[str, float]]], exact: List[List[Tuple[str, float]]]) -> float:
+    """
+    Mean fraction of each exact result list that the approximate list also returns
+
+    Args:
+        approximate: Per-query hits from the approximate search
+        exact: Per-query hits from exact search over the same chunks
+
+    Returns:
+        Mean recall across queries with at least one exact hit
+    """
+    recalls = []
+    for approx_hits, exact_hits in zip(approximate, exact):
+        if not exact_hits:
+            continue
+        expected = {chunk_id for chunk_id, _ in exact_hits}
+        recalls.append(len(expected & {chunk_id for chunk_id, _ in approx_hits}) / len(expected))
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+# Document.status of documents whose chunks are complete and searchable
+INDEXED = 'indexed'
+
+
+class RetrievalScope(NamedTuple):
+    """
+    Set of documents a retrieval is restricted to; None means unrestricted.
+    Documents still being ingested are never in scope.
+
+    embedding_space is a (provider, model, dimensions) tuple: documents
+    embedded in another space cannot be compared with the query and are
+    left out.
+    """
+    template_id: Optional[str] = None
+    session_id: Optional[str] = None
+    document_ids: Optional[Tuple[str, ...]] = None
+    embedding_space: Optional[Tuple[str, str, int]] = None
+
+    @classmethod
+    def build(cls, template_id: Optional[str] = None, session_id: Optional[str] = None,
+              document_ids: Optional[Iterable[str]] = None,
+              embedding_space: Optional[Tuple[str, str, int]] = None) -> 'RetrievalScope':
+        return cls(
+            template_id=str(template_id) if template_id else None,
+            session_id=session_id or None,
+            document_ids=tuple(sorted(str(d) for d in document_ids)) if document_ids is not None else None,
+            embedding_space=tuple(embedding_space) if embedding_space is not None else None,
+        )
+
+    def document_filter(self, prefix: str = '') -> Dict[str, Any]:
+        """
+        Queryset filter kwargs selecting the scope's documents
+
+        Args:
+            prefix: Lookup prefix, e.g. 'document__' when filtering chunks
+        """
+        filters = {f'{prefix}status': INDEXED}
+        if self.template_id is not None:
+            filters[f'{prefix}template_id'] = self.template_id
+        if self.session_id is not None:
+            filters[f'{prefix}session_id'] = self.session_id
+        if self.document_ids is not None:
+            filters[f'{prefix}id__in'] = self.document_ids
+        filters.update(self.space_filter(prefix))
+        return filters
+
+    def space_filter(self, prefix: str = '') -> Dict[str, Any]:
+        """
+        Queryset filter kwargs selecting documents embedded in the scope's embedding space
+        """
+        if self.embedding_space is None:
+            return {}
+        provider, model, dimensions = self.embedding_space
+        return {
+            f'{prefix}embedding_provider': provider,
+            f'{prefix}embedding_model': model,
+            f'{prefix}embedding_dimensions': dimensions,
+        }
+
+    def matches(self, document) -> bool:
+        """
+        Whether a Document falls inside the scope
+        """
+        return (
+            document.status == INDEXED
+            and (self.template_id is None or self.template_id == str(document.template_id))
+            and (self.session_id is None or self.session_id == document.session_id)
+            and (self.document_ids is None or str(document.id) in self.document_ids)
+            and all(getattr(document, field) == value for field, value in self.space_filter().items())
+        )
+
+    def __str__(self) -> str:
+        if self == ALL_DOCUMENTS:
+            return '*'
+        parts = [f"{name}={value}" for name, value in self._asdict().items() if value is not None]
+        return ', '.join(parts)
+
+
+ALL_DOCUMENTS = RetrievalScope()
@@ -0,0 +1,502 @@
+"""
+Memory-mapped on-disk shards of chunk embeddings, one per template
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Iterable, NamedTuple, Any, Tuple
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .vector_index import VectorIndex, RetrievalScope
+from ..models import Document, DocumentChunk
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class ShardContents(NamedTuple):
+    chunk_ids: List[str]
+    document_ids: List[str]
+    vectors: np.ndarray  # (rows, dimensions) read-only memmap of unit-length float32
+    alive: np.ndarray  # False for rows replaced or deleted since they were appended
+    versions: Dict[str, str]  # Document ID -> version of its live rows
+
+
+class EmbeddingShard:
+    """
+    Append-only store of unit-length chunk embeddings in one directory.
+
+    Each generation has two files: vectors-<generation>.f32, raw little-endian
+    float32 rows (an .npy body without a header, so appending never rewrites
+    it), and journal-<generation>.log, the sidecar ID map. Every journal line
+    is either
+
+        D <document id> <version> <comma-separated chunk ids>
+            the document's rows are now the next len(chunk ids) rows
+        X <document id>
+            the document was deleted
+
+    so earlier rows of a rewritten or deleted document become dead. Once too
+    many rows are dead the live rows are copied into a new generation, and
+    manifest.json is atomically replaced to point at it; readers that mapped
+    the old generation keep their (unlinked) files until they let go.
+
+    The manifest also counts the generation's rows, in total, dead and per
+    live document, and writers update the counts with every journal line,
+    so deciding whether to compact never re-reads the journal.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    # Fraction of dead rows that triggers compaction
+    COMPACT_RATIO = 0.25
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, kind: str, generation: int) -> str:
+        extension = 'f32' if kind == 'vectors' else 'log'
+        return os.path.join(self.directory, f"{kind}-{generation:06d}.{extension}")
+
+    def _manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _swap_manifest(self, manifest: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> None:
+        path = os.path.join(self.directory, self.MANIFEST)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+        if previous is not None and previous['generation'] != manifest['generation']:
+            for kind in ('vectors', 'journal'):
+                try:
+                    os.remove(self._path(kind, previous['generation']))
+                except FileNotFoundError:
+                    pass
+
+    @contextmanager
+    def _locked(self):
+        """
+        Serialise writers across processes
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def exists(self) -> bool:
+        return self._manifest() is not None
+
+    def read(self) -> Optional[ShardContents]:
+        """
+        Map the current generation
+
+        Returns:
+            ShardContents, or None if the shard has never been written
+        """
+        for _ in range(3):
+            manifest = self._manifest()
+            if manifest is None:
+                return None
+            try:
+                return self._read_generation(manifest)
+            except FileNotFoundError:
+                # Compacted between reading the manifest and opening its files
+                continue
+        return None
+
+    def _read_generation(self, manifest: Dict[str, Any]) -> ShardContents:
+        generation, dimensions = manifest['generation'], manifest['dimensions']
+        chunk_ids: List[str] = []
+        document_ids: List[str] = []
+        rows_by_document: Dict[str, range] = {}
+        versions: Dict[str, str] = {}
+        dead: List[int] = []
+
+        with open(self._path('journal', generation)) as f:
+            for line in f:
+                # A line without its newline is still being written
+                if not line.endswith('\n'):
+                    break
+                kind, document_id, *rest = line.rstrip('\n').split('\t')
+                dead.extend(rows_by_document.pop(document_id, ()))
+                versions.pop(document_id, None)
+                if kind == 'D':
+                    version, ids = rest
+                    ids = ids.split(',') if ids else []
+                    rows_by_document[document_id] = range(len(chunk_ids), len(chunk_ids) + len(ids))
+                    versions[document_id] = version
+                    chunk_ids.extend(ids)
+                    document_ids.extend([document_id] * len(ids))
+
+        rows = len(chunk_ids)
+        if rows and dimensions:
+            vectors = np.memmap(self._path('vectors', generation), dtype='<f4', mode='r', shape=(rows, dimensions))
+        else:
+            vectors = np.empty((0, dimensions), dtype=np.float32)
+        alive = np.ones(rows, dtype=bool)
+        alive[dead] = False
+        return ShardContents(chunk_ids, document_ids, vectors, alive, versions)
+
+    def _start_generation(self, dimensions: int, previous: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        generation = previous['generation'] + 1 if previous else 1
+        open(self._path('vectors', generation), 'wb').close()
+        open(self._path('journal', generation), 'w').close()
+        manifest = {'generation': generation, 'dimensions': dimensions, 'rows': 0, 'dead': 0, 'documents': {}}
+        self._swap_manifest(manifest, previous)
+        return manifest
+
+    def _counted(self, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        The manifest with row counts, taken from the journal if it was
+        written before the manifest kept them
+        """
+        if 'documents' in manifest:
+            return manifest
+        contents = self._read_generation(manifest)
+        documents: Dict[str, int] = dict.fromkeys(contents.versions, 0)
+        for row in np.flatnonzero(contents.alive):
+            documents[contents.document_ids[row]] += 1
+        rows = len(contents.alive)
+        return dict(manifest, rows=rows, dead=rows - sum(documents.values()), documents=documents)
+
+    @staticmethod
+    def _count(manifest: Dict[str, Any], document_id: str, rows: Optional[int]) -> None:
+        """
+        Count a journal line: the document's previous rows die, and rows
+        (None for a deletion) are appended
+        """
+        manifest['dead'] += manifest['documents'].pop(document_id, 0)
+        if rows is not None:
+            manifest['rows'] += rows
+            manifest['documents'][document_id] = rows
+
+    @staticmethod
+    def _append(vectors_file, journal_file, document_id: str,
+                version: str, chunk_ids: List[str], vectors: np.ndarray) -> None:
+        # Vectors go first so a reader never sees journal rows without their data
+        vectors_file.write(np.ascontiguousarray(vectors, dtype='<f4').tobytes())
+        vectors_file.flush()
+        journal_file.write(f"D\t{document_id}\t{version}\t{','.join(chunk_ids)}\n")
+        journal_file.flush()
+
+    def write_document(self, document_id: str, version: str, chunk_ids: List[str], vectors: np.ndarray) -> None:
+        """
+        Append a document's rows, replacing any it already has
+
+        Args:
+            document_id: Document the rows belong to
+            version: Version of the document the rows were computed from
+            chunk_ids: Chunk IDs, one per row of vectors
+            vectors: (n, d) matrix of unit-length embeddings
+        """
+        self.write_documents([(document_id, version, chunk_ids, vectors)])
+
+    def write_documents(self, documents: Iterable[tuple]) -> None:
+        """
+        Append several documents' rows under one lock
+
+        Args:
+            documents: (document_id, version, chunk_ids, vectors) tuples
+        """
+        with self._locked():
+            manifest = self._manifest()
+            documents = list(documents)
+            dimensions = next((vectors.shape[1] for _, _, ids, vectors in documents if len(ids)), None)
+            if manifest is None or (dimensions and manifest['dimensions'] and dimensions != manifest['dimensions']):
+                # First write, or the embedding model changed: existing rows are unusable
+                manifest = self._start_generation(dimensions or 0, manifest)
+            else:
+                manifest = self._counted(manifest)
+                if dimensions and not manifest['dimensions']:
+                    manifest['dimensions'] = dimensions
+
+            with open(self._path('vectors', manifest['generation']), 'ab') as vectors_file, \
+                    open(self._path('journal', manifest['generation']), 'a') as journal_file:
+                for document_id, version, chunk_ids, vectors in documents:
+                    self._append(vectors_file, journal_file, str(document_id), version,
+                                 [str(chunk_id) for chunk_id in chunk_ids], vectors)
+                    self._count(manifest, str(document_id), len(chunk_ids))
+            self._swap_manifest(manifest, None)
+            self._compact_if_needed(manifest)
+
+    def remove_document(self, document_id: str) -> None:
+        """
+        Mark a document's rows dead
+        """
+        self.remove_documents([document_id])
+
+    def remove_documents(self, document_ids: Iterable[str]) -> None:
+        """
+        Mark several documents' rows dead under one lock, checking once
+        whether the shard needs compacting
+        """
+        if not self.exists():
+            return
+        with self._locked():
+            manifest = self._counted(self._manifest())
+            with open(self._path('journal', manifest['generation']), 'a') as journal_file:
+                for document_id in document_ids:
+                    journal_file.write(f"X\t{document_id}\n")
+                    self._count(manifest, str(document_id), None)
+            self._swap_manifest(manifest, None)
+            self._compact_if_needed(manifest)
+
+    def _compact_if_needed(self, manifest: Dict[str, Any]) -> None:
+        if manifest['dead'] > self.COMPACT_RATIO * manifest['rows']:
+            self._compact(manifest, self._read_generation(manifest))
+
+    def _compact(self, manifest: Dict[str, Any], contents: ShardContents) -> None:
+        """
+        Copy live rows into a new generation and swap it in. Must hold the lock.
+        """
+        rows_by_document: Dict[str, List[int]] = {}
+        for row in np.flatnonzero(contents.alive):
+            rows_by_document.setdefault(contents.document_ids[row], []).append(int(row))
+
+        generation = manifest['generation'] + 1
+        compacted = {'generation': generation, 'dimensions': manifest['dimensions'], 'rows': 0, 'dead': 0, 'documents': {}}
+        with open(self._path('vectors', generation), 'wb') as vectors_file, \
+                open(self._path('journal', generation), 'w') as journal_file:
+            for document_id, version in contents.versions.items():
+                rows = rows_by_document.get(document_id, [])
+                self._append(vectors_file, journal_file, document_id, version,
+                             [contents.chunk_ids[row] for row in rows], contents.vectors[rows])
+                self._count(compacted, document_id, len(rows))
+        self._swap_manifest(compacted, manifest)
+        logger.info(f"Compacted vector shard {self.directory}: kept {int(np.count_nonzero(contents.alive))} of {len(contents.alive)} rows")
+
+    def rebuild(self, documents: Iterable[tuple], dimensions: int) -> None:
+        """
+        Write a fresh generation from scratch and atomically swap it in
+
+        Args:
+            documents: (document_id, version, chunk_ids, vectors) tuples
+            dimensions: Embedding dimensions
+        """
+        with self._locked():
+            previous = self._manifest()
+            generation = previous['generation'] + 1 if previous else 1
+            manifest = {'generation': generation, 'dimensions': dimensions, 'rows': 0, 'dead': 0, 'documents': {}}
+            with open(self._path('vectors', generation), 'wb') as vectors_file, \
+                    open(self._path('journal', generation), 'w') as journal_file:
+                for document_id, version, chunk_ids, vectors in documents:
+                    self._append(vectors_file, journal_file, str(document_id), version,
+                                 [str(chunk_id) for chunk_id in chunk_ids], vectors)
+                    self._count(manifest, str(document_id), len(chunk_ids))
+            self._swap_manifest(manifest, previous)
+
+
+class VectorShardStore:
+    """
+    Per-template embedding shards under RAG_VECTOR_SHARD_DIR.
+
+    Shards are a cache of the database: documents whose version (updated_at)
+    differs from the shard's are re-read from the database and appended when
+    an index is built, so the shards heal themselves after missed writes. Once
+    in sync, building an index maps the shard instead of decoding embeddings,
+    and the OS page cache shares the vectors between worker processes.
+    """
+
+    # Documents read from the database per batch when syncing a shard
+    SYNC_BATCH_SIZE = 200
+
+    def __init__(self, root: Optional[str] = None):
+        self._root = root
+        self._batches = threading.local()
+
+    @property
+    def root(self) -> str:
+        return self._root or settings.RAG_VECTOR_SHARD_DIR
+
+    def shard(self, template_id: Optional[Any]) -> EmbeddingShard:
+        return EmbeddingShard(os.path.join(self.root, str(template_id) if template_id else 'unassigned'))
+
+    @staticmethod
+    def version(updated_at) -> str:
+        return updated_at.isoformat() if updated_at else ''
+
+    def write_document(self, document: Document, chunk_ids: List[str], embeddings: List[List[float]]) -> None:
+        """
+        Replace a document's rows in its template's shard
+
+        Args:
+            document: Document whose chunks were rewritten (updated_at already bumped)
+            chunk_ids: IDs of the document's new chunks
+            embeddings: Embeddings of the new chunks
+        """
+        vectors = VectorIndex._normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(chunk_ids), -1))
+        self.shard(document.template_id).write_document(
+            str(document.id), self.version(document.updated_at), chunk_ids, vectors
+        )
+
+    def remove_document(self, document: Document) -> None:
+        self.shard(document.template_id).remove_document(str(document.id))
+
+    def remove_documents(self, documents: Iterable[Tuple[Optional[Any], str]]) -> None:
+        """
+        Mark documents' rows dead, one pass per template shard
+
+        Args:
+            documents: (template_id, document_id) pairs
+        """
+        by_template: Dict[Optional[Any], List[str]] = {}
+        for template_id, document_id in documents:
+            by_template.setdefault(template_id, []).append(str(document_id))
+        for template_id, document_ids in by_template.items():
+            try:
+                self.shard(template_id).remove_documents(document_ids)
+            except OSError as e:
+                # Deleted documents are already left out of every index built from the shard
+                logger.warning(f"Could not remove {len(document_ids)} documents from vector shard {template_id}: {str(e)}")
+
+    def remove_document_on_commit(self, document: Document) -> None:
+        """
+        Mark a deleted document's rows dead once its deletion commits
+
+        Inside batched_removals() the document joins that block's batch
+        instead of getting a pass of its own.
+        """
+        # Read now: Django clears the primary key of a deleted instance
+        removal = (document.template_id, str(document.id))
+        batch = getattr(self._batches, 'documents', None)
+        if batch is not None:
+            batch.append(removal)
+        else:
+            transaction.on_commit(lambda: self.remove_documents([removal]))
+
+    @contextmanager
+    def batched_removals(self):
+        """
+        Collect the shard removals of documents deleted inside the block and
+        apply them in one pass when the transaction commits. Use it inside
+        the transaction that deletes the documents.
+        """
+        self._batches.documents = []
+        try:
+            yield
+            batch = self._batches.documents
+        finally:
+            self._batches.documents = None
+        if batch:
+            transaction.on_commit(lambda: self.remove_documents(batch))
+
+    def _load_from_database(self, document_versions: Dict[str, str]) -> List[tuple]:
+        """
+        Read documents' embeddings from the database as shard rows
+        """
+        document_ids = list(document_versions)
+        documents = []
+        for start in range(0, len(document_ids), self.SYNC_BATCH_SIZE):
+            batch = document_ids[start:start + self.SYNC_BATCH_SIZE]
+            index = VectorIndex.from_queryset(DocumentChunk.objects.filter(document_id__in=batch).order_by('document_id', 'chunk_index'))
+            rows_by_document: Dict[str, List[int]] = {}
+            for row, document_id in enumerate(index.document_ids):
+                rows_by_document.setdefault(document_id, []).append(row)
+            for document_id in batch:
+                rows = rows_by_document.get(document_id, [])
+                vectors = index.vectors[rows] if rows else np.empty((0, index.dimensions), dtype=np.float32)
+                documents.append((document_id, document_versions[document_id], [index.chunk_ids[row] for row in rows], vectors))
+        return documents
+
+    def _synced(self, template_id: Optional[str], wanted: Dict[str, str]) -> Optional[ShardContents]:
+        shard = self.shard(template_id)
+        contents = shard.read()
+        stale = {
+            document_id: version for document_id, version in wanted.items()
+            if contents is None or contents.versions.get(document_id) != version
+        }
+        if stale:
+            logger.info(f"🔍 RAG DEBUG: Syncing {len(stale)} documents into vector shard {shard.directory}")
+            shard.write_documents(self._load_from_database(stale))
+            contents = shard.read()
+        return contents
+
+    def load_index(self, scope: RetrievalScope, fingerprint: Any = None) -> VectorIndex:
+        """
+        Build an index for a scope from the shards of its templates
+
+        A scope covering most of a single template's shard maps it directly;
+        other scopes copy their rows out of the mapped shards.
+
+        Args:
+            scope: Documents to include
+            fingerprint: Corpus fingerprint to attach to the index
+
+        Returns:
+            VectorIndex over the scope's chunks
+        """
+        by_template: Dict[Optional[str], Dict[str, str]] = {}
+        for document_id, template_id, updated_at in Document.objects.filter(
+            **scope.document_filter()
+        ).values_list('id', 'template_id', 'updated_at').iterator(chunk_size=2000):
+            key = str(template_id) if template_id else None
+            by_template.setdefault(key, {})[str(document_id)] = self.version(updated_at)
+
+        parts = []
+        for template_id, wanted in by_template.items():
+            contents = self._synced(template_id, wanted)
+            if contents is None or not contents.chunk_ids:
+                continue
+            in_scope = contents.alive & np.fromiter(
+                (document_id in wanted for document_id in contents.document_ids),
+                dtype=bool, count=len(contents.document_ids)
+            )
+            parts.append((contents, in_scope))
+
+        if len(parts) == 1:
+            contents, in_scope = parts[0]
+            if np.count_nonzero(in_scope) >= (1 - VectorIndex.COMPACT_RATIO) * len(in_scope):
+                return VectorIndex(contents.chunk_ids, contents.document_ids, contents.vectors,
+                                   fingerprint, normalized=True, alive=in_scope)
+
+        chunk_ids: List[str] = []
+        document_ids: List[str] = []
+        matrices = []
+        for contents, in_scope in parts:
+            rows = np.flatnonzero(in_scope)
+            chunk_ids.extend(contents.chunk_ids[row] for row in rows)
+            document_ids.extend(contents.document_ids[row] for row in rows)
+            matrices.append(np.asarray(contents.vectors[rows]))
+        if not chunk_ids:
+            return VectorIndex([], [], np.empty((0, 0), dtype=np.float32), fingerprint)
+        return VectorIndex(chunk_ids, document_ids, np.concatenate(matrices), fingerprint, normalized=True)
+
+    def rebuild(self, template_id: Optional[str]) -> int:
+        """
+        Rewrite a template's shard from the database and swap it in atomically
+
+        Args:
+            template_id: Template whose shard to rebuild (None for documents without one)
+
+        Returns:
+            Number of rows written
+        """
+        documents = Document.objects.filter(template_id=template_id) if template_id else Document.objects.filter(template__isnull=True)
+        versions = {str(document_id): self.version(updated_at) for document_id, updated_at in documents.values_list('id', 'updated_at')}
+        rows = self._load_from_database(versions)
+        dimensions = next((vectors.shape[1] for _, _, ids, vectors in rows if len(ids)), 0)
+        self.shard(template_id).rebuild(rows, dimensions)
+        return sum(len(ids) for _, _, ids, _ in rows)
+
+
+vector_shard_store = VectorShardStore()
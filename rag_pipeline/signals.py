@@ -0,0 +1,32 @@
+"""
+Signal handlers keeping derived RAG state in sync with the database
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Document
+from .services.index_registry import vector_index_registry
+from .services.lexical_index import lexical_index
+from .services.upload_storage import delete_if_unreferenced
+
+
+@receiver(post_delete, sender=Document)
+def remove_deleted_document_from_indexes(sender, instance, **kwargs):
+    """
+    Tombstone a deleted document's chunks in cached vector indexes and drop
+    them from the keyword index
+    """
+    vector_index_registry.remove_document(instance)
+    lexical_index.remove_document(instance)
+
+
+@receiver(post_delete, sender=Document)
+def delete_unreferenced_upload(sender, instance, **kwargs):
+    """
+    Delete a deleted document's stored file once the deletion is committed,
+    unless another document shares it
+    """
+    if instance.file_path:
+        path = instance.file_path
+        transaction.on_commit(lambda: delete_if_unreferenced(path))
@@ -1,3 +1,1425 @@
-from django.test import TestCase
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+import httpx
+import numpy as np
+
+from .models import Document, DocumentChunk, EmbeddingCacheEntry, IngestionJob
+from .services.embedding_cache import EmbeddingCache, QueryEmbeddingCache, content_hash
+from .services.embedding_service import EmbeddingService, plan_batches
+from .services.embedding_codec import encode_embedding, decode_embedding
+from .services.rag_pipeline import RAGPipeline
+from .services.vector_index import VectorIndex, RetrievalScope, recall_at_k
+from .services.index_registry import VectorIndexRegistry
+from .services.ann_index import IVFIndex
+from .services.quantization import QuantizedIndex
+from .services.vector_shards import EmbeddingShard
+from .services.lexical_index import LexicalIndex, lexical_index
+from .services.embedding_providers import EmbeddingProvider, LocalEmbeddingProvider
+from .services.ingestion_jobs import IngestionWorker, enqueue_document
+from .services.document_processor import DocumentProcessor, ExtractedPage, page_ranges
+from .services.text_chunker import TextChunker
+from .services import openai_client
+from template_engine.models import Template
+
+# Query embeddings are cached in memory rather than under BASE_DIR/cache
+_test_caches = override_settings(CACHES={
+    **settings.CACHES,
+    'embeddings': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-embeddings'},
+})
+
+
+def setUpModule():
+    _test_caches.enable()
+
+
+def tearDownModule():
+    _test_caches.disable()
+
+
+def _create_document_with_chunks(name, embeddings, **kwargs):
+    kwargs.setdefault('embedding_provider', 'openai')
+    kwargs.setdefault('embedding_model', 'text-embedding-3-small')
+    kwargs.setdefault('status', 'indexed')
+    kwargs.setdefault('embedding_dimensions', len(embeddings[0]) if embeddings else None)
+    document = Document.objects.create(name=name, content=name, file_type='text', **kwargs)
+    chunks = []
+    for i, embedding in enumerate(embeddings):
+        chunk = DocumentChunk(document=document, content=f"{name} chunk {i}", chunk_index=i)
+        chunk.set_embedding(embedding, model=document.embedding_model)
+        chunks.append(chunk)
+    DocumentChunk.objects.bulk_create(chunks)
+    lexical_index.index_chunks(document, chunks)
+    return document
+
+
+class EmbeddingCodecTests(TestCase):
+    def test_float32_round_trip(self):
+        """Test that float32 blobs decode to the original vector with its norm"""
+        data, norm = encode_embedding([3.0, 4.0])
+        self.assertEqual(len(data), 8)
+        self.assertEqual(norm, 5.0)
+        np.testing.assert_array_equal(decode_embedding(data), [3.0, 4.0])
+
+    def test_float16_halves_storage(self):
+        """Test that float16 storage uses two bytes per dimension"""
+        data, _ = encode_embedding([0.5] * 1536, dtype='float16')
+        self.assertEqual(len(data), 1536 * 2)
+        np.testing.assert_allclose(decode_embedding(data, 'float16'), 0.5)
+
+    def test_chunk_embedding_is_stored_with_model_and_dimensions(self):
+        """Test that set_embedding records model, dimension and norm alongside the blob"""
+        document = _create_document_with_chunks('doc', [[0.6, 0.8]])
+        chunk = DocumentChunk.objects.get(document=document)
+        self.assertEqual(chunk.embedding_model, 'text-embedding-3-small')
+        self.assertEqual(chunk.embedding_dimensions, 2)
+        self.assertAlmostEqual(chunk.embedding_norm, 1.0, places=6)
+        np.testing.assert_allclose(chunk.embedding, [0.6, 0.8], rtol=1e-6)
+
+
+class EmbeddingCacheTests(TestCase):
+    def test_embed_chunks_only_sends_misses(self):
+        """Test that identical chunk text is embedded once and then served from the cache"""
+        service = EmbeddingService(api_key='test')
+        fake_batch = mock.Mock(side_effect=lambda texts, progress=None: [[float(len(t)), 1.0] for t in texts])
+
+        with mock.patch.object(service, 'generate_embeddings_batch', fake_batch):
+            service.embed_chunks([{'content': 'alpha'}, {'content': 'beta'}, {'content': 'alpha'}])
+            fake_batch.assert_called_once_with(['alpha', 'beta'], progress=None)
+
+            chunks = service.embed_chunks([{'content': ' alpha\n'}, {'content': 'gamma'}])
+            fake_batch.assert_called_with(['gamma'], progress=None)
+
+        np.testing.assert_allclose(chunks[0]['embedding'], [5.0, 1.0])
+        self.assertEqual(chunks[0]['content_hash'], content_hash('alpha'))
+        self.assertEqual(EmbeddingCacheEntry.objects.count(), 3)
+
+    def test_store_evicts_least_recently_used(self):
+        """Test that the cache stays within its size bound"""
+        cache = EmbeddingCache('test-model', max_entries=2)
+        cache.set_many({'a': [1.0], 'b': [2.0]})
+        cache.get_many(['a'])
+        cache.set_many({'c': [3.0]})
+
+        remaining = set(EmbeddingCacheEntry.objects.values_list('content_hash', flat=True))
+        self.assertEqual(remaining, {'a', 'c'})
+
+
+class QueryEmbeddingCacheTests(TestCase):
+    def setUp(self):
+        self.cache = QueryEmbeddingCache(max_entries=2, ttl=60, alias='default')
+        self.cache.shared.clear()
+
+    def test_shared_tier_refills_local_lru(self):
+        """Test that a query embedding evicted from the LRU is served from the shared tier"""
+        key = self.cache.key('test-model', None, 'what is the budget?')
+        self.cache.set(key, [1.0, 2.0])
+        self.cache.clear()
+
+        np.testing.assert_allclose(self.cache.get(key), [1.0, 2.0])
+        np.testing.assert_allclose(self.cache.get(key), [1.0, 2.0])
+        stats = self.cache.stats()
+        self.assertEqual((stats['l2_hits'], stats['l1_hits'], stats['misses']), (1, 1, 0))
+
+    def test_lru_is_bounded(self):
+        """Test that the in-process level evicts the least recently used entry"""
+        for text in ('a', 'b', 'c'):
+            self.cache.set(self.cache.key('test-model', None, text), [1.0])
+        stats = self.cache.stats()
+        self.assertEqual((stats['l1_size'], stats['l1_evictions']), (2, 1))
+
+    def test_embed_queries_only_sends_misses(self):
+        """Test that repeated prompts are not re-embedded"""
+        service = EmbeddingService(api_key='test')
+        service.query_cache = self.cache
+        fake_batch = mock.Mock(side_effect=lambda texts: [[float(len(t))] for t in texts])
+
+        with mock.patch.object(service, 'generate_embeddings_batch', fake_batch):
+            service.embed_queries(['intro', 'summary'])
+            embeddings = service.embed_queries(['summary', 'pricing', 'summary'])
+
+        fake_batch.assert_called_with(['pricing'])
+        self.assertEqual([list(e) for e in embeddings], [[7.0], [7.0], [7.0]])
+
+
+class VectorIndexTests(TestCase):
+    def test_search_matches_brute_force_cosine(self):
+        """Test that top-k from the index matches a brute-force cosine ranking"""
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(200, 16)).astype(np.float32)
+        query = rng.normal(size=16)
+        index = VectorIndex([str(i) for i in range(200)], ['doc'] * 200, vectors.copy())
+
+        expected = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query))
+        expected_ids = [str(i) for i in np.argsort(-expected)[:5]]
+
+        results = index.search(query.tolist(), top_k=5)
+        self.assertEqual([chunk_id for chunk_id, _ in results], expected_ids)
+        self.assertAlmostEqual(results[0][1], float(expected.max()), places=5)
+
+    def test_search_with_top_k_larger_than_index(self):
+        """Test that asking for more results than rows returns every row in order"""
+        index = VectorIndex(['a', 'b'], ['doc', 'doc'], np.array([[1.0, 0.0], [0.0, 1.0]]))
+        results = index.search([0.0, 1.0], top_k=10)
+        self.assertEqual([chunk_id for chunk_id, _ in results], ['b', 'a'])
+
+    def test_search_batch_matches_single_searches(self):
+        """Test that a batched search returns the same hits as one search per query"""
+        rng = np.random.default_rng(1)
+        index = VectorIndex([str(i) for i in range(50)], ['doc'] * 50, rng.normal(size=(50, 8)))
+        queries = rng.normal(size=(4, 8)).tolist()
+
+        batched = index.search_batch(queries, top_k=3)
+        for query, hits in zip(queries, batched):
+            expected = index.search(query, top_k=3)
+            self.assertEqual([c for c, _ in hits], [c for c, _ in expected])
+            np.testing.assert_allclose([s for _, s in hits], [s for _, s in expected], rtol=1e-5)
+
+    def test_add_and_remove_documents_in_place(self):
+        """Test that appended chunks are searchable and removed documents are not"""
+        index = VectorIndex(['a'], ['doc1'], np.array([[1.0, 0.0]]))
+        index.add(['b', 'c'], ['doc2', 'doc2'], np.array([[0.0, 1.0], [0.6, 0.8]]))
+        self.assertEqual(index.search([0.0, 1.0], top_k=1)[0][0], 'b')
+
+        index.remove_documents(['doc2'])
+        self.assertEqual(len(index), 1)
+        self.assertEqual([chunk_id for chunk_id, _ in index.search([0.0, 1.0], top_k=3)], ['a'])
+
+
+class IVFIndexTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        centers = rng.normal(size=(20, 16))
+        vectors = centers[rng.integers(0, 20, size=2000)] + 0.1 * rng.normal(size=(2000, 16))
+        self.exact = VectorIndex([f"c{i}" for i in range(2000)], [f"d{i % 50}" for i in range(2000)], vectors)
+        self.queries = (centers[:10] + 0.1 * rng.normal(size=(10, 16))).tolist()
+
+    def test_probing_more_lists_increases_recall(self):
+        """Test that n_probe trades latency for recall and probing every list is exact"""
+        ivf = IVFIndex.train(self.exact, n_lists=40, n_probe=1)
+        low = ivf.measure_recall(self.queries, top_k=10, n_probe=1)
+        high = ivf.measure_recall(self.queries, top_k=10, n_probe=10)
+        self.assertGreaterEqual(high, low)
+        self.assertGreater(high, 0.9)
+        self.assertEqual(ivf.measure_recall(self.queries, top_k=10, n_probe=40), 1.0)
+
+    def test_save_and_load_reuses_lists_and_assigns_new_rows(self):
+        """Test that persisted lists are reused and rows added since are assigned"""
+        ivf = IVFIndex.train(self.exact, n_lists=40, n_probe=5)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ivf.npz')
+            ivf.save(path)
+            self.exact.add(['new'], ['d-new'], [self.queries[0]])
+            loaded = IVFIndex.load(self.exact, path, n_probe=5)
+
+        np.testing.assert_array_equal(loaded.centroids, ivf.centroids)
+        self.assertEqual(len(loaded), 2001)
+        self.assertEqual(loaded.search(self.queries[0], top_k=1)[0][0], 'new')
+
+    def test_tombstoned_rows_are_not_returned(self):
+        """Test that removed documents disappear from approximate results"""
+        ivf = IVFIndex.train(self.exact, n_lists=40, n_probe=40)
+        top_document = ivf.document_ids[ivf.chunk_ids.index(ivf.search(self.queries[0], top_k=1)[0][0])]
+        ivf.remove_documents([top_document])
+        for chunk_id, _ in ivf.search(self.queries[0], top_k=20):
+            self.assertNotEqual(ivf.document_ids[ivf.chunk_ids.index(chunk_id)], top_document)
+
+    def test_search_scores_only_the_probed_lists(self):
+        """Test that inverted lists hold each row once and stay in step with added rows"""
+        ivf = IVFIndex.train(self.exact, n_lists=40, n_probe=2)
+        ivf.add(['new'], ['d-new'], [self.queries[0]])
+        with ivf._lock:
+            offsets, rows = ivf._inverted_lists()
+        self.assertEqual(sorted(rows.tolist()), list(range(len(ivf))))
+        for list_number in range(40):
+            members = rows[offsets[list_number]:offsets[list_number + 1]]
+            self.assertTrue(np.all(ivf._assignments[members] == list_number))
+
+        probed = np.argsort(-(ivf.centroids @ ivf._prepare_queries([self.queries[0]])[0]))[:2]
+        with mock.patch('numpy.isin', side_effect=AssertionError('scanned every row')):
+            hits = ivf.search(self.queries[0], top_k=5)
+        self.assertEqual(hits[0][0], 'new')
+        self.assertTrue(all(ivf._assignments[ivf.chunk_ids.index(chunk_id)] in probed for chunk_id, _ in hits))
+
+
+class QuantizedIndexTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        centers = rng.normal(size=(20, 16))
+        vectors = centers[rng.integers(0, 20, size=1000)] + 0.2 * rng.normal(size=(1000, 16))
+        self.exact = VectorIndex([f"c{i}" for i in range(1000)], [f"d{i % 50}" for i in range(1000)], vectors)
+        self.queries = (centers[:10] + 0.2 * rng.normal(size=(10, 16))).tolist()
+        rows = {chunk_id: row for row, chunk_id in enumerate(self.exact.chunk_ids)}
+        self.loader = lambda chunk_ids: (chunk_ids, self.exact.vectors[[rows[c] for c in chunk_ids]])
+
+    def test_int8_is_four_times_smaller_with_exact_rescored_similarities(self):
+        """Test that int8 codes shrink memory 4x and reranked scores are exact"""
+        quantized = QuantizedIndex.train(self.exact, 'int8', vector_loader=self.loader)
+        self.assertEqual(quantized.nbytes * 4, self.exact.nbytes)
+
+        expected = self.exact.search_batch(self.queries, top_k=5)
+        for hits, exact_hits in zip(quantized.search_batch(self.queries, top_k=5), expected):
+            self.assertEqual([chunk_id for chunk_id, _ in hits], [chunk_id for chunk_id, _ in exact_hits])
+            np.testing.assert_allclose([score for _, score in hits], [score for _, score in exact_hits], rtol=1e-5)
+
+    def test_pq_compresses_and_keeps_recall(self):
+        """Test that product quantization is 16x smaller and reranking recovers recall"""
+        quantized = QuantizedIndex.train(self.exact, 'pq', vector_loader=self.loader, rerank_factor=8)
+        self.assertEqual(quantized.nbytes * 16, self.exact.nbytes)
+
+        expected = self.exact.search_batch(self.queries, top_k=5)
+        self.assertGreater(recall_at_k(quantized.search_batch(self.queries, top_k=5), expected), 0.8)
+
+    def test_pq_scores_are_inner_products_with_decoded_rows(self):
+        """Test that table lookups score codes like the vectors they decode to"""
+        quantized = QuantizedIndex.train(self.exact, 'pq', sample_size=300)
+        quantizer, codes = quantized.quantizer, quantized.vectors
+        queries = np.asarray(self.queries, dtype=np.float32)
+        np.testing.assert_allclose(quantizer.score(queries, codes), queries @ quantizer.decode(codes).T, rtol=1e-4, atol=1e-5)
+
+    def test_added_rows_are_encoded(self):
+        """Test that chunks added in place are searchable through their codes"""
+        quantized = QuantizedIndex.train(self.exact, 'int8')
+        quantized.add(['new'], ['d-new'], [[10.0] + [0.0] * 15])
+        self.assertEqual(quantized.search([1.0] + [0.0] * 15, top_k=1)[0][0], 'new')
+
+
+class HitFusionTests(TestCase):
+    def test_max_fusion_dedupes_and_keeps_best_score(self):
+        """Test that max fusion keeps each chunk once at its best rank, ties broken by similarity"""
+        fused = RAGPipeline._fuse_hits([[('a', 0.9), ('b', 0.5)], [('b', 0.95), ('c', 0.1)]], fusion='max')
+        self.assertEqual([(chunk_id, similarity) for chunk_id, similarity, _ in fused], [('b', 0.95), ('a', 0.9), ('c', 0.1)])
+
+    def test_rrf_fusion_rewards_chunks_found_by_several_queries(self):
+        """Test that reciprocal rank fusion ranks a chunk found twice above single hits"""
+        fused = RAGPipeline._fuse_hits([[('a', 0.9), ('b', 0.5)], [('c', 0.8), ('b', 0.4)]], fusion='rrf')
+        self.assertEqual(fused[0][0], 'b')
+        self.assertEqual(len(fused), 3)
+
+
+class VectorShardTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.shard = EmbeddingShard(os.path.join(directory.name, 'template'))
+
+    def test_rewritten_document_replaces_its_rows(self):
+        """Test that the journal replaces a rewritten document's rows"""
+        self.shard.write_document('a', 'v1', ['a0', 'a1'], np.eye(4, dtype=np.float32)[:2])
+        self.shard.write_document('b', 'v1', ['b0'], np.eye(4, dtype=np.float32)[2:3])
+        self.shard.write_document('a', 'v2', ['a2'], np.eye(4, dtype=np.float32)[3:4])
+
+        contents = self.shard.read()
+        self.assertIsInstance(contents.vectors, np.memmap)
+        self.assertEqual([contents.chunk_ids[row] for row in np.flatnonzero(contents.alive)], ['b0', 'a2'])
+        self.assertEqual(contents.versions, {'a': 'v2', 'b': 'v1'})
+        np.testing.assert_array_equal(contents.vectors[contents.chunk_ids.index('a2')], np.eye(4)[3])
+
+    def test_compaction_swaps_in_a_new_generation(self):
+        """Test that compaction keeps only live rows and removes the old files"""
+        for i in range(4):
+            self.shard.write_document(f"d{i}", 'v1', [f"c{i}"], np.eye(4, dtype=np.float32)[i:i + 1])
+        before = sorted(os.listdir(self.shard.directory))
+        self.shard.remove_document('d0')
+        self.shard.remove_document('d1')
+
+        contents = self.shard.read()
+        self.assertEqual(contents.chunk_ids, ['c2', 'c3'])
+        self.assertTrue(contents.alive.all())
+        self.assertTrue(set(before).isdisjoint(f for f in os.listdir(self.shard.directory) if f.endswith(('.f32', '.log'))))
+
+    def test_manifest_counts_rows_without_rereading_the_journal(self):
+        """Test that writers track live and dead rows in the manifest instead of parsing the journal"""
+        for i in range(8):
+            self.shard.write_document(f"d{i}", 'v1', [f"c{i}", f"e{i}"], np.eye(4, dtype=np.float32)[:2])
+        with mock.patch.object(EmbeddingShard, '_read_generation', side_effect=AssertionError):
+            self.shard.write_document('d0', 'v2', ['c0'], np.eye(4, dtype=np.float32)[:1])
+            self.shard.remove_document('d1')
+
+        manifest = self.shard._manifest()
+        self.assertEqual((manifest['rows'], manifest['dead']), (17, 4))
+        self.assertEqual(manifest['documents'], {'d0': 1, **{f"d{i}": 2 for i in range(2, 8)}})
+
+        # Past the dead-row threshold the live rows are compacted and recounted
+        self.shard.remove_document('d2')
+        manifest = self.shard._manifest()
+        self.assertEqual((manifest['rows'], manifest['dead']), (11, 0))
+        self.assertEqual(manifest['documents'], {'d0': 1, **{f"d{i}": 2 for i in range(3, 8)}})
+        self.assertEqual(len(self.shard.read().chunk_ids), 11)
+
+
+@override_settings(RAG_VECTOR_SHARDS_ENABLED=False)
+class EmbeddingProviderTests(TestCase):
+    @mock.patch.dict(os.environ, {'OPENAI_API_KEY': ''})
+    def test_local_provider_runs_without_api_key(self):
+        """Test that the local provider embeds deterministically and offline"""
+        service = EmbeddingService(provider='local', use_cache=False)
+        first, second, unrelated = service.generate_embeddings_batch(
+            ['Contract number INV-2024-0042', 'contract number INV-2024-0042', 'Weather in Lisbon']
+        )
+
+        self.assertEqual(len(first), 384)
+        self.assertEqual(service.space, ('local', service.model, 384))
+        self.assertAlmostEqual(float(np.linalg.norm(first)), 1.0, places=5)
+        self.assertEqual(first, LocalEmbeddingProvider().embed(['Contract number INV-2024-0042'])[0])
+        self.assertGreater(np.dot(first, second), np.dot(first, unrelated))
+
+    def test_providers_must_implement_embed(self):
+        """Test that a provider without embed cannot be instantiated"""
+        class Incomplete(EmbeddingProvider):
+            name = 'incomplete'
+
+        with self.assertRaises(TypeError):
+            Incomplete('model')
+
+    def test_documents_from_another_space_are_excluded_until_reembedded(self):
+        """Test that retrieval skips documents embedded by another provider and re-embedding includes them"""
+        from .services import rag_pipeline
+
+        pipeline = RAGPipeline(embedding_provider='local')
+        document = _create_document_with_chunks('legacy', [[1.0, 0.0]])
+        with mock.patch.object(rag_pipeline, '_checked_spaces', set()):
+            with self.assertLogs('rag_pipeline.services.rag_pipeline', 'WARNING'):
+                self.assertEqual(pipeline.get_similar_chunks_internal('legacy chunk 0'), [])
+            # The other space is reported once per process, not on every retrieval
+            with self.assertNoLogs('rag_pipeline.services.rag_pipeline', 'WARNING'):
+                self.assertEqual(pipeline.get_similar_chunks_internal('legacy chunk 0'), [])
+
+        self.assertEqual(pipeline.reembed_document(document), 1)
+        document.refresh_from_db()
+        self.assertEqual((document.embedding_provider, document.embedding_dimensions), ('local', 384))
+        results = pipeline.get_similar_chunks_internal('legacy chunk 0')
+        self.assertEqual([result['document_id'] for result in results], [str(document.id)])
+
+
+    def test_truncate_shortens_and_renormalises_stored_embeddings(self):
+        """Test that truncating re-tags a document at the smaller dimension with unit-length vectors"""
+        full = RAGPipeline(embedding_provider='local')
+        document = _create_document_with_chunks('long', [[1.0, 0.0]])
+        full.reembed_document(document)
+        original = DocumentChunk.objects.get(document=document).embedding.copy()
+
+        short = RAGPipeline(embedding_provider='local', embedding_model=full.embedding_service.model, embedding_dimensions=64)
+        self.assertEqual(short.reembed_document(document, truncate=True), 1)
+
+        chunk = DocumentChunk.objects.get(document=document)
+        document.refresh_from_db()
+        self.assertEqual((chunk.embedding_dimensions, document.embedding_dimensions), (64, 64))
+        self.assertAlmostEqual(float(np.linalg.norm(chunk.embedding)), 1.0, places=5)
+        np.testing.assert_allclose(chunk.embedding, original[:64] / np.linalg.norm(original[:64]), rtol=1e-5)
+
+        other_model = _create_document_with_chunks('openai', [[1.0, 0.0]])
+        with self.assertRaises(ValueError):
+            RAGPipeline(embedding_provider='local', embedding_dimensions=32).reembed_document(other_model, truncate=True)
+
+    def test_openai_provider_requests_configured_dimensions(self):
+        """Test that the dimensions setting is sent to the embeddings API"""
+        with override_settings(RAG_EMBEDDING_DIMENSIONS=256):
+            service = EmbeddingService(api_key='test', use_cache=False)
+        response = mock.Mock(data=[mock.Mock(embedding=[0.0] * 256)])
+        with mock.patch.object(service.client.embeddings, 'create', return_value=response) as create:
+            service.generate_embedding('hello')
+
+        self.assertEqual(create.call_args.kwargs['dimensions'], 256)
+        self.assertEqual(create.call_args.kwargs['timeout'].read, 60)
+        self.assertEqual(service.space.dimensions, 256)
+
+    def test_space_resolves_the_native_size_when_no_dimensions_are_set(self):
+        """Test that retrieval filters on the model's native size, probing a model the provider does not know"""
+        from .services import embedding_service
+
+        known = EmbeddingService(api_key='test', use_cache=False)
+        self.assertEqual(known.space.dimensions, 1536)
+        self.assertEqual(RetrievalScope.build(embedding_space=known.space).space_filter()['embedding_dimensions'], 1536)
+
+        custom = EmbeddingService(api_key='test', model='custom-embedder', use_cache=False)
+        response = mock.Mock(data=[mock.Mock(embedding=[0.0] * 7)])
+        with mock.patch.dict(embedding_service._observed_dimensions, clear=True), \
+                mock.patch.object(custom.client.embeddings, 'create', return_value=response) as create:
+            self.assertEqual((custom.space.dimensions, custom.space.dimensions), (7, 7))
+        self.assertEqual(create.call_count, 1)
+        self.assertNotIn('dimensions', create.call_args.kwargs)
+
+
+@override_settings(OPENAI_HTTP_MAX_CONNECTIONS=1)
+class OpenAIClientTests(SimpleTestCase):
+    def setUp(self):
+        openai_client._reset_after_fork()
+        self.addCleanup(openai_client._reset_after_fork)
+
+    @mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'sk-test'})
+    def test_embedding_and_chat_share_one_pool(self):
+        """Test that every embedding service and the chat client send through the same HTTP client"""
+        from template_engine.services.llm_client import get_openai_client
+
+        first, second = EmbeddingService(use_cache=False), EmbeddingService(use_cache=False)
+        http_client = openai_client.get_http_client()
+        self.assertIs(first.client, second.client)
+        self.assertEqual(first.client.max_retries, 0)
+        self.assertIs(first.client._client, http_client)
+        self.assertIs(get_openai_client()._client, http_client)
+
+    def test_pool_stats_count_saturation(self):
+        """Test that a request made while every connection is held counts as saturated"""
+        with mock.patch('httpx.HTTPTransport.handle_request', side_effect=lambda request: httpx.Response(200, stream=httpx.ByteStream(b'{}'))):
+            http_client = openai_client.get_http_client()
+            held = http_client.send(http_client.build_request('GET', 'https://api.openai.com/v1/models'), stream=True)
+            http_client.get('https://api.openai.com/v1/models')
+            busy = openai_client.http_client_stats()
+            held.close()
+
+        self.assertEqual((busy['requests'], busy['saturated_requests'], busy['in_flight']), (2, 1, 1))
+        stats = openai_client.http_client_stats()
+        self.assertEqual((stats['in_flight'], stats['peak_in_flight'], stats['max_connections']), (0, 2, 1))
+
+    def test_forked_child_builds_its_own_client(self):
+        """Test that a process forked after the client was built does not reuse the parent's connections"""
+        parent_client = openai_client.get_http_client()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if openai_client.get_http_client() is not parent_client else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertIs(openai_client.get_http_client(), parent_client)
+
+
+class FlakyProvider(EmbeddingProvider):
+    name = 'flaky'
+    max_batch_size = 3
+    max_batch_tokens = 40
+    retryable_errors = (ConnectionError,)
+
+    def __init__(self, failures=0):
+        super().__init__('flaky-model')
+        self.failures = failures
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append(list(texts))
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('rate limited')
+        # The first batch finishes last so ordering is not an accident of timing
+        if texts[0] == 'text 0':
+            time.sleep(0.05)
+        return [[float(text.split()[-1])] for text in texts]
+
+
+@override_settings(RAG_EMBEDDING_CONCURRENCY=4, RAG_EMBEDDING_MAX_RETRIES=3)
+class EmbeddingBatchingTests(TestCase):
+    def test_plan_batches_respects_item_and_token_limits(self):
+        """Test that batches stay within both limits and cover every text once"""
+        texts = ['a' * 30, 'b', 'c', 'd', 'e' * 200, 'f']
+        batches = plan_batches(texts, max_items=3, max_tokens=20)
+
+        self.assertEqual([list(batch) for batch in batches], [[0, 1, 2], [3], [4], [5]])
+        self.assertEqual(plan_batches([], 3, 20), [])
+
+    def test_batches_run_concurrently_and_keep_order(self):
+        """Test that sub-batch results are reassembled in input order"""
+        provider = FlakyProvider()
+        service = EmbeddingService(provider=provider, use_cache=False)
+        texts = [f"text {i}" for i in range(20)]
+
+        embeddings = service.generate_embeddings_batch(texts)
+
+        self.assertEqual(embeddings, [[float(i)] for i in range(20)])
+        self.assertGreater(len(provider.calls), 1)
+        self.assertTrue(all(len(call) <= 3 for call in provider.calls))
+
+    @mock.patch('tenacity.nap.time.sleep')
+    def test_transient_errors_are_retried(self, sleep):
+        """Test that retryable errors back off and retry while others fail fast"""
+        service = EmbeddingService(provider=FlakyProvider(failures=2), use_cache=False)
+        self.assertEqual(service.generate_embeddings_batch(['text 1']), [[1.0]])
+        self.assertEqual(sleep.call_count, 2)
+
+        with self.assertRaises(ValueError):
+            EmbeddingService(provider=FlakyProvider(failures=10), use_cache=False).generate_embeddings_batch(['text 1'])
+
+
+@mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'sk-test'})
+class HybridRetrievalTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shard_settings = override_settings(RAG_VECTOR_SHARD_DIR=directory.name)
+        shard_settings.enable()
+        self.addCleanup(shard_settings.disable)
+
+        self.template = Template.objects.create(name="Invoices", lexical_json={})
+        self.document = _create_document_with_chunks(
+            'invoices', [[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]], template=self.template
+        )
+        chunks = list(self.document.chunks.order_by('chunk_index'))
+        for chunk, content in zip(chunks, ['General payment terms', 'Invoice INV-2024-0042 is overdue', 'Other notes']):
+            chunk.content = content
+            chunk.save(update_fields=['content'])
+        lexical_index.index_chunks(self.document, chunks)
+        self.identifier_chunk = str(chunks[1].id)
+
+    def test_query_terms_are_safe_fts_phrases(self):
+        """Test that identifiers stay whole and FTS5 syntax is quoted away"""
+        self.assertEqual(LexicalIndex.fts5_query('Find INV-2024-0042 AND "x" NEAR(y)'),
+                         '"find" OR "inv-2024-0042" OR "and" OR "x" OR "near" OR "y"')
+
+    def test_keyword_search_is_scoped(self):
+        """Test that keyword search finds identifiers only within the scope"""
+        other = _create_document_with_chunks('other', [[1.0, 0.0]])
+        DocumentChunk.objects.filter(document=other).update(content='INV-2024-0042 copy')
+        lexical_index.index_chunks(other, list(other.chunks.all()))
+
+        hits = lexical_index.search('INV-2024-0042', RetrievalScope.build(template_id=self.template.id))
+        self.assertEqual([chunk_id for chunk_id, _ in hits], [self.identifier_chunk])
+        self.assertEqual(len(lexical_index.search('INV-2024-0042')), 2)
+
+        other.delete()
+        self.assertEqual(len(lexical_index.search('INV-2024-0042')), 1)
+
+    def test_deletes_find_fts_rows_through_the_indexed_row_map(self):
+        """Test that a document's keyword rows are looked up by index, not by scanning the FTS table"""
+        from django.db import connection
+        from .services.lexical_index import FTS_TABLE, FTS_ROWS_TABLE
+
+        if connection.vendor != 'sqlite' or not lexical_index.available:
+            self.skipTest('needs the SQLite FTS5 index')
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN SELECT id FROM {FTS_ROWS_TABLE} WHERE document_id = %s", ['x'])
+            self.assertIn(f'INDEX {FTS_ROWS_TABLE}_document_id', ' '.join(str(row[-1]) for row in cursor.fetchall()))
+
+        chunks = list(self.document.chunks.order_by('chunk_index'))
+        lexical_index.update_chunks(self.document, [str(chunks[0].id)], [])
+        self.assertEqual([chunk_id for chunk_id, _ in lexical_index.search('payment')], [])
+        self.assertEqual(len(lexical_index.search('INV-2024-0042')), 1)
+
+        self.document.delete()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT (SELECT COUNT(*) FROM {FTS_TABLE}), (SELECT COUNT(*) FROM {FTS_ROWS_TABLE})")
+            self.assertEqual(cursor.fetchone(), (0, 0))
+
+    def test_exact_identifier_outranks_semantic_neighbours(self):
+        """Test that a keyword match is fused into the vector ranking"""
+        pipeline = RAGPipeline(embedding_dimensions=2)
+        with mock.patch.object(pipeline.embedding_service, 'embed_query', return_value=[1.0, 0.0]):
+            results = pipeline.get_similar_chunks_internal('status of INV-2024-0042', top_k=1, template_id=str(self.template.id))
+            with override_settings(RAG_LEXICAL_SEARCH_ENABLED=False):
+                vector_only = pipeline.get_similar_chunks_internal('status of INV-2024-0042', top_k=1, template_id=str(self.template.id))
+
+        self.assertEqual(results[0]['chunk_id'], self.identifier_chunk)
+        self.assertAlmostEqual(results[0]['similarity_score'], 0.0, places=5)
+        self.assertNotEqual(vector_only[0]['chunk_id'], self.identifier_chunk)
+
+    def test_keyword_hit_survives_multi_query_fusion(self):
+        """Test that fusing several queries keeps a chunk ranked first only by keyword match"""
+        pipeline = RAGPipeline(embedding_dimensions=2)
+        with mock.patch.object(pipeline.embedding_service, 'embed_queries', return_value=[[1.0, 0.0], [1.0, 0.0]]):
+            results = pipeline.get_similar_chunks_multi(['status of INV-2024-0042', 'payment terms'], top_k=2, limit=2,
+                                                        template_id=str(self.template.id))
+        self.assertIn(self.identifier_chunk, [result['chunk_id'] for result in results])
+
+    @override_settings(RAG_LEXICAL_PREFILTER_MIN_CHUNKS=1)
+    def test_prefilter_only_scores_keyword_candidates(self):
+        """Test that large scopes score keyword candidates instead of scanning every chunk"""
+        pipeline = RAGPipeline(embedding_dimensions=2)
+        with mock.patch.object(pipeline.embedding_service, 'embed_query', return_value=[1.0, 0.0]), \
+                mock.patch.object(VectorIndex, 'search_batch', side_effect=AssertionError):
+            results = pipeline.get_similar_chunks_internal('INV-2024-0042', top_k=1, template_id=str(self.template.id))
+        self.assertEqual([result['chunk_id'] for result in results], [self.identifier_chunk])
+
+
+class VectorIndexRegistryTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shard_settings = override_settings(RAG_VECTOR_SHARD_DIR=directory.name)
+        shard_settings.enable()
+        self.addCleanup(shard_settings.disable)
+
+    def test_index_is_cached_until_corpus_changes(self):
+        """Test that the registry reuses an index and rebuilds after a document is deleted"""
+        registry = VectorIndexRegistry()
+        first = _create_document_with_chunks('first', [[1.0, 0.0]])
+        _create_document_with_chunks('second', [[0.0, 1.0]])
+
+        index = registry.get_index()
+        self.assertEqual(len(index), 2)
+        self.assertIs(registry.get_index(), index)
+
+        first.delete()
+        rebuilt = registry.get_index()
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(len(rebuilt), 1)
+
+    def test_scope_only_loads_matching_documents(self):
+        """Test that a template/session scope only indexes that scope's chunks"""
+        registry = VectorIndexRegistry()
+        template = Template.objects.create(name="Scoped", lexical_json={})
+        other_template = Template.objects.create(name="Other", lexical_json={})
+        mine = _create_document_with_chunks('mine', [[1.0, 0.0]], template=template, session_id='s1')
+        _create_document_with_chunks('other session', [[1.0, 0.0]], template=template, session_id='s2')
+        _create_document_with_chunks('other template', [[1.0, 0.0]], template=other_template, session_id='s1')
+
+        index = registry.get_index(RetrievalScope.build(template_id=template.id, session_id='s1'))
+        self.assertEqual(index.document_ids, [str(mine.id)])
+        self.assertEqual(len(registry.get_index(RetrievalScope.build(template_id=template.id))), 2)
+        self.assertEqual(len(registry.get_index(RetrievalScope.build(document_ids=[mine.id]))), 1)
+
+    @override_settings(RAG_INDEX_QUANTIZATION='int8')
+    def test_quantized_scope_rescores_from_database(self):
+        """Test that a quantized index reranks candidates with stored float embeddings"""
+        registry = VectorIndexRegistry()
+        _create_document_with_chunks('doc', [[1.0, 0.0, 0.0], [0.6, 0.8, 0.0], [0.0, 0.0, 1.0]])
+
+        index = registry.get_index()
+        self.assertIsInstance(index, QuantizedIndex)
+        hits = index.search([0.6, 0.8, 0.0], top_k=2)
+        self.assertEqual(DocumentChunk.objects.get(id=hits[0][0]).content, 'doc chunk 1')
+        self.assertAlmostEqual(hits[0][1], 1.0, places=5)
+        self.assertAlmostEqual(hits[1][1], 0.6, places=5)
+
+    @override_settings(RAG_VECTOR_SHARDS_ENABLED=False)
+    def test_update_document_applies_in_place(self):
+        """Test that rewriting a document's chunks updates the cached index without a rebuild"""
+        registry = VectorIndexRegistry()
+        _create_document_with_chunks('first', [[1.0, 0.0]])
+        index = registry.get_index()
+
+        second = _create_document_with_chunks('second', [[0.0, 1.0]])
+        second.save(update_fields=['updated_at'])
+        chunk_ids = [str(chunk_id) for chunk_id in second.chunks.values_list('id', flat=True)]
+        registry.update_document(second, chunk_ids, [[0.0, 1.0]])
+
+        self.assertIs(registry.get_index(), index)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.search([0.0, 1.0], top_k=1)[0][0], chunk_ids[0])
+
+    def test_shards_are_mapped_and_resynced_from_database(self):
+        """Test that indexes map the template shard and stale documents are re-read"""
+        template = Template.objects.create(name="Sharded", lexical_json={})
+        document = _create_document_with_chunks('doc', [[1.0, 0.0], [0.0, 1.0]], template=template)
+        scope = RetrievalScope.build(template_id=template.id)
+
+        index = VectorIndexRegistry().get_index(scope)
+        self.assertTrue(index.is_mapped)
+        self.assertEqual(len(index), 2)
+
+        # Another process builds from the shard without decoding embeddings
+        with mock.patch.object(VectorIndex, 'from_queryset', side_effect=AssertionError):
+            self.assertEqual(len(VectorIndexRegistry().get_index(scope)), 2)
+
+        # A rewrite the shard missed is picked up from the database
+        document.chunks.all().delete()
+        chunk = DocumentChunk(document=document, content='new', chunk_index=0)
+        chunk.set_embedding([0.6, 0.8], model='test-model')
+        chunk.save()
+        document.save(update_fields=['updated_at'])
+        hits = VectorIndexRegistry().get_index(scope).search([0.6, 0.8], top_k=5)
+        self.assertEqual([chunk_id for chunk_id, _ in hits], [str(chunk.id)])
+
+    def test_deleted_documents_leave_the_shard_in_one_pass_after_commit(self):
+        """Test that a deletion batch marks its shard rows dead once, and only when it commits"""
+        from .services.retention import delete_documents
+
+        template = Template.objects.create(name="Sharded", lexical_json={})
+        document_ids = [_create_document_with_chunks(f'doc {i}', [[1.0, 0.0]], template=template).id for i in range(4)]
+        scope = RetrievalScope.build(template_id=template.id)
+        VectorIndexRegistry().get_index(scope)
+        shard = EmbeddingShard(os.path.join(settings.RAG_VECTOR_SHARD_DIR, str(template.id)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Document.objects.get(id=document_ids[0]).delete()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertTrue(shard.read().alive.all())
+
+        with mock.patch.object(EmbeddingShard, '_compact_if_needed') as compact:
+            with self.captureOnCommitCallbacks() as callbacks:
+                delete_documents(Document.objects.filter(id__in=document_ids[:3]))
+            self.assertTrue(shard.read().alive.all())
+            for callback in callbacks:
+                callback()
+        self.assertEqual(compact.call_count, 1)
+        contents = shard.read()
+        self.assertEqual([document_id for document_id, alive in zip(contents.document_ids, contents.alive) if alive],
+                         [str(document_ids[3])])
+
+
+@override_settings(RAG_EMBEDDING_PROVIDER='local', RAG_VECTOR_SHARDS_ENABLED=False)
+class IngestionJobTests(TestCase):
+    def _upload(self, content):
+        return self.client.post('/api/rag/upload/', {'content': content, 'name': 'notes', 'session_id': 's1'})
+
+    def test_upload_is_queued_and_searchable_once_processed(self):
+        """Test that uploads return 202 and stay out of retrieval until a worker indexes them"""
+        response = self._upload('The invoice number is INV-2024-0042.')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        pipeline = RAGPipeline()
+        self.assertEqual(pipeline.get_similar_chunks_internal('invoice number', session_id='s1'), [])
+
+        worker = IngestionWorker(pipeline=pipeline)
+        self.assertEqual(worker.run_pending(), 1)
+
+        status = self.client.get(response.json()['status_url']).json()
+        self.assertEqual((status['job_id'], status['status'], status['stage']), (job_id, 'succeeded', 'done'))
+        self.assertEqual(status['progress'], {'current': 1, 'total': 1})
+        self.assertEqual(Document.objects.get(id=status['document_id']).status, 'indexed')
+        results = pipeline.get_similar_chunks_internal('invoice number', session_id='s1')
+        self.assertEqual([result['document_id'] for result in results], [status['document_id']])
+
+    def test_failed_job_records_error(self):
+        """Test that a processing error fails the job and the document"""
+        job_id = self._upload('text').json()['job_id']
+        worker = IngestionWorker(pipeline=RAGPipeline())
+        with mock.patch.object(worker.pipeline.embedding_service, 'embed_chunks', side_effect=ValueError('quota exceeded')):
+            worker.run_pending()
+
+        job = IngestionJob.objects.get(id=job_id)
+        self.assertEqual((job.status, job.stage, job.error), ('failed', 'embedding', 'quota exceeded'))
+        self.assertEqual(job.document.status, 'failed')
+        self.assertEqual(self.client.get(f'/api/rag/jobs/{uuid.uuid4()}/').status_code, 404)
+
+    def test_failed_reprocessing_keeps_the_document_searchable(self):
+        """Test that a failed replace fails the job but leaves the document indexed with its previous chunks"""
+        document_id = self._upload('The invoice number is INV-2024-0042.').json()['document_id']
+        pipeline = RAGPipeline()
+        worker = IngestionWorker(pipeline=pipeline)
+        worker.run_pending()
+
+        job_id = self.client.post(f'/api/rag/replace/{document_id}/', {'content': 'Refunds take ten days.'}).json()['job_id']
+        with mock.patch.object(pipeline.embedding_service, 'embed_chunks', side_effect=ValueError('quota exceeded')):
+            worker.run_pending()
+
+        self.assertEqual(IngestionJob.objects.get(id=job_id).error, 'quota exceeded')
+        self.assertEqual(Document.objects.get(id=document_id).status, 'indexed')
+        results = pipeline.get_similar_chunks_internal('invoice number', session_id='s1')
+        self.assertEqual([result['content'] for result in results], ['The invoice number is INV-2024-0042.'])
+
+    def test_abandoned_jobs_are_requeued(self):
+        """Test that a job whose worker stopped heartbeating is claimed again"""
+        self._upload('text')
+        first = IngestionWorker(name='crashed')
+        job = first.claim()
+        self.assertIsNone(IngestionWorker(name='other').claim())
+
+        IngestionJob.objects.filter(id=job.id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        second = IngestionWorker(name='other', pipeline=RAGPipeline())
+        self.assertEqual(second.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.attempts), ('succeeded', 'other', 2))
+
+
+    def test_worker_that_lost_its_lease_does_not_overwrite_the_outcome(self):
+        """Test that a worker finishing a job re-claimed by another leaves that worker's result alone"""
+        self._upload('text')
+        slow = IngestionWorker(name='slow', pipeline=RAGPipeline())
+        job = slow.claim()
+
+        def taken_over(document, progress=None):
+            IngestionJob.objects.filter(id=job.id).update(worker='other', status=IngestionJob.STATUS_SUCCEEDED)
+            raise RuntimeError('interrupted')
+
+        with mock.patch.object(slow.pipeline, 'process_document', side_effect=taken_over):
+            self.assertFalse(slow.run_job(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.error), ('succeeded', 'other', ''))
+        self.assertNotEqual(job.document.status, 'failed')
+
+
+@override_settings(RAG_EMBEDDING_PROVIDER='local', RAG_VECTOR_SHARDS_ENABLED=False, RAG_INGESTION_LEASE_SECONDS=1)
+class IngestionHeartbeatTests(TransactionTestCase):
+    def test_long_running_job_keeps_its_lease(self):
+        """Test that a job busy for longer than the lease keeps heartbeating and is not re-queued"""
+        document = RAGPipeline().create_text_document('notes', 'The invoice number is INV-2024-0042.')
+        enqueue_document(document)
+        worker = IngestionWorker(name='busy', pipeline=RAGPipeline())
+        job = worker.claim()
+        process_document = worker.pipeline.process_document
+
+        def slow(document, progress=None):
+            time.sleep(2.5)
+            self.assertEqual(IngestionWorker(name='other').requeue_stale(), 0)
+            process_document(document, progress=progress)
+
+        with mock.patch.object(worker.pipeline, 'process_document', side_effect=slow):
+            self.assertTrue(worker.run_job(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('succeeded', 1))
+
+
+class PdfExtractionTests(TestCase):
+    def setUp(self):
+        import fitz
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'report.pdf')
+        with fitz.open() as pdf:
+            for number in range(1, 41):
+                pdf.new_page().insert_text((72, 72), f"Section {number} of the annual report")
+            pdf.save(self.path)
+
+    def test_parallel_extraction_matches_serial_order(self):
+        """Test that pages extracted by several processes come back in page order"""
+        with override_settings(RAG_PDF_PARALLEL_MIN_PAGES=2):
+            parallel = list(DocumentProcessor.iter_pdf_pages(self.path, workers=2))
+        with override_settings(RAG_PDF_PARALLEL_MIN_PAGES=1000):
+            serial = list(DocumentProcessor.iter_pdf_pages(self.path))
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual([page.number for page in parallel], list(range(1, 41)))
+        self.assertIn('Section 7 of', parallel[6].text)
+        self.assertEqual([len(r) for r in page_ranges(100, 2)], [16] * 6 + [4])
+
+    def test_chunks_record_the_pages_they_span(self):
+        """Test that page numbers flow from extraction into chunk metadata"""
+        text, pages = DocumentProcessor.join_pages(list(DocumentProcessor.iter_pdf_pages(self.path)))
+        chunks = TextChunker(chunk_size=120, chunk_overlap=0).chunk_document(text, 'report', pages=pages)
+
+        first, last = chunks[0]['metadata'], chunks[-1]['metadata']
+        self.assertEqual((first['page_start'], first['document_name']), (1, 'report'))
+        self.assertEqual(last['page_end'], 40)
+        for chunk in chunks:
+            self.assertIn(f"Section {chunk['metadata']['page_start']} of", chunk['content'])
+
+        chunker = TextChunker(chunk_size=120, chunk_overlap=0)
+        self.assertEqual(chunker.chunk_parts(DocumentProcessor.iter_document(self.path, 'pdf')),
+                         (text, chunker.chunk_text(text, pages=pages)))
+
+
+class TextChunkerTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        pieces = ['a', 'lorem', 'ipsum dolor', 'x' * 45, 'y' * 130, ' ', '  ', '\n', '\n\n', '\n\n\n', '\t']
+        self.texts = [
+            ''.join(pieces[i] + (' ' if i % 3 else '') for i in rng.integers(0, len(pieces), size=n))
+            for n in (0, 5, 60, 400, 1500)
+        ] + ['z' * 700, ' '.join(['word'] * 300), '\n\n'.join(['para graph'] * 50)]
+
+    def test_matches_langchain_recursive_splitter(self):
+        """Test that chunks are identical to langchain's RecursiveCharacterTextSplitter"""
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        for chunk_size, chunk_overlap in [(2, 1), (10, 0), (50, 20), (100, 99), (300, 60)]:
+            splitter = RecursiveCharacterTextSplitter(
+                chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len,
+                separators=["\n\n", "\n", " ", ""]
+            )
+            chunker = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+            for text in self.texts:
+                chunks = chunker.chunk_text(text)
+                self.assertEqual([chunk['content'] for chunk in chunks], splitter.split_text(text))
+
+    def test_streamed_parts_chunk_like_the_joined_text(self):
+        """Test that chunking a text in parts gives the same chunks and offsets as chunking it whole"""
+        chunker = TextChunker(chunk_size=50, chunk_overlap=20)
+        for text in self.texts:
+            whole = list(chunker.iter_spans([text]))
+            for part_size in (1, 7, 64):
+                parts = (text[i:i + part_size] for i in range(0, len(text), part_size))
+                self.assertEqual(list(chunker.iter_spans(parts)), whole)
+            for start, end, content in whole:
+                self.assertEqual(text[start:end], content)
+
+    def test_chunk_parts_matches_chunking_the_stripped_text(self):
+        """Test that chunking extracted parts as they stream matches chunk_text on the joined pages"""
+        chunker = TextChunker(chunk_size=50, chunk_overlap=20)
+        for text in self.texts:
+            padded = f" \n{text}\n\n  "
+            for part_size in (1, 7, 64):
+                parts = [padded[i:i + part_size] for i in range(0, len(padded), part_size)]
+                self.assertEqual(chunker.chunk_parts((part, None) for part in parts),
+                                 (padded.strip(), chunker.chunk_text(padded.strip())))
+
+                pages = [ExtractedPage(number, part, {'page': number}) for number, part in enumerate(parts, 1)]
+                joined, offsets = DocumentProcessor.join_pages(pages)
+                self.assertEqual(chunker.chunk_parts((page.text, page.metadata) for page in pages),
+                                 (joined, chunker.chunk_text(joined, pages=offsets)))
+
+
+class DocxExtractionTests(TestCase):
+    def test_streams_blocks_in_order_without_repeating_merged_cells(self):
+        """Test that paragraphs and table rows stream in document order and merged cells appear once"""
+        from docx import Document as DocxDocument
+        docx = DocxDocument()
+        docx.add_paragraph('Intro paragraph')
+        table = docx.add_table(rows=3, cols=3)
+        for row in range(3):
+            for column in range(3):
+                table.cell(row, column).text = f'r{row}c{column}'
+        table.cell(0, 0).merge(table.cell(0, 1))
+        table.cell(1, 2).merge(table.cell(2, 2))
+        nested = table.cell(2, 0).add_table(rows=1, cols=2)
+        nested.cell(0, 0).text, nested.cell(0, 1).text = 'inner1', 'inner2'
+        docx.add_paragraph('Closing paragraph')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'contract.docx')
+        docx.save(path)
+
+        self.assertEqual(list(DocumentProcessor.iter_docx_blocks(path)), [
+            'Intro paragraph',
+            'r0c0 r0c1 r0c2',
+            'r1c0 r1c1 r1c2 r2c2',
+            'r2c0 inner1 inner2 r2c1',
+            'Closing paragraph',
+        ])
+        self.assertTrue(DocumentProcessor.extract_text_from_docx(path).endswith('r2c1\nClosing paragraph'))
+
+        with open(path, 'wb') as broken:
+            broken.write(b'not a zip')
+        with self.assertRaises(ValueError):
+            DocumentProcessor.extract_text_from_docx(path)
+        with self.assertRaises(ValueError):
+            DocumentProcessor.extract_text_from_docx(os.path.join(directory.name, 'missing.docx'))
+
+
+@override_settings(RAG_EMBEDDING_PROVIDER='local', RAG_EMBEDDING_CACHE_ENABLED=False, RAG_VECTOR_SHARDS_ENABLED=False)
+class IncrementalReingestionTests(TestCase):
+    def test_only_changed_chunks_are_embedded(self):
+        """Test that replacing a document keeps unchanged chunks and embeds only the edit"""
+        from .services.index_registry import vector_index_registry
+        paragraphs = [f"Paragraph {i} about topic {i} in the handbook." for i in range(8)]
+        pipeline = RAGPipeline(chunk_size=60, chunk_overlap=0)
+        document = pipeline.process_text_document('handbook', '\n\n'.join(paragraphs), session_id='s1')
+        before = {chunk.text: chunk.id for chunk in document.chunks.all()}
+        scope = pipeline._scope(session_id='s1')
+        index = vector_index_registry.get_index(scope)
+        self.assertEqual(len(before), 8)
+
+        paragraphs[3] = 'Paragraph 3 now covers the refund policy instead.'
+        pipeline.replace_document_source(document, content='\n\n'.join(paragraphs))
+        with mock.patch.object(pipeline.embedding_service.provider, 'embed',
+                               wraps=pipeline.embedding_service.provider.embed) as embed, \
+                mock.patch.object(VectorIndex, 'from_queryset', side_effect=AssertionError):
+            pipeline.process_document(document)
+            self.assertIs(vector_index_registry.get_index(scope), index)
+
+        self.assertEqual(embed.call_args.args[0], [paragraphs[3]])
+        after = {chunk.text: chunk.id for chunk in document.chunks.all()}
+        self.assertEqual(list(document.chunks.values_list('chunk_index', flat=True)), list(range(8)))
+        for i in (0, 2, 7):
+            self.assertEqual(after[paragraphs[i]], before[paragraphs[i]])
+        replaced = str(before['Paragraph 3 about topic 3 in the handbook.'])
+        self.assertNotIn(replaced, [index.chunk_ids[row] for row in np.flatnonzero(index._alive)])
+        results = pipeline.get_similar_chunks_internal('refund policy', top_k=1, session_id='s1')
+        self.assertEqual(results[0]['chunk_id'], str(after[paragraphs[3]]))
+        if lexical_index.available:
+            self.assertEqual([chunk_id for chunk_id, _ in lexical_index.search('refund', scope)], [str(after[paragraphs[3]])])
+            self.assertNotIn(replaced, [chunk_id for chunk_id, _ in lexical_index.search('handbook', scope)])
+
+
+@override_settings(RAG_EMBEDDING_PROVIDER='local', RAG_EMBEDDING_CACHE_ENABLED=False, RAG_VECTOR_SHARDS_ENABLED=False)
+class ChunkStorageTests(TestCase):
+    def setUp(self):
+        self.paragraphs = [f"Section {i} of the lease covers clause {i * 7}." for i in range(6)]
+        self.pipeline = RAGPipeline(chunk_size=60, chunk_overlap=20)
+
+    def test_chunks_are_stored_as_offsets_into_the_document(self):
+        """Test that chunk text is stored once, on the document, and sliced out for results"""
+        document = self.pipeline.process_text_document('lease', '\n\n'.join(self.paragraphs), session_id='s1')
+        chunks = list(document.chunks.all())
+
+        self.assertEqual([chunk.content for chunk in chunks], [''] * len(chunks))
+        self.assertEqual([chunk.text for chunk in chunks], self.paragraphs)
+        self.assertEqual(chunks[0].metadata, {})
+        results = self.pipeline.get_similar_chunks_internal('clause 21', top_k=2, session_id='s1')
+        self.assertIn(results[0]['content'], self.paragraphs)
+        self.assertEqual(results[0]['metadata']['document_name'], 'lease')
+        self.assertEqual(results[0]['metadata']['chunk_size'], 60)
+        self.assertEqual(
+            [chunk['content'] for chunk in self.pipeline.get_document_chunks(str(document.id))], self.paragraphs
+        )
+
+    def test_failed_reprocessing_keeps_stored_chunk_text(self):
+        """Test that chunks keep their text when a replaced document fails to re-embed, and move to the new text once it succeeds"""
+        document = self.pipeline.process_text_document('lease', '\n\n'.join(self.paragraphs))
+        replaced = ['Inserted a new leading paragraph.'] + self.paragraphs
+        self.pipeline.replace_document_source(document, content='\n\n'.join(replaced))
+
+        with mock.patch.object(EmbeddingService, 'embed_chunks', side_effect=RuntimeError('API down')):
+            with self.assertRaises(RuntimeError):
+                self.pipeline.process_document(Document.objects.get(id=document.id))
+        chunks = list(DocumentChunk.objects.filter(document=document).with_text().order_by('chunk_index'))
+        self.assertEqual([chunk.text for chunk in chunks], self.paragraphs)
+        self.assertEqual([chunk.materialized_text for chunk in chunks], self.paragraphs)
+
+        self.pipeline.process_document(Document.objects.get(id=document.id))
+        chunks = list(DocumentChunk.objects.filter(document=document).with_text().order_by('chunk_index'))
+        self.assertEqual([chunk.materialized_text for chunk in chunks], replaced)
+        self.assertEqual([chunk.content for chunk in chunks], [''] * len(chunks))
+
+    def test_compact_chunks_converts_stored_text(self):
+        """Test that chunks stored with their own text are rewritten as offsets"""
+        from django.core.management import call_command
+        with override_settings(RAG_CHUNK_STORAGE='content'):
+            document = self.pipeline.process_text_document('lease', '\n\n'.join(self.paragraphs))
+        self.assertEqual([chunk.content for chunk in document.chunks.all()], self.paragraphs)
+
+        call_command('compact_chunks', stdout=open(os.devnull, 'w'))
+
+        chunks = list(document.chunks.all())
+        self.assertEqual([chunk.content for chunk in chunks], [''] * len(chunks))
+        self.assertEqual([chunk.text for chunk in chunks], self.paragraphs)
+
+
+@override_settings(RAG_EMBEDDING_PROVIDER='local', RAG_VECTOR_SHARDS_ENABLED=False)
+class UploadDeduplicationTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media_root = directory.name
+
+        from docx import Document as DocxDocument
+        docx = DocxDocument()
+        for i in range(5):
+            docx.add_paragraph(f"Clause {i}: the supplier delivers within {i + 10} days.")
+        self.path = os.path.join(directory.name, 'terms.docx')
+        docx.save(self.path)
+
+    def _upload(self, session_id):
+        with open(self.path, 'rb') as upload:
+            return self.client.post('/api/rag/upload/', {'file': upload, 'session_id': session_id})
+
+    def test_identical_upload_reuses_blob_text_and_embeddings(self):
+        """Test that a re-uploaded file is stored once and indexed without re-processing"""
+        first = self._upload('s1')
+        self.assertEqual(first.status_code, 202)
+        with mock.patch.object(TextChunker, 'chunk_text') as chunk_text:
+            IngestionWorker(pipeline=RAGPipeline()).run_pending()
+        # The file is chunked as its blocks are extracted
+        chunk_text.assert_not_called()
+
+        with mock.patch('rag_pipeline.services.embedding_providers.LocalEmbeddingProvider.embed') as embed, \
+                mock.patch.object(DocumentProcessor, 'iter_docx_blocks') as extract:
+            second = self._upload('s2')
+        self.assertEqual((second.status_code, second.json()['status'], second.json()['job_id']), (202, 'indexed', None))
+        embed.assert_not_called()
+        extract.assert_not_called()
+
+        original = Document.objects.get(id=first.json()['document_id'])
+        copy = Document.objects.get(id=second.json()['document_id'])
+        self.assertEqual((copy.status, copy.file_path, copy.content), ('indexed', original.file_path, original.content))
+        self.assertEqual(len(original.content_sha256), 64)
+        self.assertEqual(
+            [(chunk.text, bytes(chunk.embedding_data)) for chunk in copy.chunks.all()],
+            [(chunk.text, bytes(chunk.embedding_data)) for chunk in original.chunks.all()],
+        )
+        blobs = [name for _, _, names in os.walk(os.path.join(self.media_root, 'uploads')) for name in names]
+        self.assertEqual(blobs, [f"{original.content_sha256}.docx"])
+        results = RAGPipeline().get_similar_chunks_internal('supplier delivers', session_id='s2')
+        self.assertTrue(results and all(result['document_id'] == str(copy.id) for result in results))
+
+
+class UploadStorageTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media_root = directory.name
+
+    def test_upload_is_read_in_bounded_chunks(self):
+        """Test that an upload is hashed, sniffed and stored without ever being read whole"""
+        import hashlib
+        import io
+        from django.core.files import File
+        from .services.upload_storage import store_upload, UPLOAD_CHUNK_SIZE
+        data = b'%PDF-1.7\n' + os.urandom(3 * UPLOAD_CHUNK_SIZE)
+        stream = io.BytesIO(data)
+        upload = File(stream, name='report.pdf')
+
+        with mock.patch.object(stream, 'read', wraps=stream.read) as read:
+            stored = store_upload(upload, expected_type='pdf')
+
+        self.assertTrue(all(0 <= call.args[0] <= UPLOAD_CHUNK_SIZE for call in read.call_args_list))
+        self.assertEqual((stored.sha256, stored.size, stored.file_type), (hashlib.sha256(data).hexdigest(), len(data), 'pdf'))
+        with open(os.path.join(self.media_root, stored.path), 'rb') as blob:
+            self.assertEqual(blob.read(), data)
+
+    def test_spooled_upload_is_moved_and_mislabelled_upload_refused(self):
+        """Test that an upload already on disk is moved into storage and content not matching its extension is refused"""
+        from django.core.files.uploadedfile import TemporaryUploadedFile
+        from .services.upload_storage import store_upload
+        upload = TemporaryUploadedFile('contract.docx', 'application/octet-stream', 0, None)
+        upload.write(b'PK\x03\x04' + b'0' * 5000)
+        upload.flush()
+        spooled = upload.temporary_file_path()
+
+        stored = store_upload(upload, expected_type='docx')
+        upload.close()
+        self.assertFalse(os.path.exists(spooled))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, stored.path)))
+
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as fake:
+            fake.write(b'<html>not a pdf</html>')
+            fake.seek(0)
+            with self.assertRaises(ValueError):
+                RAGPipeline().create_file_document('fake.pdf', fake)
+        self.assertFalse(Document.objects.exists())
+        blobs = [name for _, _, names in os.walk(os.path.join(self.media_root, 'uploads')) for name in names]
+        self.assertEqual(len(blobs), 1)
+
+    def test_concurrent_store_and_delete_of_a_blob(self):
+        """Test that a blob another upload stored first keeps its content-addressed name, and a just-reused blob survives deletion"""
+        import io
+        from django.core.files import File
+        from django.core.files.storage import default_storage
+        from .services.upload_storage import store_upload, delete_if_unreferenced
+        data = b'%PDF-1.7\n' + b'0' * 100
+        first = store_upload(File(io.BytesIO(data), name='a.pdf'))
+
+        # The second upload checks for the blob before the first one has saved it
+        exists = default_storage.exists
+        checks = iter([False])
+        with mock.patch.object(default_storage, 'exists', side_effect=lambda name: next(checks, exists(name))), \
+                mock.patch.object(default_storage, 'delete', wraps=default_storage.delete) as delete:
+            second = store_upload(File(io.BytesIO(data), name='b.pdf'))
+        self.assertEqual(second.path, first.path)
+        self.assertNotEqual(delete.call_args.args[0], first.path)
+        blobs = [name for _, _, names in os.walk(os.path.join(self.media_root, 'uploads')) for name in names]
+        self.assertEqual(len(blobs), 1)
+
+        # The document about to refer to the reused blob is not saved yet
+        old = time.time() - 7200
+        os.utime(default_storage.path(first.path), (old, old))
+        reused = store_upload(File(io.BytesIO(data), name='c.pdf'))
+        self.assertFalse(delete_if_unreferenced(reused.path))
+        self.assertTrue(default_storage.exists(reused.path))
+
+        os.utime(default_storage.path(first.path), (old, old))
+        self.assertTrue(delete_if_unreferenced(reused.path))
+        self.assertFalse(default_storage.exists(reused.path))
+
+
+@override_settings(RAG_EMBEDDING_PROVIDER='local', RAG_EMBEDDING_CACHE_ENABLED=False, RAG_VECTOR_SHARDS_ENABLED=False)
+class BulkUploadTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.directory = directory.name
+
+    def _docx(self, name, topic):
+        from docx import Document as DocxDocument
+        docx = DocxDocument()
+        for i in range(3):
+            docx.add_paragraph(f"{topic} note {i} for the onboarding handbook.")
+        path = os.path.join(self.directory, name)
+        docx.save(path)
+        return path
+
+    def test_files_and_archives_are_queued_and_processed_together(self):
+        """Test that loose files and zip members are queued, then extracted in parallel and embedded in shared batches"""
+        import zipfile
+        archive = os.path.join(self.directory, 'handbook.zip')
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.write(self._docx('travel.docx', 'Travel'), 'policies/travel.docx')
+            zf.writestr('policies/holidays.txt', 'Holidays are booked two weeks ahead.')
+            zf.writestr('tools/setup.exe', b'MZ')
+            zf.writestr('__MACOSX/policies/._travel.docx', b'')
+        paths = [self._docx('security.docx', 'Security'), archive]
+
+        embed_chunks = EmbeddingService.embed_chunks
+        with override_settings(RAG_BULK_EXTRACT_WORKERS=2), \
+                mock.patch.object(EmbeddingService, 'embed_chunks', autospec=True, side_effect=embed_chunks) as embed:
+            with open(paths[0], 'rb') as security, open(paths[1], 'rb') as handbook:
+                response = self.client.post('/api/rag/upload/bulk/', {'files': [security, handbook], 'session_id': 's1'})
+            embed.assert_not_called()
+
+            self.assertEqual(response.status_code, 202)
+            body = response.json()
+            self.assertEqual(
+                [(result['name'], result['status']) for result in body['documents']],
+                [('security.docx', 'queued'), ('travel.docx', 'queued'), ('holidays.txt', 'queued'), ('setup.exe', 'rejected')]
+            )
+            self.assertEqual((body['queued'], body['rejected']), (3, 1))
+            self.assertEqual(IngestionWorker(pipeline=RAGPipeline()).run_pending(), 3)
+
+        embed.assert_called_once()
+        self.assertEqual(len(embed.call_args.args[1]), DocumentChunk.objects.count())
+        for result in body['documents'][:3]:
+            status = self.client.get(result['status_url']).json()
+            self.assertEqual((status['status'], status['stage']), ('succeeded', 'done'))
+        travel = Document.objects.get(id=body['documents'][1]['document_id'])
+        self.assertEqual((travel.status, travel.session_id), ('indexed', 's1'))
+        self.assertIn('Travel note 2', travel.content)
+        results = RAGPipeline().get_similar_chunks_internal('Holidays booked', top_k=1, session_id='s1')
+        self.assertEqual(results[0]['document_name'], 'holidays.txt')
+
+    def test_text_files_are_stored_like_other_uploads(self):
+        """Test that a text file is streamed to blob storage, read from there when processed, and deduplicated"""
+        from django.core.files.storage import default_storage
+        path = os.path.join(self.directory, 'holidays.txt')
+        with open(path, 'wb') as f:
+            f.write('Holidays are booked two weeks ahead.\r\nCafé hours vary.\n'.encode('utf-8'))
+
+        with open(path, 'rb') as upload:
+            first = self.client.post('/api/rag/upload/bulk/', {'files': [upload]}).json()['documents'][0]
+        document = Document.objects.get(id=first['document_id'])
+        self.assertEqual((first['status'], document.file_type, document.content), ('queued', 'text', None))
+        with default_storage.open(document.file_path) as blob, open(path, 'rb') as f:
+            self.assertEqual(blob.read(), f.read())
+
+        IngestionWorker(pipeline=RAGPipeline()).run_pending()
+        document.refresh_from_db()
+        self.assertEqual((document.status, document.content),
+                         ('indexed', 'Holidays are booked two weeks ahead.\r\nCafé hours vary.'))
+
+        with open(path, 'rb') as upload:
+            second = self.client.post('/api/rag/upload/bulk/', {'files': [upload]}).json()['documents'][0]
+        self.assertEqual(second['status'], 'indexed')
+        self.assertEqual(Document.objects.get(id=second['document_id']).file_path, document.file_path)
+
+    def test_corrupt_archive_member_is_rejected_alone(self):
+        """Test that a member failing its CRC check is rejected and the other files are still queued"""
+        import zipfile
+        archive = os.path.join(self.directory, 'notes.zip')
+        with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_STORED) as zf:
+            zf.writestr('broken.txt', 'This member is corrupted after writing.')
+            zf.writestr('intact.txt', 'This member reads back fine.')
+        with open(archive, 'r+b') as f:
+            data = f.read()
+            f.seek(data.index(b'corrupted'))
+            f.write(b'CORRUPTED')
+
+        with open(archive, 'rb') as upload:
+            response = self.client.post('/api/rag/upload/bulk/', {'files': [upload]})
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(
+            [(result['name'], result['status']) for result in response.json()['documents']],
+            [('broken.txt', 'rejected'), ('intact.txt', 'queued')]
+        )
+        self.assertEqual(list(Document.objects.values_list('name', flat=True)), ['intact.txt'])
+        self.assertEqual(IngestionJob.objects.count(), 1)
+
+    def test_too_many_files_are_refused(self):
+        """Test that a bulk upload over the file limit is rejected before anything is stored"""
+        path = self._docx('security.docx', 'Security')
+        with override_settings(RAG_BULK_UPLOAD_MAX_FILES=1), open(path, 'rb') as first, open(path, 'rb') as second:
+            response = self.client.post('/api/rag/upload/bulk/', {'files': [first, second]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Document.objects.exists())
+
+
+class StartupImportTests(SimpleTestCase):
+    # Seconds a fresh process may take to set Django up and load every URL's views
+    STARTUP_BUDGET = 2.0
+    # Imported on first use only: each costs from tens of milliseconds to seconds
+    DEFERRED_MODULES = ('openai', 'opik', 'weasyprint', 'fitz', 'lxml.etree', 'langchain_text_splitters')
+
+    def test_startup_defers_heavy_imports(self):
+        """Test that setting Django up and resolving the URLs stays within budget without loading SDKs or parsers"""
+        script = (
+            "import json, sys, time\n"
+            "started = time.perf_counter()\n"
+            "import django\n"
+            "django.setup()\n"
+            "from django.urls import resolve\n"
+            "resolve('/api/rag/upload/', urlconf='Wordy.urls')\n"
+            "resolve('/api/template/generate_doc/', urlconf='Wordy.urls')\n"
+            "print(json.dumps([time.perf_counter() - started, sorted(sys.modules)]))\n"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=60
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        elapsed, modules = json.loads(result.stdout.splitlines()[-1])
+        self.assertEqual([name for name in self.DEFERRED_MODULES if name in modules], [])
+        self.assertLess(elapsed, self.STARTUP_BUDGET)
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def _store(self, path, age=0):
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+
+        path = default_storage.save(path, ContentFile(b'%PDF-1.4 ' + path.encode()))
+        modified = time.time() - age
+        os.utime(default_storage.path(path), (modified, modified))
+        return path
+
+    def test_sweep_deletes_expired_session_documents_without_loading_chunks(self):
+        """Test that expired session documents go with their chunks and unshared files, and nothing else does"""
+        from django.core.files.storage import default_storage
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .services.retention import sweep_expired_sessions
+
+        own, shared = self._store('uploads/blobs/aa/own.pdf', age=7200), self._store('uploads/blobs/bb/shared.pdf', age=7200)
+        expired = _create_document_with_chunks('expired', [[1.0, 0.0]] * 3, session_id='s1', file_path=own)
+        sharing = _create_document_with_chunks('sharing', [[1.0, 0.0]], session_id='s1', file_path=shared)
+        ingesting = _create_document_with_chunks('ingesting', [[1.0, 0.0]], session_id='s1')
+        IngestionJob.objects.create(document=ingesting, status=IngestionJob.STATUS_RUNNING)
+        fresh = _create_document_with_chunks('fresh', [[1.0, 0.0]], session_id='s2', file_path=shared)
+        template_document = _create_document_with_chunks('template', [[1.0, 0.0]], template=Template.objects.create(name='T', lexical_json={}))
+        Document.objects.exclude(id=fresh.id).update(updated_at=timezone.now() - timedelta(hours=25))
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            deleted = sweep_expired_sessions(ttl=24 * 3600, batch_size=1)
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(
+            set(Document.objects.values_list('name', flat=True)), {'ingesting', 'fresh', template_document.name}
+        )
+        self.assertFalse(DocumentChunk.objects.filter(document_id__in=[expired.id, sharing.id]).exists())
+        self.assertFalse(default_storage.exists(own))
+        self.assertTrue(default_storage.exists(shared))
+        chunk_table = DocumentChunk._meta.db_table
+        self.assertFalse([query['sql'] for query in queries if query['sql'].startswith('SELECT') and chunk_table in query['sql']])
+        self.assertFalse([query['sql'] for query in queries if 'content' in query['sql'].split('FROM')[0]])
+
+    def test_delete_context_removes_stored_file(self):
+        """Test that deleting a document through the API deletes its stored file"""
+        from django.core.files.storage import default_storage
+
+        path = self._store('uploads/blobs/cc/report.pdf', age=7200)
+        document = _create_document_with_chunks('report', [[1.0, 0.0]], file_path=path)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/api/rag/delete/{document.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(default_storage.exists(path))
+
+    def test_storage_gc_deletes_old_unreferenced_uploads(self):
+        """Test that only unreferenced upload files past the grace period are collected"""
+        from django.core.files.storage import default_storage
+        from .services.retention import collect_orphaned_uploads
+
+        referenced = self._store('uploads/blobs/dd/referenced.pdf', age=7200)
+        orphaned = self._store('uploads/3f2c_legacy.pdf', age=7200)
+        recent = self._store('uploads/blobs/ee/recent.pdf')
+        _create_document_with_chunks('referenced', [[1.0, 0.0]], file_path=referenced)
+
+        result = collect_orphaned_uploads(grace=3600, dry_run=True, batch_size=2)
+        self.assertEqual((result.deleted, result.bytes, result.kept), (1, default_storage.size(orphaned), 2))
+        self.assertTrue(default_storage.exists(orphaned))
+
+        result = collect_orphaned_uploads(grace=3600, batch_size=2)
+        self.assertEqual(result.deleted, 1)
+        self.assertEqual([default_storage.exists(path) for path in (referenced, orphaned, recent)], [True, False, True])
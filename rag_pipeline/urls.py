@@ -1,12 +1,16 @@
 from django.urls import path
-from .views import upload_context, list_context, delete_context, cleanup_session
+from .views import upload_context, bulk_upload_context, replace_context, ingestion_status, list_context, delete_context, cleanup_session, cache_stats
 
 app_name = 'rag_pipeline'
 
 urlpatterns = [
     # Context management endpoints (internal RAG pipeline)
     path('upload/', upload_context, name='upload_context'),
+    path('upload/bulk/', bulk_upload_context, name='bulk_upload_context'),
+    path('replace/<uuid:document_id>/', replace_context, name='replace_context'),
+    path('jobs/<uuid:job_id>/', ingestion_status, name='ingestion_status'),
     path('list/', list_context, name='list_context'),
     path('delete/<uuid:document_id>/', delete_context, name='delete_context'),
     path('cleanup/<str:session_id>/', cleanup_session, name='cleanup_session'),
+    path('stats/', cache_stats, name='cache_stats'),
 ] 
\ No newline at end of file
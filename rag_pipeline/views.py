@@ -4,8 +4,14 @@ import uuid
 from django.http import JsonResponse, HttpResponseNotAllowed
 from django.views.decorators.csrf import csrf_exempt
 from django.core.exceptions import ObjectDoesNotExist
-from .models import Document
+from django.urls import reverse
+from django.db import transaction
+from .models import Document, IngestionJob
 from .services.rag_pipeline import RAGPipeline
+from .services.ingestion_jobs import enqueue_document, job_status
+from .services.upload_storage import iter_upload_files
+from .services.embedding_cache import EmbeddingCache, query_embedding_cache
+from .services.retention import delete_documents
 
 
 def _validate_uuid(uuid_string):
@@ -24,8 +30,9 @@ def _validate_uuid(uuid_string):
 @csrf_exempt
 def upload_context(request):
     """
-    POST: Upload and process a document (PDF, DOCX, or text) for internal RAG pipeline
+    POST: Upload a document (PDF, DOCX, or text) and queue it for processing by the internal RAG pipeline
     Body: Form data with 'file' (for file uploads) or 'content' (for text), 'name', 'template_id', and 'session_id'
+    Returns 202 with the ingestion job id; the document is used for generation once the job has succeeded
     """
     if request.method != 'POST':
         return HttpResponseNotAllowed(['POST'])
@@ -48,36 +55,163 @@ def upload_context(request):
         
         # Check if it's a file upload or text content
         if 'file' in request.FILES:
-            # File upload (PDF, DOCX)
+            # File upload (PDF, DOCX, TXT)
             file_obj = request.FILES['file']
             name = request.POST.get('name', file_obj.name)
             
-            document = rag_pipeline.process_file_document(name, file_obj, str(validated_template_id) if validated_template_id else None, session_id)
+            document = rag_pipeline.create_file_document(name, file_obj, str(validated_template_id) if validated_template_id else None, session_id)
             
         elif 'content' in request.POST:
             # Text content
             content = request.POST['content']
             name = request.POST.get('name', 'Text Document')
             
-            document = rag_pipeline.process_text_document(name, content, str(validated_template_id) if validated_template_id else None, session_id)
+            document = rag_pipeline.create_text_document(name, content, str(validated_template_id) if validated_template_id else None, session_id)
             
         else:
             return JsonResponse({'error': 'Either file or content must be provided'}, status=400)
 
+        # A file that was already ingested with the same settings is indexed
+        # immediately; the response has the same shape and status code as a
+        # queued upload, without a job
+        if rag_pipeline.reuse_existing_ingestion(document):
+            return JsonResponse({
+                'status': 'indexed',
+                'job_id': None,
+                'status_url': None,
+                'document_id': str(document.id),
+                'name': document.name,
+                'file_type': document.file_type,
+                'template_id': str(document.template_id) if document.template_id else None,
+                'session_id': document.session_id,
+                'created_at': document.created_at.isoformat(),
+                'message': 'Context document processed successfully'
+            }, status=202)
+
+        job = enqueue_document(document)
         return JsonResponse({
+            'status': 'queued',
+            'job_id': str(job.id),
+            'status_url': reverse('rag_pipeline:ingestion_status', args=[job.id]),
             'document_id': str(document.id),
             'name': document.name,
             'file_type': document.file_type,
-            'template_id': str(document.template.id) if document.template else None,
+            'template_id': str(document.template_id) if document.template_id else None,
             'session_id': document.session_id,
             'created_at': document.created_at.isoformat(),
-            'message': 'Context document processed successfully'
-        }, status=201)
+            'message': 'Context document queued for processing'
+        }, status=202)
+
+    except Exception as e:
+        return JsonResponse({'error': f"Context processing failed: {str(e)}"}, status=500)
+
+
+@csrf_exempt
+def bulk_upload_context(request):
+    """
+    POST: Upload many documents in one request and queue them for processing
+    Body: Multipart form data with one or more 'files' (PDF, DOCX, TXT, or ZIP archives of them), 'template_id', and 'session_id'
+    Returns 202 with a result per file: its ingestion job, or why it was rejected. Workers take queued jobs in batches,
+    extracting the files in parallel and embedding their chunks together
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    template_id = request.POST.get('template_id')
+    session_id = request.POST.get('session_id')
+    if template_id:
+        try:
+            template_id = str(_validate_uuid(template_id))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+    uploads = request.FILES.getlist('files')
+    if not uploads:
+        return JsonResponse({'error': 'At least one file must be provided'}, status=400)
+
+    try:
+        files = list(iter_upload_files(uploads))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    rag_pipeline = RAGPipeline()
+    results = []
+    for name, file_obj in files:
+        result = {'document_id': None, 'name': name, 'status': 'rejected', 'job_id': None, 'status_url': None, 'error': None}
+        try:
+            # A file is only kept once its document is queued or indexed
+            with transaction.atomic():
+                document = rag_pipeline.create_file_document(name, file_obj, template_id, session_id)
+                if rag_pipeline.reuse_existing_ingestion(document):
+                    result['status'] = 'indexed'
+                else:
+                    job = enqueue_document(document)
+                    result.update(
+                        status='queued', job_id=str(job.id),
+                        status_url=reverse('rag_pipeline:ingestion_status', args=[job.id])
+                    )
+            result['document_id'] = str(document.id)
+        except Exception as e:
+            # Bad archive members and the like reject their file, not the whole upload
+            result['error'] = str(e)
+        results.append(result)
+
+    return JsonResponse({
+        'documents': results,
+        'queued': sum(1 for result in results if result['status'] == 'queued'),
+        'indexed': sum(1 for result in results if result['status'] == 'indexed'),
+        'rejected': sum(1 for result in results if result['status'] == 'rejected'),
+    }, status=202)
+
+
+@csrf_exempt
+def replace_context(request, document_id):
+    """
+    POST: Replace a context document's file or text and queue it for re-processing
+    Body: Form data with 'file' (for file uploads) or 'content' (for text)
+    Only chunks whose content changed are re-embedded; the current chunks stay in use until the job succeeds
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
 
+    try:
+        document = Document.objects.get(id=document_id)
+    except ObjectDoesNotExist:
+        return JsonResponse({'error': 'Context document not found'}, status=404)
+
+    if 'file' not in request.FILES and 'content' not in request.POST:
+        return JsonResponse({'error': 'Either file or content must be provided'}, status=400)
+
+    try:
+        document = RAGPipeline().replace_document_source(
+            document, file_obj=request.FILES.get('file'), content=request.POST.get('content')
+        )
+        job = enqueue_document(document)
+        return JsonResponse({
+            'job_id': str(job.id),
+            'status_url': reverse('rag_pipeline:ingestion_status', args=[job.id]),
+            'document_id': str(document.id),
+            'name': document.name,
+            'message': 'Context document queued for re-processing'
+        }, status=202)
     except Exception as e:
         return JsonResponse({'error': f"Context processing failed: {str(e)}"}, status=500)
 
 
+def ingestion_status(request, job_id):
+    """
+    GET: Report an ingestion job's status, stage (extracting, chunking, embedding, indexing) and progress
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    try:
+        job = IngestionJob.objects.get(id=job_id)
+    except ObjectDoesNotExist:
+        return JsonResponse({'error': 'Ingestion job not found'}, status=404)
+    return JsonResponse(job_status(job))
+
+
 def list_context(request):
     """
     GET: List all processed context documents, optionally filtered by template_id
@@ -102,7 +236,7 @@ def list_context(request):
         if session_id:
             documents = documents.filter(session_id=session_id)
             
-        documents = documents.values('id', 'name', 'file_type', 'template_id', 'session_id', 'created_at')
+        documents = documents.values('id', 'name', 'file_type', 'template_id', 'session_id', 'status', 'created_at')
         return JsonResponse({'documents': list(documents)})
     except Exception as e:
         return JsonResponse({'error': f"Failed to list context documents: {str(e)}"}, status=500)
@@ -124,7 +258,7 @@ def delete_context(request, document_id):
             return JsonResponse({'error': str(e)}, status=400)
         
         document = Document.objects.get(id=validated_document_id)
-        document.delete()  # This will cascade delete chunks due to ForeignKey relationship
+        document.delete()  # Cascades to chunks; the stored file is deleted once unreferenced
         
         return JsonResponse({'message': f'Context document {document.name} deleted successfully'})
     except ObjectDoesNotExist:
@@ -148,7 +282,7 @@ def cleanup_session(request, session_id):
         print(f"🔧 CLEANUP: Found {count} documents for session {session_id}")
         
         if count > 0:
-            documents.delete()  # This will cascade delete chunks
+            delete_documents(documents)  # Chunks, jobs and stored files go with them
             print(f"🔧 CLEANUP: Successfully deleted {count} documents for session {session_id}")
         else:
             print(f"🔧 CLEANUP: No documents found for session {session_id}")
@@ -160,3 +294,19 @@ def cleanup_session(request, session_id):
     except Exception as e:
         print(f"🔧 CLEANUP: Error cleaning up session {session_id}: {str(e)}")
         return JsonResponse({'error': f"Failed to cleanup session: {str(e)}"}, status=500)
+
+
+def cache_stats(request):
+    """
+    GET: Report this worker's embedding cache and OpenAI connection pool counters
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    from .services.openai_client import http_client_stats
+
+    return JsonResponse({
+        'chunk_embedding_cache': EmbeddingCache.stats(),
+        'query_embedding_cache': query_embedding_cache.stats(),
+        'openai_http_pool': http_client_stats(),
+    })
@@ -1,8 +1,7 @@
 import os
 import logging
-from openai import OpenAI
-from opik.integrations.openai import track_openai
 from dotenv import load_dotenv
+from django.conf import settings
 
 # Load .env
 load_dotenv()
@@ -14,8 +13,21 @@ logger = logging.getLogger(__name__)
 os.environ["OPIK_API_KEY"] = os.getenv("OPIK_API_KEY", "")
 os.environ["OPIK_WORKSPACE"] = os.getenv("OPIK_WORKSPACE", "")
 
-# Wrap client
-openai_client = track_openai(OpenAI())
+def _track(client):
+    from opik.integrations.openai import track_openai
+    return track_openai(client)
+
+
+def get_openai_client():
+    """
+    The Opik-tracked OpenAI client, on the process's shared connection pool
+
+    openai and opik are imported on the first call: importing them takes
+    seconds, which every process would otherwise pay at startup.
+    """
+    from rag_pipeline.services.openai_client import get_openai_client as shared_openai_client
+    return shared_openai_client(wrapper=_track)
+
 
 def call_llm(prompt, context_info=None):
     """
@@ -52,10 +64,13 @@ def call_llm(prompt, context_info=None):
     else:
         logger.info("🔍 RAG DEBUG: No context provided for LLM call")
     
+    from rag_pipeline.services.openai_client import request_timeout
+
     try:
-        response = openai_client.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": full_prompt}],
+            timeout=request_timeout(settings.OPENAI_CHAT_TIMEOUT),
         )
         content = response.choices[0].message.content
         logger.info(f"🔍 RAG DEBUG: LLM response length: {len(content) if content else 0} characters")
@@ -4,8 +4,6 @@ This replaces the DOCX generator with a more flexible HTML-based approach.
 """
 
 import io
-from weasyprint import HTML, CSS
-from weasyprint.text.fonts import FontConfiguration
 from .html_generator import build_html
 from typing import Optional
 
@@ -37,6 +35,10 @@ def generate_pdf_from_html(html_content: str) -> io.BytesIO:
     Returns:
         BytesIO buffer containing the PDF
     """
+    # WeasyPrint and its native libraries are loaded on the first PDF, not at startup
+    from weasyprint import HTML
+    from weasyprint.text.fonts import FontConfiguration
+
     # Configure fonts
     font_config = FontConfiguration()
     
@@ -69,6 +71,10 @@ def generate_pdf_with_custom_css(html_content: str, custom_css: Optional[str] =
     Returns:
         BytesIO buffer containing the PDF
     """
+    # WeasyPrint and its native libraries are loaded on the first PDF, not at startup
+    from weasyprint import HTML, CSS
+    from weasyprint.text.fonts import FontConfiguration
+
     # Configure fonts
     font_config = FontConfiguration()
     
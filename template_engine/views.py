@@ -204,6 +204,7 @@ def generate_document(request):
         template_id = data.get('template_id')
         context_map = data.get('context_map', {})
         prompt_map = data.get('prompt_map', {})
+        session_id = data.get('session_id')
         
         if not template_id:
             return JsonResponse({'error': 'template_id is required'}, status=400)
@@ -235,7 +236,9 @@ def generate_document(request):
         # Get context documents associated with this template
         context_info = []
         try:
-            documents = Document.objects.filter(template=template)
+            documents = Document.objects.filter(template=template, status='indexed')
+            if session_id:
+                documents = documents.filter(session_id=session_id)
             logger.info(f"🔍 RAG DEBUG: Found {documents.count()} context documents for template")
             
             if documents.exists():
@@ -264,23 +267,15 @@ def generate_document(request):
                     search_queries = ["general information", "context", "background"]
                     logger.info("🔍 RAG DEBUG: No specific queries found, using general search terms")
                 
-                # Get relevant chunks for each search query
-                all_relevant_chunks = []
-                for query in search_queries:
-                    logger.info(f"🔍 RAG DEBUG: Searching for chunks relevant to: {query[:50]}...")
-                    relevant_chunks = rag_pipeline.get_similar_chunks_internal(query, top_k=3)
-                    logger.info(f"🔍 RAG DEBUG: Found {len(relevant_chunks)} relevant chunks for query")
-                    
-                    for chunk in relevant_chunks:
-                        # Check if this chunk is already in our list (avoid duplicates)
-                        chunk_id = chunk['chunk_id']
-                        if not any(c.get('chunk_id') == chunk_id for c in all_relevant_chunks):
-                            all_relevant_chunks.append(chunk)
-                            logger.info(f"🔍 RAG DEBUG: Added chunk {chunk_id} from {chunk['document_name']} (similarity: {chunk['similarity_score']:.3f})")
-                
-                # Sort by similarity score and take top results
-                all_relevant_chunks.sort(key=lambda x: x['similarity_score'], reverse=True)
-                context_info = all_relevant_chunks[:10]  # Limit to top 10 most relevant chunks
+                # Embed all queries in one call and score them in one pass over
+                # the template's chunks, keeping each chunk once at its best rank
+                logger.info(f"🔍 RAG DEBUG: Searching for chunks relevant to {len(search_queries)} queries")
+                context_info = rag_pipeline.get_similar_chunks_multi(
+                    search_queries, top_k=3, limit=10,  # Limit to top 10 most relevant chunks
+                    template_id=str(template.id), session_id=session_id
+                )
+                for chunk in context_info:
+                    logger.info(f"🔍 RAG DEBUG: Added chunk {chunk['chunk_id']} from {chunk['document_name']} (similarity: {chunk['similarity_score']:.3f})")
                 
                 logger.info(f"🔍 RAG DEBUG: Final context info contains {len(context_info)} unique chunks")
                 